@@ -0,0 +1,249 @@
+"""
+Microbenchmarks for the prediction, loading and training hot paths
+
+Run from the model directory:
+
+    python benchmarks.py run --output benchmark_results.json
+    python benchmarks.py compare baseline.json benchmark_results.json
+
+Formulations are synthetic and generated from a fixed seed, so two runs on
+the same machine time the same work. compare exits with status 1 when a
+benchmark's median got slower than the baseline by more than the threshold.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+import numpy as np
+
+SEED = 0
+# Benchmarks are repeated this many times; fast ones run enough calls per
+# repeat to take at least MIN_REPEAT_SECONDS
+REPEAT = 5
+MIN_REPEAT_SECONDS = 0.2
+DEFAULT_THRESHOLD = 0.10
+BATCH_SIZES = [1, 10, 1000]
+
+
+def synthetic_formulations(model_set, count, seed=SEED):
+    """
+    Generate formulations resembling the workbook recipes
+
+    Each uses 8 to 15 random raw materials of the formulation matrix, with
+    amounts drawn up to the largest amount of that material in any recipe.
+    """
+    rng = np.random.default_rng(seed)
+    materials = model_set.formulation_matrix.columns.tolist()
+    max_amounts = model_set.formulation_matrix.max(axis=0).to_numpy()
+    formulations = []
+    for _ in range(count):
+        used = rng.choice(len(materials), size=rng.integers(8, 16), replace=False)
+        formulations.append({
+            materials[i]: round(float(rng.uniform(0.1, 1.0) * max(max_amounts[i], 1.0)), 3) for i in used
+        })
+    return formulations
+
+
+def time_call(func, repeat=REPEAT, number=None):
+    """
+    Time func() and return per-call statistics in seconds
+
+    number is the calls per repeat; when None it is chosen so one repeat
+    takes at least MIN_REPEAT_SECONDS.
+    """
+    timer = timeit.Timer(func)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < MIN_REPEAT_SECONDS and number < 1_000_000:
+            number *= 2
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def run_benchmarks(selected=None):
+    """Run every benchmark whose name contains one of the selected substrings (all if None)"""
+    import main
+    import compound_predictor
+
+    def wanted(name):
+        return selected is None or any(s in name for s in selected)
+
+    results = {}
+
+    def record(name, func, **kwargs):
+        if not wanted(name):
+            return
+        # The code under test prints progress; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = time_call(func, **kwargs)
+        print(f"{name:<40} median {results[name]['median'] * 1e3:10.3f} ms")
+
+    # load_data with the columnar dataset cache (warmed first) and with every
+    # call parsing the workbook, whatever USE_DATASET_CACHE says
+    use_dataset_cache = main.USE_DATASET_CACHE
+    try:
+        for label, use_cache in (("cached", True), ("uncached", False)):
+            name = f"load_data[{label}]"
+            if not wanted(name):
+                continue
+            main.USE_DATASET_CACHE = use_cache
+            if use_cache:
+                main.load_dataset(main.EXCEL_FILE, use_cache=True)
+            record(name, main.load_data, repeat=3, number=1)
+    finally:
+        main.USE_DATASET_CACHE = use_dataset_cache
+    with contextlib.redirect_stdout(io.StringIO()):
+        if main.active_model_set.version is None:
+            main.load_data()
+    model_set = main.active_model_set
+
+    # Measure the model path, not the prediction and contribution caches
+    for cache in (main.prediction_cache, main.contribution_cache):
+        cache.maxsize = 0
+        cache.clear()
+
+    formulations = synthetic_formulations(model_set, max(BATCH_SIZES))
+    record("predict_new_formulation[1]", lambda: main.predict_new_formulation(model_set, formulations[0]))
+    for size in BATCH_SIZES:
+        batch = formulations[:size]
+        record(f"predict_formulations[{size}]", lambda batch=batch: main.predict_formulations(model_set, batch))
+
+    # Full /predict response bodies; TreeSHAP contributions should at most double the cost
+    without_contributions = [
+        field for field in main.PREDICTION_FIELDS if field not in ("materialImpacts", "materialContributions")
+    ]
+    record("run_prediction[no_contributions]",
+           lambda: main.run_prediction(formulations[0], fields=without_contributions))
+    record("run_prediction[contributions]", lambda: main.run_prediction(formulations[0]))
+
+    # Slider-style use: one material of a session's formulation moves back and forth
+    session = main.PredictionSession(model_set, formulations[0])
+    material = next(iter(formulations[0]))
+    amounts = itertools.cycle(formulations[0][material] * np.linspace(0.5, 1.5, 11))
+    record("prediction_session_update", lambda: (session.update({material: next(amounts)}), session.predict()))
+
+    predictions = main.predict_new_formulation(model_set, formulations[0])
+    registry = model_set.property_registry
+    record("extract_key_properties", lambda: main.extract_key_properties(predictions, registry))
+    record("get_recommended_uses", lambda: main.get_recommended_uses(predictions, registry))
+
+    recipe_name = model_set.recipes[0]
+    record("get_recipe_composition", lambda: main.get_recipe_composition(model_set, recipe_name))
+
+    if wanted("build_train_model"):
+        dataset = main.load_dataset(main.EXCEL_FILE, use_cache=main.USE_DATASET_CACHE)
+        test_parameter = dataset["test_params"][0]
+        X, y = compound_predictor.prepare_training_data(
+            test_parameter, dataset["evaluation_long"], dataset["formulation_matrix"]
+        )
+        record("build_train_model", lambda: compound_predictor.build_train_model(X, y, test_parameter, n_jobs=1),
+               repeat=3, number=1)
+
+    return results
+
+
+def environment():
+    """Describe the machine and library versions a result file was produced with"""
+    import pandas as pd
+    import sklearn
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scikit-learn": sklearn.__version__,
+        "seed": SEED,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two result files by median time
+
+    Returns:
+    - List of (name, baseline median, current median, ratio, status), where
+      status is "regression", "improvement", "ok" or "missing"
+    """
+    rows = []
+    for name, base in baseline["benchmarks"].items():
+        new = current["benchmarks"].get(name)
+        if new is None:
+            rows.append((name, base["median"], None, None, "missing"))
+            continue
+        ratio = new["median"] / base["median"] if base["median"] > 0 else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append((name, base["median"], new["median"], ratio, status))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks and write their results as JSON")
+    run.add_argument("--output", default="benchmark_results.json", help="Result file to write")
+    run.add_argument("--only", action="append", default=None,
+                     help="Only run benchmarks whose name contains this; may be repeated")
+
+    cmp = commands.add_parser("compare", help="Flag benchmarks that got slower than a baseline")
+    cmp.add_argument("baseline", help="Baseline result file")
+    cmp.add_argument("current", help="Result file to check")
+    cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                     help=f"Allowed slowdown of the median, as a fraction (default {DEFAULT_THRESHOLD})")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for attr in ("output", "baseline", "current"):
+        if hasattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+
+    # main.py and compound_predictor.py resolve their data files from here
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.command == "run":
+        results = {"environment": environment(), "benchmarks": run_benchmarks(args.only)}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+        sys.exit(0)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for name, base, new, ratio, status in rows:
+        new_text = f"{new * 1e3:10.3f} ms" if new is not None else f"{'-':>13}"
+        ratio_text = f"{ratio:6.2f}x" if ratio is not None else f"{'-':>7}"
+        print(f"{name:<40} {base * 1e3:10.3f} ms -> {new_text} {ratio_text}  {status}")
+
+    regressions = [row[0] for row in rows if row[4] == "regression"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions")
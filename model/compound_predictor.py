@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
+from sklearn.base import clone
+from sklearn.model_selection import KFold
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.compose import TransformedTargetRegressor
@@ -9,6 +10,17 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import joblib
 import os
+import sys
+import json
+import hashlib
+import shutil
+import time
+import argparse
+from joblib import Parallel, delayed
+from concurrent.futures import ProcessPoolExecutor
+from dataset_cache import load_dataset, preprocess_workbook
+from tree_engine import BUNDLE_FILENAME, compile_models, save_bundle
+from training_manifest import data_fingerprint, library_versions, load_manifest, plan_training, save_manifest
 
 # Load the data from Excel sheets
 def load_data(file_path):
@@ -27,140 +39,173 @@ def preprocess_data(formulation_df, evaluation_df):
     # Get the actual column names from the dataframes
     formulation_cols = formulation_df.columns.tolist()
     
-    # Process formulation data (unchanged)
-    id_cols = formulation_cols[:2]
-    recipe_names = formulation_cols[2:]
+    print(f"ID columns: {formulation_cols[:2]}")
+    print(f"Recipe names: {formulation_cols[2:]}")
     
-    print(f"ID columns: {id_cols}")
-    print(f"Recipe names: {recipe_names}")
+    dataset = preprocess_workbook(formulation_df, evaluation_df)
     
-    # Clean formulation data - replace spaces, empty strings with NaN
-    for col in recipe_names:
-        formulation_df[col] = pd.to_numeric(formulation_df[col], errors='coerce')
-    
-    # Transform formulation data from wide to long format using actual column names
-    formulation_long = pd.melt(
-        formulation_df, 
-        id_vars=id_cols,
-        value_vars=recipe_names,
-        var_name='Recipe_Name',
-        value_name='Composition_Amount'
-    )
-    
-    # Filter out rows where raw materials are not used in recipes (NaN or 0)
-    formulation_long = formulation_long.dropna(subset=['Composition_Amount'])
-    formulation_long = formulation_long[formulation_long['Composition_Amount'] > 0]
-    
-    # Get the name of the column that contains the raw material names (second column)
-    raw_material_col = id_cols[1]
-    
-    # Create the formulation matrix directly without using pivot_table
-    formulation_matrix = formulation_long.pivot(
-        index='Recipe_Name',
-        columns=raw_material_col,
-        values='Composition_Amount'
-    )
-    
-    # Fill NaN values with 0 (raw materials not used in certain recipes)
-    formulation_matrix = formulation_matrix.fillna(0)
-    
-    # Initialize test_params and evaluation_long as empty
-    test_params = []
-    evaluation_long = pd.DataFrame()
-    
-    # Only process evaluation data if it's not empty
-    if not evaluation_df.empty:
-        evaluation_cols = evaluation_df.columns.tolist()
-        # First column in evaluation_df contains test parameter names
-        test_param_col = evaluation_cols[0]
-        
-        # Clean evaluation data - replace spaces, empty strings with NaN
-        for col in evaluation_cols[1:]:
-            evaluation_df[col] = pd.to_numeric(evaluation_df[col], errors='coerce')
-        
-        # Get all test parameters
-        test_params = evaluation_df[test_param_col].tolist()
-        
-        # Transform evaluation data from wide to long format
-        evaluation_long = pd.melt(
-            evaluation_df,
-            id_vars=[test_param_col],
-            value_vars=evaluation_cols[1:],
-            var_name='Recipe_Name',
-            value_name='Test_Result'
-        )
-        
-        # Filter out rows where test was not conducted (null cells)
-        evaluation_long = evaluation_long.dropna(subset=['Test_Result'])
-    
-    return formulation_matrix, evaluation_long, test_params, formulation_df
+    return dataset["formulation_matrix"], dataset["evaluation_long"], dataset["test_params"], dataset["formulation_df"]
 
 
-def build_train_model(X, y, test_parameter):
-    """Build and train a model for a specific test parameter"""
-    # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    # Initialize models
-    models = {
+# Model selection settings: number of folds shared by all candidates, parallel
+# (candidate, fold) fits (-1 = every CPU), and the cross-validation time budget
+# per test parameter in seconds (0 = unlimited)
+CV_FOLDS = int(os.environ.get("CV_FOLDS", 5))
+CV_JOBS = int(os.environ.get("CV_JOBS", -1))
+TRAINING_TIME_BUDGET = float(os.environ.get("TRAINING_TIME_BUDGET", 0))
+
+def make_candidates():
+    """Return the model families compared for each test parameter, all fit on log1p of the target"""
+    regressors = {
         'Linear Regression': LinearRegression(),
         'Random Forest': RandomForestRegressor(n_estimators=100, random_state=42),
         'Gradient Boosting': GradientBoostingRegressor(random_state=42)
     }
+    return {
+        name: TransformedTargetRegressor(
+            regressor=regressor,
+            func=np.log1p,            # log1p handles zero
+            inverse_func=np.expm1     # undo log1p
+        )
+        for name, regressor in regressors.items()
+    }
+
+def training_config():
+    """Return everything besides the data that determines a trained model: candidate hyperparameters, CV settings and library versions"""
+    return {
+        "candidates": {name: candidate.get_params(deep=True) for name, candidate in make_candidates().items()},
+        "cv_folds": CV_FOLDS,
+        "cv_random_state": 42,
+        "time_budget": TRAINING_TIME_BUDGET,
+        "versions": library_versions(),
+    }
+
+def _fit_fold(name, candidate, X, y, fold, train_idx, test_idx):
+    """Fit a fresh copy of a candidate on one fold and predict its held-out rows"""
+    start = time.perf_counter()
+    try:
+        model = clone(candidate).fit(X.iloc[train_idx], y.iloc[train_idx])
+        y_pred = model.predict(X.iloc[test_idx])
+        # expm1 of an extrapolating linear fit can overflow
+        if not np.all(np.isfinite(y_pred)):
+            return name, fold, None, time.perf_counter() - start, "non-finite predictions"
+        return name, fold, y_pred, time.perf_counter() - start, None
+    except Exception as e:
+        return name, fold, None, time.perf_counter() - start, str(e)
+
+def build_train_model(X, y, test_parameter, n_splits=None, n_jobs=None, time_budget=None):
+    """
+    Select and train the best model family for a specific test parameter
+    
+    Every candidate is cross-validated on the same k-fold splits, with the
+    (candidate, fold) fits running in parallel. The candidate with the best
+    out-of-fold R² is refit on all rows.
+    
+    Parameters:
+    - X, y: Aligned formulation matrix rows and test results
+    - test_parameter: Test parameter name, for log output
+    - n_splits: Number of folds (default CV_FOLDS)
+    - n_jobs: Parallel fits (default CV_JOBS)
+    - time_budget: Seconds allowed for cross-validation (default TRAINING_TIME_BUDGET);
+      candidates whose folds don't all finish in time are not selected
     
-    # Train and evaluate each model
+    Returns:
+    - (best model, results) where results maps each candidate to its scores and fit times
+    """
+    n_splits = min(n_splits or CV_FOLDS, len(X))
+    n_jobs = CV_JOBS if n_jobs is None else n_jobs
+    time_budget = TRAINING_TIME_BUDGET if time_budget is None else time_budget
+    
+    candidates = make_candidates()
+    
+    # One set of fold splits, reused by every candidate
+    folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=42).split(X))
+    
+    # Out-of-fold predictions and fit times, filled as fits complete
+    oof_preds = {name: np.full(len(y), np.nan) for name in candidates}
+    fold_r2 = {name: {} for name in candidates}
+    fit_times = {name: [] for name in candidates}
+    errors = {}
+    timed_out = False
+    
+    start = time.perf_counter()
+    fits = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+        delayed(_fit_fold)(name, candidate, X, y, fold, train_idx, test_idx)
+        for name, candidate in candidates.items()
+        for fold, (train_idx, test_idx) in enumerate(folds)
+    )
+    try:
+        for name, fold, y_pred, fit_time, error in fits:
+            fit_times[name].append(fit_time)
+            if error is not None:
+                errors[name] = error
+            else:
+                test_idx = folds[fold][1]
+                oof_preds[name][test_idx] = y_pred
+                if len(test_idx) > 1:
+                    fold_r2[name][fold] = r2_score(y.iloc[test_idx], y_pred)
+            
+            if time_budget and time.perf_counter() - start > time_budget:
+                timed_out = True
+                break
+    finally:
+        # Stop any fits still queued once the budget is spent
+        fits.close()
+    
+    # Score every candidate on its pooled out-of-fold predictions
     results = {}
     best_r2 = -float('inf')
     best_model_name = None
     
-    for name, model in models.items():
-        try:
-            # Train
-            model = TransformedTargetRegressor(
-                regressor=GradientBoostingRegressor(),
-                func=np.log1p,            # log1p handles zero
-                inverse_func=np.expm1     # undo log1p
+    for name in candidates:
+        completed = not np.isnan(oof_preds[name]).any()
+        result = {
+            'mse': None,
+            'mae': None,
+            'r2': None,
+            'fold_r2': [fold_r2[name][fold] for fold in sorted(fold_r2[name])],
+            'fit_time': float(np.sum(fit_times[name])),
+            'folds_fit': len(fit_times[name]),
+        }
+        
+        if name in errors:
+            result['status'] = f"failed: {errors[name]}"
+            print(f"Error with {name} model for {test_parameter}: {errors[name]}")
+        elif not completed:
+            result['status'] = "timed out" if timed_out else "incomplete"
+            print(f"{name} - {test_parameter}: {result['status']} after {result['folds_fit']}/{n_splits} folds")
+        else:
+            y_pred = oof_preds[name]
+            result.update(
+                status="ok",
+                mse=mean_squared_error(y, y_pred),
+                mae=mean_absolute_error(y, y_pred),
+                r2=r2_score(y, y_pred),
             )
-            model.fit(X_train, y_train)
-            
-            # Predict
-            y_pred = model.predict(X_test)
-            
-            # Evaluate
-            mse = mean_squared_error(y_test, y_pred)
-            mae = mean_absolute_error(y_test, y_pred)
-            r2 = r2_score(y_test, y_pred)
-            
-            # Store results
-            results[name] = {
-                'model': model,
-                'mse': mse,
-                'mae': mae,
-                'r2': r2,
-                'y_test': y_test,
-                'y_pred': y_pred
-            }
             
-            print(f"{name} - {test_parameter}:")
-            print(f"  MSE: {mse:.4f}")
-            print(f"  MAE: {mae:.4f}")
-            print(f"  R²: {r2:.4f}")
+            print(f"{name} - {test_parameter} ({n_splits}-fold CV):")
+            print(f"  MSE: {result['mse']:.4f}")
+            print(f"  MAE: {result['mae']:.4f}")
+            print(f"  R²: {result['r2']:.4f}")
+            print(f"  Fit time: {result['fit_time']:.2f}s")
             print()
             
             # Update best model
-            if r2 > best_r2:
-                best_r2 = r2
+            if result['r2'] > best_r2:
+                best_r2 = result['r2']
                 best_model_name = name
-                
-        except Exception as e:
-            print(f"Error with {name} model for {test_parameter}: {str(e)}")
+        
+        results[name] = result
     
-    # Return the best model based on R²
+    # Refit the best candidate on all rows
     if best_model_name:
-        return results[best_model_name]['model'], results
+        best_model = clone(candidates[best_model_name]).fit(X, y)
+        results[best_model_name]['model'] = best_model
+        print(f"Selected {best_model_name} for {test_parameter}")
+        return best_model, results
     else:
         print(f"No successful models for {test_parameter}")
-        return None, {}
+        return None, results
 
 def feature_importance_analysis(model, feature_names, test_parameter):
     """Analyze feature importance for tree-based models"""
@@ -190,14 +235,87 @@ def feature_importance_analysis(model, feature_names, test_parameter):
         print(f"Feature importance not available for this model type for {test_parameter}")
         return None
 
-def main(file_path):
-    # Load data
-    print("Loading data...")
-    formulation_df, evaluation_df = load_data(file_path)
+def prepare_training_data(test_parameter, evaluation_long, formulation_matrix):
+    """
+    Align the formulation matrix with one test parameter's results
+    
+    Returns:
+    - (X, y) with matching recipe indices, or None if there is not enough data
+    """
+    # Get data for this test parameter
+    param_col = evaluation_long.columns[0]  # First column contains parameter names
+    test_data = evaluation_long[evaluation_long[param_col] == test_parameter]
+    
+    # Check if we have enough data
+    if len(test_data) < 5:
+        print(f"Not enough data for {test_parameter}, skipping...")
+        return None
+        
+    # Get recipes with test results
+    recipes_with_results = test_data['Recipe_Name'].unique()
+    
+    # Check which recipes are in formulation_matrix
+    common_recipes = [r for r in recipes_with_results if r in formulation_matrix.index]
+    if len(common_recipes) < len(recipes_with_results):
+        print(f"Warning: {len(recipes_with_results) - len(common_recipes)} recipes not found in formulation data")
+        
+    # Get formulation data for these recipes
+    X = formulation_matrix.loc[formulation_matrix.index.intersection(recipes_with_results)]
+    y = test_data.set_index('Recipe_Name')['Test_Result']
+    
+    # Align indices
+    common_indices = X.index.intersection(y.index)
+    X = X.loc[common_indices]
+    y = y.loc[common_indices]
+    
+    if len(X) < 5:
+        print(f"After alignment, not enough data for {test_parameter}, skipping...")
+        return None
+    
+    return X, y
+
+# Formulation matrix of a training worker process, set once by its initializer
+_worker_formulation_matrix = None
+
+def _init_training_worker(formulation_matrix):
+    """Keep the shared formulation matrix in the training worker"""
+    global _worker_formulation_matrix
+    _worker_formulation_matrix = formulation_matrix
+
+def _train_in_worker(test_parameter, y):
+    """Train one test parameter's model in a worker; X is rebuilt from the shared matrix"""
+    X = _worker_formulation_matrix.loc[y.index]
+    # Parameters already run in parallel, so cross-validate within the worker
+    best_model, _ = build_train_model(X, y, test_parameter, n_jobs=1)
+    return best_model
+
+def main(file_path, n_jobs=None, model_dir=None):
+    """
+    Train a model for every test parameter in the workbook
+    
+    Parameters:
+    - file_path: Path to the training workbook
+    - n_jobs: Number of worker processes training parameters in parallel
+      (default TRAINING_JOBS env var or 1; -1 uses every CPU). Results are
+      identical to a sequential run.
+    - model_dir: When given, train incrementally against the models saved
+      there: only test parameters whose training data fingerprint changed
+      since the last run (see training_manifest) are refit, the rest are
+      loaded from disk. Retrained models, the manifest and the bundle are
+      written back to model_dir; other model files are left as they are.
+    """
+    if n_jobs is None:
+        n_jobs = int(os.environ.get("TRAINING_JOBS", 1))
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
     
-    # Preprocess data
-    print("Preprocessing data...")
-    formulation_matrix, evaluation_long, test_params, orig_formulation_df = preprocess_data(formulation_df, evaluation_df)
+    # Load preprocessed data (from the columnar cache when the workbook is unchanged)
+    print("Loading data...")
+    dataset = load_dataset(file_path)
+    formulation_matrix = dataset["formulation_matrix"]
+    evaluation_long = dataset["evaluation_long"]
+    test_params = dataset["test_params"]
+    orig_formulation_df = dataset["formulation_df"]
     
     # Display data shapes
     print(f"Formulation matrix shape: {formulation_matrix.shape}")
@@ -206,57 +324,84 @@ def main(file_path):
     # Display available test parameters
     print(f"Available test parameters: {test_params}")
     
-    # Build models for each test parameter
-    models = {}
-    feature_importances = {}
-    
+    # Collect the aligned training data of each test parameter
+    training_data = {}
     for test_parameter in test_params:
-        print(f"\nBuilding model for: {test_parameter}")
+        data = prepare_training_data(test_parameter, evaluation_long, formulation_matrix)
+        if data is not None:
+            training_data[test_parameter] = data
+    
+    # Reuse saved models whose training data and configuration are unchanged
+    reused = {}
+    if model_dir is not None:
+        config = training_config()
+        fingerprints = {p: data_fingerprint(X, y) for p, (X, y) in training_data.items()}
+        manifest = load_manifest(model_dir)
+        _, current, reason = plan_training(manifest, config, fingerprints, model_dir)
         
-        # Get data for this test parameter
-        param_col = evaluation_long.columns[0]  # First column contains parameter names
-        test_data = evaluation_long[evaluation_long[param_col] == test_parameter]
-        
-        # Check if we have enough data
-        if len(test_data) < 5:
-            print(f"Not enough data for {test_parameter}, skipping...")
-            continue
-            
-        # Get recipes with test results
-        recipes_with_results = test_data['Recipe_Name'].unique()
-        
-        # Check which recipes are in formulation_matrix
-        common_recipes = [r for r in recipes_with_results if r in formulation_matrix.index]
-        if len(common_recipes) < len(recipes_with_results):
-            print(f"Warning: {len(recipes_with_results) - len(common_recipes)} recipes not found in formulation data")
-            
-        # Get formulation data for these recipes
-        X = formulation_matrix.loc[formulation_matrix.index.intersection(recipes_with_results)]
-        y = test_data.set_index('Recipe_Name')['Test_Result']
+        for test_parameter in current:
+            model_path = os.path.join(model_dir, manifest["parameters"][test_parameter]["model_file"])
+            try:
+                reused[test_parameter] = joblib.load(model_path)
+            except Exception as e:
+                print(f"Error loading model {model_path}: {str(e)}; retraining")
         
-        # Align indices
-        common_indices = X.index.intersection(y.index)
-        X = X.loc[common_indices]
-        y = y.loc[common_indices]
+        if reason:
+            print(f"\nRetraining all {len(training_data)} test parameters: {reason}")
+        else:
+            print(f"\nRetraining {len(training_data) - len(reused)} changed test parameters, "
+                  f"reusing {len(reused)} saved models")
+    
+    to_train = {p: data for p, data in training_data.items() if p not in reused}
+    
+    # Build models for each test parameter
+    trained = {}
+    if n_jobs > 1 and len(to_train) > 1:
+        print(f"\nTraining {len(to_train)} models with {n_jobs} worker processes")
         
-        if len(X) < 5:
-            print(f"After alignment, not enough data for {test_parameter}, skipping...")
+        # The formulation matrix is sent to each worker once; tasks only carry y
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_training_worker,
+            initargs=(formulation_matrix,)
+        ) as executor:
+            futures = {
+                test_parameter: executor.submit(_train_in_worker, test_parameter, y)
+                for test_parameter, (_, y) in to_train.items()
+            }
+            # Collect in test parameter order so the result matches a sequential run
+            for test_parameter, future in futures.items():
+                trained[test_parameter] = future.result()
+    else:
+        for test_parameter, (X, y) in to_train.items():
+            print(f"\nBuilding model for: {test_parameter}")
+            trained[test_parameter], _ = build_train_model(X, y, test_parameter)
+    
+    models = {}
+    feature_importances = {}
+    
+    for test_parameter in training_data:
+        if test_parameter in reused:
+            models[test_parameter] = reused[test_parameter]
             continue
-            
-        # Train model
-        best_model, results = build_train_model(X, y, test_parameter)
         
+        best_model = trained[test_parameter]
         if best_model is not None:
             # Store the model
             models[test_parameter] = best_model
             
             # Analyze feature importance
+            X, _ = training_data[test_parameter]
             feature_importance = feature_importance_analysis(best_model, X.columns, test_parameter)
             if feature_importance is not None:
                 feature_importances[test_parameter] = feature_importance
     
     print(f"\nSuccessfully built models for {len(models)} test parameters out of {len(test_params)}")
     
+    if model_dir is not None:
+        retrained = {p: m for p, m in trained.items() if m is not None}
+        save_incremental(models, retrained, fingerprints, training_data, config, model_dir)
+    
     return models, feature_importances, formulation_matrix, orig_formulation_df
 
 def predict_new_formulation(models, new_formulation, formulation_matrix):
@@ -487,6 +632,12 @@ def interactive_prediction(models, formulation_matrix, orig_formulation_df):
     
     return predictions
 
+def model_filename(test_param):
+    """Return the joblib filename a test parameter's model is saved under"""
+    # Create a safe filename
+    safe_name = "".join([c if c.isalnum() else "_" for c in test_param])
+    return f"{safe_name}_model.joblib"
+
 def save_models(models, file_path):
     """Save models to disk"""
     # Create a directory for models if it doesn't exist
@@ -495,15 +646,79 @@ def save_models(models, file_path):
     
     # Save each model
     for test_param, model in models.items():
-        # Create a safe filename
-        safe_name = "".join([c if c.isalnum() else "_" for c in test_param])
-        model_path = os.path.join(model_dir, f"{safe_name}_model.joblib")
+        model_path = os.path.join(model_dir, model_filename(test_param))
         joblib.dump(model, model_path)
     
     print(f"Saved {len(models)} models to {model_dir} directory")
+    
+    # Also write the single-file bundle the API loads
+    export_bundle(models, model_dir)
+
+def save_incremental(models, retrained, fingerprints, training_data, config, model_dir="compound_models"):
+    """
+    Save the result of an incremental training run
+    
+    Only the retrained models are written; the manifest is rewritten last so
+    an interrupted run just retrains the same parameters again. The bundle is
+    re-exported when any model changed or it is missing.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    
+    for test_param, model in retrained.items():
+        joblib.dump(model, os.path.join(model_dir, model_filename(test_param)))
+    print(f"Saved {len(retrained)} retrained models to {model_dir} directory")
+    
+    parameters = {}
+    for test_param, model in models.items():
+        _, y = training_data[test_param]
+        regressor = getattr(model, 'regressor_', model)
+        parameters[test_param] = {
+            "fingerprint": fingerprints[test_param],
+            "model_file": model_filename(test_param),
+            "model_type": type(regressor).__name__,
+            "n_samples": len(y),
+        }
+    save_manifest(model_dir, config, parameters)
+    
+    if retrained or not os.path.exists(os.path.join(model_dir, BUNDLE_FILENAME)):
+        export_bundle(models, model_dir)
+
+def export_bundle(models, model_dir="compound_models"):
+    """
+    Write all models into one versioned, memory-mappable bundle
+    
+    The bundle holds the flattened tree arrays plus a manifest with the exact
+    test parameter names. Models that can't be flattened are listed in the
+    manifest with the joblib file that still holds them.
+    """
+    # All models are trained on the same formulation matrix columns
+    feature_names = list(dict.fromkeys(
+        f for model in models.values() for f in getattr(model, 'feature_names_in_', [])
+    ))
+    
+    engine, skipped = compile_models(models, feature_names)
+    if engine is None:
+        print("No models could be bundled.")
+        return None
+    
+    for test_param, reason in skipped.items():
+        print(f"Not bundling {test_param}: {reason}")
+    
+    bundle_path = os.path.join(model_dir, BUNDLE_FILENAME)
+    save_bundle(engine, bundle_path, unbundled={p: model_filename(p) for p in skipped})
+    print(f"Wrote bundle of {len(engine.test_params)} models to {bundle_path}")
+    return bundle_path
 
-def load_models(model_dir="compound_models"):
-    """Load saved models from disk"""
+def load_models(model_dir="compound_models", test_params=None):
+    """
+    Load saved models from disk
+    
+    Parameters:
+    - model_dir: Directory containing the *_model.joblib files
+    - test_params: Optional list of exact test parameter names; when given, models
+      are keyed by the name whose safe filename matches instead of the filename
+      with underscores turned back into spaces
+    """
     models = {}
     
     if not os.path.exists(model_dir):
@@ -516,10 +731,12 @@ def load_models(model_dir="compound_models"):
         print(f"No model files found in {model_dir}.")
         return models
     
+    exact_names = {model_filename(p): p for p in (test_params or [])}
+    
     for model_file in model_files:
         try:
             # Extract test parameter name from filename
-            test_param = model_file.replace("_model.joblib", "").replace("_", " ")
+            test_param = exact_names.get(model_file, model_file.replace("_model.joblib", "").replace("_", " "))
             
             # Load the model
             model_path = os.path.join(model_dir, model_file)
@@ -534,53 +751,260 @@ def load_models(model_dir="compound_models"):
     print(f"Loaded {len(models)} models from {model_dir}.")
     return models
 
+# Offline scoring: rows per chunk handed to a worker, and chunks queued per worker
+SCORE_CHUNK_ROWS = int(os.environ.get("SCORE_CHUNK_ROWS", 5000))
+SCORE_QUEUE_DEPTH = 2
+
+# Models of a scoring worker process, loaded once by its initializer
+_worker_models = None
+
+def _init_scoring_worker(model_dir):
+    """Load the saved models in a scoring worker"""
+    global _worker_models
+    _worker_models = load_models(model_dir, test_params=saved_test_params(model_dir))
+
+def _score_in_worker(chunk, id_columns):
+    """Score one chunk of formulations in a worker"""
+    return score_formulations(_worker_models, chunk, id_columns)
+
+def saved_test_params(model_dir):
+    """Return the exact test parameter names recorded in the training manifest, if there is one"""
+    manifest = load_manifest(model_dir)
+    return list(manifest.get("parameters", {})) if manifest else None
+
+def model_files_fingerprint(model_dir):
+    """Fingerprint the name, size and modification time of every file in a model directory"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def score_formulations(models, formulations, id_columns=()):
+    """
+    Predict every test parameter for a table of formulations
+    
+    Parameters:
+    - models: Dictionary mapping test parameters to trained models
+    - formulations: DataFrame with one row per formulation and one column per
+      raw material; raw materials a model expects but the table lacks are 0
+    - id_columns: Columns copied unchanged to the output
+    
+    Returns:
+    - DataFrame with the id columns followed by one column per test parameter
+    """
+    amounts = formulations.drop(columns=list(id_columns))
+    amounts = amounts.apply(pd.to_numeric, errors='coerce').fillna(0)
+    
+    scores = formulations[list(id_columns)].reset_index(drop=True)
+    for test_param, model in models.items():
+        try:
+            if hasattr(model, 'feature_names_in_'):
+                X = amounts.reindex(columns=model.feature_names_in_, fill_value=0)
+            else:
+                X = amounts
+            # Same floor at 0 as predict_new_formulation
+            scores[test_param] = np.maximum(model.predict(X), 0)
+        except Exception as e:
+            print(f"Error predicting {test_param}: {str(e)}")
+            scores[test_param] = np.nan
+    return scores
+
+def _read_table_chunks(path, chunk_rows):
+    """Yield DataFrame chunks of a CSV or Parquet table, and its row count when known up front"""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        return (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_rows)), parquet_file.metadata.num_rows
+    return pd.read_csv(path, chunksize=chunk_rows), None
+
+def _write_table(table, path):
+    """Write a DataFrame as CSV or Parquet, by extension, replacing path atomically"""
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        table.to_parquet(tmp_path, index=False)
+    else:
+        table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def _combine_parts(part_paths, output_path):
+    """Concatenate the scored part files into the output file one part at a time"""
+    tmp_path = output_path + ".tmp"
+    if output_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        writer = None
+        try:
+            for part_path in part_paths:
+                table = pq.read_table(part_path)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+            for i, part_path in enumerate(part_paths):
+                with open(part_path, encoding="utf-8", newline="") as part:
+                    header = part.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(part, out)
+    os.replace(tmp_path, output_path)
+
+def score_table(input_path, output_path, model_dir="compound_models", n_jobs=None,
+                chunk_rows=None, id_columns=()):
+    """
+    Score a CSV or Parquet table of formulations with the saved models
+    
+    The table is read in chunks of chunk_rows rows, which worker processes
+    score in parallel. Each scored chunk is written to a part file in
+    <output_path>.parts as soon as it is done, so an interrupted run picks up
+    at the first unscored chunk when started again with the same input, chunk
+    size and model files. The parts are combined into output_path (CSV or Parquet, by
+    extension) at the end.
+    
+    Parameters:
+    - input_path, output_path: Formulation table and where to write the scores
+    - model_dir: Directory the models are loaded from (see load_models)
+    - n_jobs: Number of worker processes (default every CPU)
+    - chunk_rows: Rows per chunk (default SCORE_CHUNK_ROWS env var or 5000)
+    - id_columns: Input columns copied to the output alongside the scores
+    
+    Returns:
+    - Number of rows scored
+    """
+    chunk_rows = chunk_rows or SCORE_CHUNK_ROWS
+    n_jobs = n_jobs if n_jobs and n_jobs > 0 else os.cpu_count() or 1
+    id_columns = list(id_columns)
+    
+    models = load_models(model_dir, test_params=saved_test_params(model_dir))
+    if not models:
+        raise ValueError(f"No models available in {model_dir}")
+    features = set()
+    for model in models.values():
+        features.update(getattr(model, 'feature_names_in_', []))
+    
+    # Part files are only reused for the same input read in the same chunks
+    # and scored by the same models
+    parts_dir = output_path + ".parts"
+    stat = os.stat(input_path)
+    run_info = {
+        "input": os.path.abspath(input_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "chunk_rows": chunk_rows,
+        "id_columns": id_columns,
+        "model_dir": os.path.abspath(model_dir),
+        "models": model_files_fingerprint(model_dir),
+    }
+    run_info_path = os.path.join(parts_dir, "run.json")
+    try:
+        with open(run_info_path, encoding="utf-8") as f:
+            resumable = json.load(f) == run_info
+    except (OSError, ValueError):
+        resumable = False
+    if not resumable:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        os.makedirs(parts_dir)
+        with open(run_info_path, "w", encoding="utf-8") as f:
+            json.dump(run_info, f)
+    
+    extension = ".parquet" if output_path.endswith(".parquet") else ".csv"
+    
+    def part_path(index):
+        return os.path.join(parts_dir, f"part-{index:06d}{extension}")
+    
+    chunks, total_rows = _read_table_chunks(input_path, chunk_rows)
+    started = time.time()
+    scored_rows, resumed_rows, n_chunks = 0, 0, 0
+    
+    def report(done):
+        elapsed = max(time.time() - started, 1e-9)
+        total = f"/{total_rows}" if total_rows is not None else ""
+        print(f"Scored {done}{total} rows ({scored_rows / elapsed:.0f} rows/s)", flush=True)
+    
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_scoring_worker, initargs=(model_dir,)) as executor:
+        pending = {}
+        
+        def collect(block):
+            # Wait for the oldest chunk and write its part file
+            nonlocal scored_rows
+            index, future = next(iter(pending.items()))
+            if not block and not future.done():
+                return False
+            del pending[index]
+            scores = future.result()
+            _write_table(scores, part_path(index))
+            scored_rows += len(scores)
+            report(resumed_rows + scored_rows)
+            return True
+        
+        for index, chunk in enumerate(chunks):
+            n_chunks += 1
+            if index == 0:
+                unknown = sorted(str(c) for c in chunk.columns if c not in features and c not in id_columns)
+                if unknown:
+                    print(f"Ignoring columns that are not raw materials of any model: {unknown}")
+            
+            if os.path.exists(part_path(index)):
+                resumed_rows += len(chunk)
+                continue
+            
+            pending[index] = executor.submit(_score_in_worker, chunk, id_columns)
+            # Bound the chunks held in memory
+            while len(pending) >= n_jobs * SCORE_QUEUE_DEPTH:
+                collect(block=True)
+            while pending and collect(block=False):
+                pass
+        
+        while pending:
+            collect(block=True)
+    
+    if resumed_rows:
+        print(f"Resumed: {resumed_rows} rows were already scored")
+    
+    _combine_parts([part_path(i) for i in range(n_chunks)], output_path)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    
+    elapsed = time.time() - started
+    print(f"Wrote {resumed_rows + scored_rows} rows to {output_path} in {elapsed:.1f}s "
+          f"({scored_rows / max(elapsed, 1e-9):.0f} rows/s)")
+    return resumed_rows + scored_rows
+
+def parse_args(argv=None):
+    """Parse the command line: no command trains and starts interactive prediction"""
+    parser = argparse.ArgumentParser(description="Train compound test result models or score formulations with them")
+    commands = parser.add_subparsers(dest="command")
+    
+    score = commands.add_parser("score", help="Score a CSV or Parquet table of formulations without the API")
+    score.add_argument("input", help="Formulation table: one row per formulation, one column per raw material")
+    score.add_argument("output", help="Where to write the predictions (.csv or .parquet)")
+    score.add_argument("--model-dir", default="compound_models", help="Directory holding the saved models")
+    score.add_argument("--jobs", type=int, default=None, help="Worker processes (default every CPU)")
+    score.add_argument("--chunk-rows", type=int, default=None, help=f"Rows per chunk (default {SCORE_CHUNK_ROWS})")
+    score.add_argument("--id-column", action="append", default=[], dest="id_columns",
+                       help="Input column copied to the output; may be repeated")
+    
+    return parser.parse_args(argv)
+
 # Example usage
 if __name__ == "__main__":
+    args = parse_args()
+    
+    if args.command == "score":
+        score_table(args.input, args.output, model_dir=args.model_dir, n_jobs=args.jobs,
+                    chunk_rows=args.chunk_rows, id_columns=args.id_columns)
+        sys.exit(0)
+    
     # Replace with your file path
     file_path = "training_dataset.xlsx"
     
-    # Check if models are already saved
-    if os.path.exists("compound_models") and any(f.endswith("_model.joblib") for f in os.listdir("compound_models")):
-        print("Found existing models. Loading...")
-        models = load_models()
-        
-        # We still need to load the formulation data for prediction
-        formulation_df, _ = load_data(file_path)
-        _, _, _, orig_formulation_df = preprocess_data(formulation_df, pd.DataFrame())
-        
-        # For prediction we need the formulation matrix
-        id_cols = formulation_df.columns.tolist()[:2]
-        recipe_names = formulation_df.columns.tolist()[2:]
-        
-        # Clean and prepare formulation data
-        for col in recipe_names:
-            formulation_df[col] = pd.to_numeric(formulation_df[col], errors='coerce')
-        
-        formulation_long = pd.melt(
-            formulation_df, 
-            id_vars=id_cols,
-            value_vars=recipe_names,
-            var_name='Recipe_Name',
-            value_name='Composition_Amount'
-        )
-        
-        formulation_long = formulation_long.dropna(subset=['Composition_Amount'])
-        formulation_long = formulation_long[formulation_long['Composition_Amount'] > 0]
-        
-        formulation_matrix = formulation_long.pivot(
-            index='Recipe_Name',
-            columns=id_cols[1],
-            values='Composition_Amount'
-        ).fillna(0)
-        
-    else:
-        # Run the main analysis
-        print("Training new models...")
-        models, feature_importances, formulation_matrix, orig_formulation_df = main(file_path)
-        
-        # Save models for future use
-        if models:
-            save_models(models, file_path)
+    # Train incrementally: only test parameters whose data changed since the
+    # saved models were trained are refit, the rest are loaded from disk
+    models, feature_importances, formulation_matrix, orig_formulation_df = main(file_path, model_dir="compound_models")
     
     # Run interactive prediction
     if models:
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401 - Parquet engine for the cache files
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Bump when the cached tables change shape so stale caches are rebuilt
+CACHE_FORMAT_VERSION = 1
+CACHE_TABLES = ["formulation_df", "formulation_matrix", "evaluation_long"]
+
+
+def read_workbook(excel_file):
+    """Read the formulation and evaluation sheets of the training workbook"""
+    formulation_df = pd.read_excel(excel_file, sheet_name='Compound_Formulation')
+    evaluation_df = pd.read_excel(excel_file, sheet_name='Compound_Evaluation_Report')
+    return formulation_df, evaluation_df
+
+
+def preprocess_workbook(formulation_df, evaluation_df):
+    """
+    Clean the workbook sheets and build the formulation matrix and evaluation table
+
+    Returns:
+    - Dictionary with formulation_df (cleaned wide sheet), formulation_matrix
+      (recipes x raw materials), raw_materials, recipes, evaluation_long
+      (test parameter, recipe, result rows) and test_params
+    """
+    # Get the actual column names from the dataframes
+    formulation_cols = formulation_df.columns.tolist()
+    id_cols = formulation_cols[:2]
+    recipe_names = formulation_cols[2:]
+
+    # Clean formulation data - replace spaces, empty strings with NaN
+    for col in recipe_names:
+        formulation_df[col] = pd.to_numeric(formulation_df[col], errors='coerce')
+
+    # ID columns mix numbers and text (e.g. SAP codes); keep them as text
+    for col in id_cols:
+        formulation_df[col] = formulation_df[col].map(lambda v: v if pd.isna(v) else str(v))
+
+    # Transform formulation data from wide to long format
+    formulation_long = pd.melt(
+        formulation_df,
+        id_vars=id_cols,
+        value_vars=recipe_names,
+        var_name='Recipe_Name',
+        value_name='Composition_Amount'
+    )
+
+    # Filter out rows where raw materials are not used in recipes (NaN or 0)
+    formulation_long = formulation_long.dropna(subset=['Composition_Amount'])
+    formulation_long = formulation_long[formulation_long['Composition_Amount'] > 0]
+
+    # Get the name of the column that contains the raw material names (second column)
+    raw_material_col = id_cols[1]
+
+    # Create the formulation matrix; raw materials not used in a recipe are 0
+    formulation_matrix = formulation_long.pivot(
+        index='Recipe_Name',
+        columns=raw_material_col,
+        values='Composition_Amount'
+    ).fillna(0)
+
+    test_params = []
+    evaluation_long = pd.DataFrame(columns=['Test Parameters', 'Recipe_Name', 'Test_Result'])
+
+    # Only process evaluation data if it's not empty
+    if not evaluation_df.empty:
+        evaluation_cols = evaluation_df.columns.tolist()
+        # First column in evaluation_df contains test parameter names
+        test_param_col = evaluation_cols[0]
+
+        # Clean evaluation data - replace spaces, empty strings with NaN
+        for col in evaluation_cols[1:]:
+            evaluation_df[col] = pd.to_numeric(evaluation_df[col], errors='coerce')
+
+        test_params = evaluation_df[test_param_col].tolist()
+
+        # Transform evaluation data from wide to long format
+        evaluation_long = pd.melt(
+            evaluation_df,
+            id_vars=[test_param_col],
+            value_vars=evaluation_cols[1:],
+            var_name='Recipe_Name',
+            value_name='Test_Result'
+        )
+
+        # Filter out rows where test was not conducted (null cells)
+        evaluation_long = evaluation_long.dropna(subset=['Test_Result'])
+
+    return {
+        "formulation_df": formulation_df,
+        "formulation_matrix": formulation_matrix,
+        "raw_materials": formulation_df[raw_material_col].tolist(),
+        "recipes": recipe_names,
+        "evaluation_long": evaluation_long,
+        "test_params": test_params,
+    }
+
+
+def cache_dir_for(excel_file):
+    """Return the cache directory kept next to a workbook"""
+    return os.path.splitext(excel_file)[0] + ".cache"
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(cache_dir, meta):
+    tmp_path = os.path.join(cache_dir, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(cache_dir, "meta.json"))
+
+
+def _cache_is_fresh(excel_file, cache_dir, meta):
+    """Check the cache against the workbook: size and mtime first, content hash if they moved"""
+    if meta is None or meta.get("format_version") != CACHE_FORMAT_VERSION:
+        return False
+    if not all(os.path.exists(os.path.join(cache_dir, f"{name}.parquet")) for name in CACHE_TABLES):
+        return False
+
+    stat = os.stat(excel_file)
+    if stat.st_size == meta["source_size"] and stat.st_mtime_ns == meta["source_mtime_ns"]:
+        return True
+
+    # The workbook was touched; it is only stale if its contents changed
+    if stat.st_size == meta["source_size"] and file_sha256(excel_file) == meta["source_sha256"]:
+        meta["source_mtime_ns"] = stat.st_mtime_ns
+        _write_meta(cache_dir, meta)
+        return True
+    return False
+
+
+def write_cache(excel_file, dataset, cache_dir=None):
+    """Write a preprocessed dataset to the columnar cache next to the workbook"""
+    cache_dir = cache_dir or cache_dir_for(excel_file)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Tables first, metadata last: a cache without meta.json is never used
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    for name in CACHE_TABLES:
+        tmp_path = os.path.join(cache_dir, f"{name}.parquet.tmp")
+        dataset[name].to_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{name}.parquet"))
+
+    stat = os.stat(excel_file)
+    _write_meta(cache_dir, {
+        "format_version": CACHE_FORMAT_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_sha256": file_sha256(excel_file),
+        "raw_materials": dataset["raw_materials"],
+        "recipes": dataset["recipes"],
+        "test_params": dataset["test_params"],
+    })
+
+
+def read_cache(cache_dir, meta):
+    """Read a dataset back from the columnar cache"""
+    dataset = {name: pd.read_parquet(os.path.join(cache_dir, f"{name}.parquet")) for name in CACHE_TABLES}
+    dataset["raw_materials"] = meta["raw_materials"]
+    dataset["recipes"] = meta["recipes"]
+    dataset["test_params"] = meta["test_params"]
+    return dataset
+
+
+def load_dataset(excel_file, use_cache=True):
+    """
+    Return the preprocessed training dataset (see preprocess_workbook)
+
+    The columnar cache next to the workbook is used when it is fresh; otherwise
+    the workbook is parsed and the cache rewritten. Without a Parquet engine
+    the workbook is always parsed.
+    """
+    use_cache = use_cache and PARQUET_AVAILABLE
+    cache_dir = cache_dir_for(excel_file)
+
+    if use_cache:
+        meta = _read_meta(cache_dir)
+        if _cache_is_fresh(excel_file, cache_dir, meta):
+            try:
+                return read_cache(cache_dir, meta)
+            except Exception as e:
+                print(f"Error reading dataset cache {cache_dir}: {str(e)}; rebuilding")
+
+    dataset = preprocess_workbook(*read_workbook(excel_file))
+
+    if use_cache:
+        try:
+            write_cache(excel_file, dataset, cache_dir)
+        except Exception as e:
+            print(f"Error writing dataset cache {cache_dir}: {str(e)}")
+
+    return dataset
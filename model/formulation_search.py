@@ -0,0 +1,131 @@
+import time
+
+import numpy as np
+
+# Share of each population used to refit the sampling distribution, how much
+# of the previous distribution is kept per iteration, and the smallest spread
+# (as a share of each material's bound range) the search may narrow down to
+ELITE_FRACTION = 0.1
+SMOOTHING = 0.7
+MIN_SPREAD = 1e-3
+
+
+def target_violation(predictions, lower, upper, scale):
+    """
+    Return how far each row of predictions lies outside the target ranges
+
+    predictions is (rows, targets); lower/upper hold each target's bounds
+    (-inf/inf when open) and scale the value each violation is divided by.
+    Rows inside every range score 0; non-finite predictions score inf.
+    """
+    below = np.maximum(lower - predictions, 0)
+    above = np.maximum(predictions - upper, 0)
+    violation = np.sum(((below + above) / scale) ** 2, axis=1)
+    violation[~np.all(np.isfinite(predictions), axis=1)] = np.inf
+    return violation
+
+
+def target_center_distance(predictions, lower, upper, scale):
+    """Return each row's normalized distance to the middle of the closed target ranges"""
+    center = np.where(np.isfinite(lower) & np.isfinite(upper), (lower + upper) / 2, predictions)
+    return np.sum(((predictions - center) / scale) ** 2, axis=1)
+
+
+def target_scale(lower, upper):
+    """Return the per-target normalization: range width, else the bound's magnitude, else 1"""
+    width = upper - lower
+    magnitude = np.where(np.isfinite(lower), np.abs(lower), np.abs(upper))
+    scale = np.where(np.isfinite(width) & (width > 0), width, magnitude)
+    return np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+
+
+def search_formulations(predict, lower, upper, target_lower, target_upper, start=None,
+                        top_k=5, population=2048, max_evaluations=50000, time_limit=10.0,
+                        precision=4, seed=None):
+    """
+    Search material amounts whose predictions fall inside target ranges
+
+    Cross-entropy search: each iteration samples a population of candidates
+    from a per-material normal distribution clipped to the bounds, scores the
+    whole population with one call to predict, and refits the distribution
+    to the best ELITE_FRACTION of it. Candidates are ranked by target
+    violation, then by distance to the middle of the target ranges.
+
+    Parameters:
+    - predict: function mapping an (n, materials) array of amounts to an
+      (n, targets) array of predictions
+    - lower, upper: per-material bounds on the amounts
+    - target_lower, target_upper: per-target bounds (-inf/inf when open)
+    - start: amounts the first iteration is centred on (middle of the bounds if None)
+    - top_k: number of distinct formulations to return
+    - population: candidates evaluated per iteration
+    - max_evaluations, time_limit: evaluation budget and wall-clock limit in seconds
+    - precision: decimals amounts are rounded to before scoring
+
+    Returns:
+    - dict with the best "amounts" (top_k x materials), their "predictions",
+      "violation" and "distance", and the "evaluations", "iterations" and
+      "elapsed" seconds used
+    """
+    started = time.monotonic()
+    rng = np.random.default_rng(seed)
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    target_lower = np.asarray(target_lower, dtype=float)
+    target_upper = np.asarray(target_upper, dtype=float)
+    scale = target_scale(target_lower, target_upper)
+
+    mean = (lower + upper) / 2 if start is None else np.clip(np.asarray(start, dtype=float), lower, upper)
+    spread = (upper - lower) / 2
+    min_spread = (upper - lower) * MIN_SPREAD
+
+    best_amounts = np.empty((0, len(lower)))
+    best_predictions = np.empty((0, len(target_lower)))
+    evaluations = 0
+    iterations = 0
+
+    while evaluations < max_evaluations:
+        size = min(population, max_evaluations - evaluations)
+        candidates = np.clip(mean + spread * rng.standard_normal((size, len(lower))), lower, upper)
+        if iterations == 0:
+            # The starting point itself is always scored
+            candidates[0] = mean
+        candidates = np.round(candidates, precision)
+
+        predictions = np.asarray(predict(candidates), dtype=float).reshape(size, len(target_lower))
+        evaluations += size
+        iterations += 1
+
+        violation = target_violation(predictions, target_lower, target_upper, scale)
+        distance = target_center_distance(predictions, target_lower, target_upper, scale)
+        order = np.lexsort((distance, violation))
+
+        # Refit the sampling distribution to the elite of this population
+        elite = candidates[order[:max(2, int(size * ELITE_FRACTION))]]
+        mean = SMOOTHING * mean + (1 - SMOOTHING) * elite.mean(axis=0)
+        spread = np.maximum(SMOOTHING * spread + (1 - SMOOTHING) * elite.std(axis=0), min_spread)
+
+        # Keep the top_k distinct candidates seen so far
+        pool_amounts = np.vstack([best_amounts, candidates[order[:top_k]]])
+        pool_predictions = np.vstack([best_predictions, predictions[order[:top_k]]])
+        _, first = np.unique(pool_amounts, axis=0, return_index=True)
+        first.sort()
+        pool_amounts, pool_predictions = pool_amounts[first], pool_predictions[first]
+        pool_order = np.lexsort((
+            target_center_distance(pool_predictions, target_lower, target_upper, scale),
+            target_violation(pool_predictions, target_lower, target_upper, scale),
+        ))[:top_k]
+        best_amounts, best_predictions = pool_amounts[pool_order], pool_predictions[pool_order]
+
+        if time.monotonic() - started >= time_limit:
+            break
+
+    return {
+        "amounts": best_amounts,
+        "predictions": best_predictions,
+        "violation": target_violation(best_predictions, target_lower, target_upper, scale),
+        "distance": target_center_distance(best_predictions, target_lower, target_upper, scale),
+        "evaluations": evaluations,
+        "iterations": iterations,
+        "elapsed": time.monotonic() - started,
+    }
@@ -1,14 +1,39 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, confloat, conint
 from typing import List, Dict, Union, Optional
 import pandas as pd
 import numpy as np
 import os
+import json
+import tempfile
+import time
+import hashlib
+import hmac
+import asyncio
+import random
+import threading
+import uuid
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import joblib
+from dataset_cache import load_dataset
+from prediction_cache import PredictionCache, canonicalize_formulation
+from property_registry import PropertyRegistry, normalize_test_param
+from formulation_search import search_formulations
+from recipe_index import RecipeIndex
+from metrics import Counter, GaugeFunc, Histogram, Registry, process_rss_bytes
+from profiling import StageTimings, profile_call
+from tree_engine import BUNDLE_FILENAME, EngineModel, IncrementalState, compile_models, load_bundle, verify_engine
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 
+# Requests are scored on precompiled NumPy rows (see build_feature_layout), so
+# the feature-name check sklearn performs against DataFrame inputs does not apply
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
 # Create the FastAPI app
 app = FastAPI()
 
@@ -19,18 +44,283 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Model-Version", "Server-Timing"],  # Lets the frontend read which model set answered and stage timings
 )
 
 # Model storage
 MODEL_DIR = "compound_models"
 EXCEL_FILE = "training_dataset.xlsx"
+USE_DATASET_CACHE = os.environ.get("USE_DATASET_CACHE", "1") == "1"
+
+# Evaluate the gradient boosting models with the flattened tree engine instead
+# of calling model.predict per model (set USE_TREE_ENGINE=0 to disable)
+USE_TREE_ENGINE = os.environ.get("USE_TREE_ENGINE", "1") == "1"
+
+# Memory-mapped model bundle written by compound_predictor.save_models; when
+# present (and the tree engine is enabled) it replaces the per-model joblib files
+MODEL_BUNDLE = os.path.join(MODEL_DIR, BUNDLE_FILENAME)
+
+# In-process cache of /predict results keyed on the canonical formulation:
+# at most PREDICTION_CACHE_SIZE entries (0 disables it), each kept for
+# PREDICTION_CACHE_TTL seconds, amounts rounded to PREDICTION_CACHE_PRECISION decimals
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", 600))
+PREDICTION_CACHE_PRECISION = int(os.environ.get("PREDICTION_CACHE_PRECISION", 4))
+
+# Incremental prediction sessions (/predict/session): the tree engine state of
+# a formulation is kept in the API process between requests, so changing a few
+# materials only walks the trees whose splits they cross again. At most
+# PREDICTION_SESSION_LIMIT sessions are kept, each for PREDICTION_SESSION_TTL
+# seconds after its last use.
+PREDICTION_SESSION_LIMIT = int(os.environ.get("PREDICTION_SESSION_LIMIT", 1024))
+PREDICTION_SESSION_TTL = float(os.environ.get("PREDICTION_SESSION_TTL", 1800))
+
+# Where CPU-bound prediction work runs so it doesn't block the event loop:
+# "thread" (thread pool), "process" (process pool, each worker loads the
+# models once) or "inline" (on the event loop, the original behaviour).
+# At most MAX_INFLIGHT_PREDICTIONS requests are accepted at once (0 = no cap);
+# beyond that /predict answers 503.
+PREDICTION_BACKEND = os.environ.get("PREDICTION_BACKEND", "thread")
+PREDICTION_WORKERS = int(os.environ.get("PREDICTION_WORKERS", os.cpu_count() or 1))
+MAX_INFLIGHT_PREDICTIONS = int(os.environ.get("MAX_INFLIGHT_PREDICTIONS", 64))
+
+# Bulk scoring (/predict/upload): uploaded CSV/Parquet files are spooled to
+# disk past UPLOAD_SPOOL_BYTES and scored UPLOAD_CHUNK_ROWS rows at a time;
+# bodies larger than UPLOAD_MAX_BYTES are rejected with 413
+UPLOAD_CHUNK_ROWS = int(os.environ.get("UPLOAD_CHUNK_ROWS", 1024))
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", 8 * 1024 * 1024))
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Per-stage timings of /predict and /predict/batch are returned in a
+# Server-Timing header (SERVER_TIMING=0 disables it). A PROFILE_SAMPLE_RATE
+# fraction of those requests, plus any sent with "X-Profile: 1" and the admin
+# token (ignored while ADMIN_TOKEN is unset), run under cProfile and write a
+# .prof file to PROFILE_DIR, named in the X-Profile-File response header.
+# Only the newest PROFILE_MAX_FILES profiles there are kept.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 100))
+
+# Hot reload: POST /admin/reload loads and validates a new model set in the
+# background and swaps it in. With MODEL_WATCH_INTERVAL > 0 the model directory
+# and workbook are also polled every that many seconds and reloaded on change.
+# When ADMIN_TOKEN is set, admin endpoints require it in the X-Admin-Token header.
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", 0))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Per-material contributions (exact TreeSHAP) reported with /predict, for the
+# test parameters a request lists in contributionParameters or by default the
+# ones behind the key properties; cached per canonical formulation and parameter
+CONTRIBUTION_CACHE_SIZE = int(os.environ.get("CONTRIBUTION_CACHE_SIZE", 4096))
+
+# Canonical IDs (see property_registry) of the test parameters behind the key
+# properties, most preferred first; the first one the model set has is used
+KEY_PROPERTY_IDS = {
+    "tensileStrength": ["tensile_strength.unaged.160c_15min", "tensile_strength.unaged.160c_30min"],
+    "elongation": ["elongation_at_break.unaged.160c_15min", "elongation_at_break.unaged.160c_30min"],
+    "hardness": ["hardness.unaged.160c_15min", "hardness.unaged.160c_30min"],
+    "abrasionResistance": ["abrasion_loss.slip_9deg", "abrasion_loss.slip_5_5deg"],
+    "tearStrength": ["tear_strength.unaged.160c_15min", "tear_strength.unaged.160c_30min"],
+}
+
+# Unaged 100% modulus, which get_recommended_uses also reads
+MODULUS_100_IDS = ["modulus_100.unaged.160c_15min", "modulus_100.unaged.160c_30min"]
+
+# Response fields of /predict holding the key properties, in KEY_PROPERTY_IDS
+# order followed by the modulus breakdowns, and all fields a request may pick
+KEY_PROPERTY_FIELDS = list(KEY_PROPERTY_IDS) + ["modulus100", "modulus200", "modulus300", "modulus50"]
+PREDICTION_FIELDS = (
+    ["testResults", "confidenceScore", "recommendedUses"] + KEY_PROPERTY_FIELDS
+    + ["propertyRanges", "materialImpacts", "materialContributions"]
+)
+# Fields of /predict/session responses when the request names none: session
+# work runs on the event loop, where TreeSHAP contributions would take several
+# milliseconds per update, so they are only computed when asked for
+SESSION_FIELDS = [field for field in PREDICTION_FIELDS if field not in ("materialImpacts", "materialContributions")]
+
+# Canonical IDs of the test parameters behind the modulus key properties, with
+# the value reported when one isn't predicted; modulus50 is a single value,
+# the others a breakdown
+MODULUS_PROPERTIES = {
+    "modulus100": {
+        "unaged_15min": ("modulus_100.unaged.160c_15min", 2.1100),
+        "unaged_30min": ("modulus_100.unaged.160c_30min", 1.1390),
+        "aged_100C_48hrs": ("modulus_100.aged.100c_48h", 3.2700),
+        "aged_70C_7days": ("modulus_100.aged.70c_7d", 2.8147),
+    },
+    "modulus200": {
+        "unaged_15min": ("modulus_200.unaged.160c_15min", 6.0800),
+        "unaged_30min": ("modulus_200.unaged.160c_30min", 2.8721),
+        "aged_100C_48hrs": ("modulus_200.aged.100c_48h", 8.5300),
+        "aged_70C_7days": ("modulus_200.aged.70c_7d", 6.5362),
+    },
+    "modulus300": {
+        "unaged_15min": ("modulus_300.unaged.160c_15min", 11.9731),
+        "unaged_30min": ("modulus_300.unaged.160c_30min", 5.9926),
+        "aged_100C_48hrs": ("modulus_300.aged.100c_48h", 14.5008),
+        "aged_70C_7days": ("modulus_300.aged.70c_7d", 11.4306),
+    },
+    "modulus50": ("modulus_50.unaged.160c_15min", 1.2300),
+}
+
+# Inverse design (/optimize): candidates scored per search iteration, and the
+# largest evaluation budget and wall-clock limit (seconds) a request may ask for,
+# which are also the defaults
+OPTIMIZE_POPULATION = int(os.environ.get("OPTIMIZE_POPULATION", 2048))
+OPTIMIZE_MAX_EVALUATIONS = int(os.environ.get("OPTIMIZE_MAX_EVALUATIONS", 100000))
+OPTIMIZE_TIME_LIMIT = float(os.environ.get("OPTIMIZE_TIME_LIMIT", 10))
+OPTIMIZE_MAX_TOP_K = 50
+
+# Most grid points a /sweep request may ask for
+SWEEP_MAX_STEPS = int(os.environ.get("SWEEP_MAX_STEPS", 1000))
+
+class ModelSet:
+    """
+    One loaded generation of the formulation data and models
+    
+    A model set is fully built and validated before it becomes active and is
+    not modified afterwards, so a request holding a reference to it finishes
+    on that version even if a reload swaps in a new one meanwhile.
+    """
+    def __init__(self, version=None, generation=0):
+        # Fingerprint of the files the set was loaded from, and its load sequence number
+        self.version = version
+        self.generation = generation
+        self.loaded_at = None
+        # Seconds spent per load stage: dataset (workbook or its cache), models, compile
+        self.load_timings = {}
+        
+        self.models = {}
+        self.formulation_matrix = None
+        self.formulation_df = None
+        self.raw_materials = []
+        self.recipes = []
+        
+        # Feature layout compiled at load time: material name -> column index in the
+        # request matrix, and per model the column permutation matching feature_names_in_
+        self.material_index = {}
+        self.model_feature_orders = {}
+        
+        # Recipe name -> list of (material, amount) for the materials it uses
+        self.recipe_compositions = {}
+        
+        # Nearest-recipe index over the formulation matrix, and recipe name ->
+        # {test parameter: measured result} from the evaluation sheet
+        self.recipe_index = None
+        self.measured_results = {}
+        
+        # Recipe name -> predictions for its composition and -> measured results
+        # keyed by model test parameter, computed at load time, and canonical
+        # formulation -> recipe name for matching /predict requests
+        self.recipe_predictions = {}
+        self.recipe_measured = {}
+        self.recipe_formulations = {}
+        
+        # Flattened tree engine compiled from the loaded models (None when disabled)
+        self.tree_engine = None
+        
+        # Test parameter -> tree engine index for the models TreeSHAP can explain,
+        # and the ones explained when a request doesn't choose
+        self.explainable = {}
+        self.contribution_params = []
+        
+        # Test parameters parsed into canonical IDs, and /predict response
+        # field -> test parameters it is read from
+        self.property_registry = PropertyRegistry()
+        self.field_params = {}
 
-# Load models at startup
-models = {}
-formulation_matrix = None
-formulation_df = None
-raw_materials = []
-recipes = []
+# The active model set; reloads replace this reference, never its contents
+active_model_set = ModelSet()
+reload_lock = asyncio.Lock()
+model_watcher = None
+
+prediction_cache = PredictionCache(maxsize=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+contribution_cache = PredictionCache(maxsize=CONTRIBUTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+prediction_sessions = PredictionCache(maxsize=PREDICTION_SESSION_LIMIT, ttl=PREDICTION_SESSION_TTL)
+
+# Prediction backend (None runs inline) and the number of requests using it;
+# the counter is only touched from the event loop
+prediction_executor = None
+inflight_predictions = 0
+
+# Metrics served at /metrics in the Prometheus text format. Model-level
+# metrics cover predictions made in this process (with PREDICTION_BACKEND=process
+# they are recorded in the workers and not visible here).
+metrics_registry = Registry()
+REQUESTS = metrics_registry.register(Counter(
+    "http_requests_total", "HTTP requests by method, route and status", ["method", "endpoint", "status"]
+))
+REQUEST_LATENCY = metrics_registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["endpoint"]
+))
+MODEL_LATENCY = metrics_registry.register(Histogram(
+    "model_predict_duration_seconds",
+    "Latency of one model.predict call on a feature matrix; tree engine models get the share of "
+    "each engine pass their trees make up",
+    ["test_param"]
+))
+TREE_ENGINE_LATENCY = metrics_registry.register(Histogram(
+    "tree_engine_predict_duration_seconds", "Latency of one tree engine pass over all compiled models"
+))
+MODEL_FAILURES = metrics_registry.register(Counter(
+    "model_predict_failures_total", "Model predictions that raised and were returned as None", ["test_param"]
+))
+metrics_registry.register(GaugeFunc(
+    "model_set_load_seconds", "Time spent loading the active model set, by stage",
+    lambda: {(stage,): seconds for stage, seconds in active_model_set.load_timings.items()}, ["stage"]
+))
+metrics_registry.register(GaugeFunc(
+    "model_set_models", "Models in the active model set", lambda: len(active_model_set.models)
+))
+metrics_registry.register(GaugeFunc(
+    "model_set_generation", "Load sequence number of the active model set", lambda: active_model_set.generation
+))
+metrics_registry.register(GaugeFunc(
+    "prediction_cache_requests", "Prediction cache lookups by result",
+    lambda: {(result,): prediction_cache.stats()[result] for result in ("hits", "misses")}, ["result"]
+))
+metrics_registry.register(GaugeFunc(
+    "prediction_sessions", "Open incremental prediction sessions", lambda: prediction_sessions.stats()["size"]
+))
+metrics_registry.register(GaugeFunc(
+    "inflight_predictions", "Prediction requests currently running", lambda: inflight_predictions
+))
+metrics_registry.register(GaugeFunc(
+    "process_resident_memory_bytes", "Resident set size of the API process", process_rss_bytes
+))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them per route template, adding any stage timings as Server-Timing"""
+    started = time.perf_counter()
+    request.state.started = started
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        
+        timings = getattr(request.state, "timings", None)
+        if timings is not None:
+            finished = time.perf_counter()
+            # From the endpoint returning to the response being ready: response model
+            # validation and JSON encoding (not recorded when the endpoint raised)
+            handler_finished = getattr(request.state, "handler_finished", None)
+            if handler_finished is not None:
+                timings.add("serialize", finished - handler_finished)
+            timings.add("total", finished - started)
+            if SERVER_TIMING:
+                response.headers["Server-Timing"] = timings.server_timing()
+            profile_path = getattr(request.state, "profile_path", None)
+            if profile_path is not None:
+                response.headers["X-Profile-File"] = os.path.basename(profile_path)
+        return response
+    finally:
+        # The route template keeps label cardinality bounded
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUESTS.inc(request.method, endpoint, str(status))
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint)
 
 # Pydantic models for request/response
 class MaterialComposition(BaseModel):
@@ -39,22 +329,49 @@ class MaterialComposition(BaseModel):
 
 class PredictionRequest(BaseModel):
     materialCompositions: List[MaterialComposition]
+    contributionParameters: Optional[List[str]] = None
+    # Test parameters or property groups (e.g. "unaged_modulus") to return in
+    # testResults, and the response fields to return; everything when omitted
+    targets: Optional[List[str]] = None
+    fields: Optional[List[str]] = None
 
+# Fields a request didn't ask for are left out of the response
 class PredictionResponse(BaseModel):
-    testResults: Dict[str, Union[float, str]]
-    confidenceScore: float
-    recommendedUses: List[str]
-    tensileStrength: float
-    elongation: float
-    hardness: float
-    abrasionResistance: float
-    tearStrength: float
-    modulus100: Dict[str, Union[float, str]]
-    modulus200: Dict[str, Union[float, str]]
-    modulus300: Dict[str, Union[float, str]]
-    modulus50: float
-    propertyRanges: Dict[str, Dict[str, float]]
-    materialImpacts: Dict[str, float]
+    testResults: Optional[Dict[str, Union[float, str]]] = None
+    confidenceScore: Optional[float] = None
+    recommendedUses: Optional[List[str]] = None
+    tensileStrength: Optional[float] = None
+    elongation: Optional[float] = None
+    hardness: Optional[float] = None
+    abrasionResistance: Optional[float] = None
+    tearStrength: Optional[float] = None
+    modulus100: Optional[Dict[str, Union[float, str]]] = None
+    modulus200: Optional[Dict[str, Union[float, str]]] = None
+    modulus300: Optional[Dict[str, Union[float, str]]] = None
+    modulus50: Optional[float] = None
+    propertyRanges: Optional[Dict[str, Dict[str, float]]] = None
+    materialImpacts: Optional[Dict[str, float]] = None
+    materialContributions: Optional[Dict[str, Dict[str, float]]] = None
+
+class SessionPredictionResponse(PredictionResponse):
+    sessionId: Optional[str] = None
+    # Trees walked to answer this request (all of them when the session started)
+    treesEvaluated: Optional[int] = None
+
+class BatchPredictionRequest(BaseModel):
+    formulations: List[PredictionRequest]
+
+class BatchPredictionResponse(BaseModel):
+    results: List[PredictionResponse]
+
+class CacheStatsResponse(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
 
 class RecipeListResponse(BaseModel):
     recipes: List[str]
@@ -62,15 +379,139 @@ class RecipeListResponse(BaseModel):
 class MaterialListResponse(BaseModel):
     materials: List[str]
 
+class PropertyInfo(BaseModel):
+    id: str
+    testParameter: str
+    property: str
+    unit: Optional[str] = None
+    condition: Optional[str] = None
+    temperature: Optional[int] = None
+    duration: Optional[str] = None
+    qualifier: Optional[str] = None
+
+class PropertyListResponse(BaseModel):
+    properties: List[PropertyInfo]
+
 class RecipeRequest(BaseModel):
     recipeName: str
 
 class RecipeCompositionResponse(BaseModel):
     materialCompositions: List[MaterialComposition]
 
-def load_data():
-    """Load the formulation data and models"""
-    global models, formulation_matrix, formulation_df, raw_materials, recipes
+class RecipeResult(BaseModel):
+    predicted: Optional[float] = None
+    measured: Optional[float] = None
+
+class RecipePredictionsResponse(BaseModel):
+    recipeName: str
+    results: Dict[str, RecipeResult]
+
+class BulkRecipeRequest(BaseModel):
+    recipeNames: List[str]
+
+class BulkRecipeCompositionResponse(BaseModel):
+    compositions: Dict[str, List[MaterialComposition]]
+    missing: List[str]
+
+class TargetRange(BaseModel):
+    testParameter: str
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class MaterialBound(BaseModel):
+    material: str
+    min: float = 0
+    max: float
+
+class OptimizationRequest(BaseModel):
+    targets: List[TargetRange]
+    materials: List[MaterialBound]
+    baseRecipe: Optional[str] = None
+    topK: int = 5
+    maxEvaluations: Optional[conint(gt=0)] = None
+    timeLimit: Optional[confloat(gt=0)] = None
+    seed: Optional[int] = None
+
+class OptimizedFormulation(BaseModel):
+    materialCompositions: List[MaterialComposition]
+    testResults: Dict[str, Optional[float]]
+    targetsMet: bool
+    targetViolation: float
+
+class OptimizationResponse(BaseModel):
+    results: List[OptimizedFormulation]
+    evaluations: int
+    iterations: int
+    elapsedSeconds: float
+
+class SweepRequest(BaseModel):
+    materialCompositions: List[MaterialComposition]
+    material: str
+    start: float
+    stop: float
+    steps: int = 50
+
+class SweepResponse(BaseModel):
+    material: str
+    values: List[float]
+    curves: Dict[str, List[Optional[float]]]
+
+class SimilarRequest(BaseModel):
+    materialCompositions: List[MaterialComposition]
+    k: int = 5
+
+class SimilarRecipe(BaseModel):
+    recipeName: str
+    distance: float
+    measuredResults: Dict[str, float]
+
+class SimilarResponse(BaseModel):
+    recipes: List[SimilarRecipe]
+    unknownMaterials: List[str]
+
+class ModelSetResponse(BaseModel):
+    version: Optional[str]
+    generation: int
+    loadedAt: Optional[float]
+    models: int
+    engineModels: int
+
+class ReloadResponse(ModelSetResponse):
+    previousVersion: Optional[str]
+
+def source_fingerprint():
+    """
+    Fingerprint the files a model set is loaded from
+    
+    Covers the name, size and modification time of every model file in
+    MODEL_DIR and of the workbook, so any retrain or data update changes it.
+    """
+    digest = hashlib.sha256()
+    paths = [EXCEL_FILE]
+    if os.path.isdir(MODEL_DIR):
+        paths += sorted(
+            os.path.join(MODEL_DIR, f) for f in os.listdir(MODEL_DIR)
+            if f.endswith("_model.joblib") or f == BUNDLE_FILENAME
+        )
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f"{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def load_model_set(generation=1, previous=None):
+    """
+    Load the formulation data and models into a new ModelSet
+    
+    Nothing global is touched, so this can run in the background while the
+    active model set keeps serving requests. Parts of the previous model set
+    that are still valid (the recipe index) are reused.
+    """
+    # Fingerprint before reading: files changing during the load give the
+    # next fingerprint check a different value, which triggers another reload
+    model_set = ModelSet(version=source_fingerprint(), generation=generation)
     
     # Check if models directory exists
     if not os.path.exists(MODEL_DIR):
@@ -80,120 +521,360 @@ def load_data():
     if not os.path.exists(EXCEL_FILE):
         raise FileNotFoundError(f"Training data file {EXCEL_FILE} not found")
     
+    # Load the preprocessed formulation data, from the columnar cache when
+    # it is fresh (USE_DATASET_CACHE=0 always parses the workbook)
+    stage_started = time.perf_counter()
+    dataset = load_dataset(EXCEL_FILE, use_cache=USE_DATASET_CACHE)
+    model_set.load_timings["dataset"] = time.perf_counter() - stage_started
+    model_set.formulation_df = dataset["formulation_df"]
+    model_set.formulation_matrix = dataset["formulation_matrix"]
+    
+    # Store raw materials and recipes for later use
+    model_set.raw_materials = dataset["raw_materials"]
+    model_set.recipes = dataset["recipes"]
+    
+    # Index recipe compositions so lookups don't touch pandas
+    build_recipe_compositions(model_set)
+    build_measured_results(model_set, dataset["evaluation_long"])
+    build_recipe_index(model_set, previous)
+    
+    # Load models, preferring the single-file bundle
+    stage_started = time.perf_counter()
+    bundle_loaded = False
+    if USE_TREE_ENGINE and os.path.exists(MODEL_BUNDLE):
+        try:
+            load_model_bundle(model_set, MODEL_BUNDLE)
+            bundle_loaded = True
+        except Exception as e:
+            print(f"Error loading model bundle {MODEL_BUNDLE}: {str(e)}; falling back to joblib files")
+            model_set.models = {}
+    
+    if not bundle_loaded:
+        load_model_files(model_set)
+    model_set.load_timings["models"] = time.perf_counter() - stage_started
+    
+    # Precompile the request feature layout
+    stage_started = time.perf_counter()
+    build_feature_layout(model_set)
+    
+    # Compile the tree engine (the bundle already provides one)
+    if USE_TREE_ENGINE and not bundle_loaded:
+        build_tree_engine(model_set)
+    
+    # Parse the test parameter names once, for lookups by canonical ID
+    model_set.property_registry = PropertyRegistry(model_set.models)
+    build_explainable(model_set)
+    build_field_params(model_set)
+    model_set.load_timings["compile"] = time.perf_counter() - stage_started
+    
+    # Predict the known recipes once; validation and /predict reuse the results
+    stage_started = time.perf_counter()
+    build_recipe_predictions(model_set)
+    model_set.load_timings["materialize"] = time.perf_counter() - stage_started
+    
+    model_set.loaded_at = time.time()
+    
+    print(f"Loaded {len(model_set.models)} models (model set {model_set.version})")
+    print(f"Loaded {len(model_set.raw_materials)} raw materials")
+    print(f"Loaded {len(model_set.recipes)} recipes")
+    
+    return model_set
+
+def validate_model_set(model_set, previous=None):
+    """
+    Check a freshly loaded model set before it is made active
+    
+    Every model must give a finite prediction for every known recipe. Test
+    parameters the previous model set had but this one lacks are reported.
+    Raises ValueError when the set can't serve predictions.
+    """
+    if not model_set.models:
+        raise ValueError("no models loaded")
+    
+    # The recipe predictions materialized at load time cover the known recipes
+    failed = set()
+    for predictions in model_set.recipe_predictions.values():
+        failed.update(p for p, v in predictions.items() if v is None or not np.isfinite(v))
+    if failed:
+        raise ValueError(f"models fail on the known recipes: {sorted(failed)}")
+    
+    if previous is not None:
+        dropped = sorted(set(previous.models) - set(model_set.models))
+        if dropped:
+            print(f"Model set {model_set.version} no longer has models for {dropped}")
+
+def activate_model_set(model_set):
+    """Make a loaded model set the one new requests use, returning the previous one"""
+    global active_model_set
+    previous = active_model_set
+    # A single reference assignment: requests already running keep the set they took
+    active_model_set = model_set
+    
+    # Entries of the previous version can no longer be hit
+    if previous.version != model_set.version:
+        prediction_cache.clear()
+        contribution_cache.clear()
+    return previous
+
+def load_data():
+    """Load the formulation data and models and make them the active model set"""
     try:
-        # Load Excel data
-        formulation_df = pd.read_excel(EXCEL_FILE, sheet_name='Compound_Formulation')
-        
-        # Extract column names
-        id_cols = formulation_df.columns.tolist()[:2]
-        recipe_names = formulation_df.columns.tolist()[2:]
-        
-        # Store recipes for later use
-        recipes = recipe_names
-        
-        # Clean formulation data - replace spaces, empty strings with NaN
-        for col in recipe_names:
-            formulation_df[col] = pd.to_numeric(formulation_df[col], errors='coerce')
-        
-        # Transform formulation data from wide to long format
-        formulation_long = pd.melt(
-            formulation_df, 
-            id_vars=id_cols,
-            value_vars=recipe_names,
-            var_name='Recipe_Name',
-            value_name='Composition_Amount'
-        )
-        
-        # Filter out rows where raw materials are not used in recipes (NaN or 0)
-        formulation_long = formulation_long.dropna(subset=['Composition_Amount'])
-        # Ensure Composition_Amount is float before comparison
-        formulation_long['Composition_Amount'] = pd.to_numeric(formulation_long['Composition_Amount'], errors='coerce')
-        formulation_long = formulation_long[formulation_long['Composition_Amount'] > 0]
-        
-        # Get the name of the column that contains the raw material names (second column)
-        raw_material_col = id_cols[1]
-        
-        # Store raw materials for later use
-        raw_materials = formulation_df[raw_material_col].tolist()
-        
-        # Create the formulation matrix
-        formulation_matrix = formulation_long.pivot(
-            index='Recipe_Name',
-            columns=raw_material_col,
-            values='Composition_Amount'
-        )
-        
-        # Fill NaN values with 0 (raw materials not used in certain recipes)
-        formulation_matrix = formulation_matrix.fillna(0)
-        
-        # Load models
-        model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith("_model.joblib")]
-        
-        for model_file in model_files:
-            try:
-                # Extract test parameter name from filename
-                test_param = model_file.replace("_model.joblib", "").replace("_", " ")
-                
-                # Load the model
-                model_path = os.path.join(MODEL_DIR, model_file)
-                model = joblib.load(model_path)
-                
-                # Store in dictionary
-                models[test_param] = model
-                
-            except Exception as e:
-                print(f"Error loading model {model_file}: {str(e)}")
-        
-        print(f"Loaded {len(models)} models")
-        print(f"Loaded {len(raw_materials)} raw materials")
-        print(f"Loaded {len(recipes)} recipes")
-        
+        activate_model_set(load_model_set(active_model_set.generation + 1))
     except Exception as e:
         print(f"Error during data loading: {str(e)}")
         raise e
 
-def predict_new_formulation(new_formulation):
+def load_model_files(model_set):
+    """Load each model from its own joblib file in MODEL_DIR"""
+    model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith("_model.joblib")]
+    
+    for model_file in model_files:
+        try:
+            # Extract test parameter name from filename
+            test_param = model_file.replace("_model.joblib", "").replace("_", " ")
+            
+            # Load the model
+            model_path = os.path.join(MODEL_DIR, model_file)
+            model = joblib.load(model_path)
+            
+            # Store in dictionary
+            model_set.models[test_param] = model
+        
+        except Exception as e:
+            print(f"Error loading model {model_file}: {str(e)}")
+
+def load_model_bundle(model_set, bundle_path):
+    """Open the memory-mapped model bundle and register its models under their exact names"""
+    engine, manifest = load_bundle(bundle_path)
+    if engine.feature_names != model_set.formulation_matrix.columns.tolist():
+        raise ValueError("bundle raw materials don't match the formulation matrix")
+    
+    bundled_models = {test_param: EngineModel(engine, j) for j, test_param in enumerate(engine.test_params)}
+    
+    # Models the bundle could not hold are still loaded from their joblib files
+    for test_param, model_file in manifest["unbundled"].items():
+        bundled_models[test_param] = joblib.load(os.path.join(MODEL_DIR, model_file))
+    
+    model_set.models.update(bundled_models)
+    model_set.tree_engine = engine
+    print(f"Loaded model bundle {bundle_path} (format version {manifest['format_version']})")
+
+def build_feature_layout(model_set):
+    """Build the material -> column index map and each model's column permutation"""
+    # One column per raw material in the formulation matrix, plus a trailing
+    # column that is always 0 for features a model expects but the matrix lacks
+    material_index = {material: i for i, material in enumerate(model_set.formulation_matrix.columns)}
+    padding_col = len(material_index)
+    
+    model_feature_orders = {}
+    for test_param, model in model_set.models.items():
+        if hasattr(model, 'feature_names_in_'):
+            missing_features = [f for f in model.feature_names_in_ if f not in material_index]
+            if missing_features:
+                print(f"Model {test_param} expects features missing from the formulation matrix: {missing_features}")
+            model_feature_orders[test_param] = np.array(
+                [material_index.get(f, padding_col) for f in model.feature_names_in_], dtype=np.intp
+            )
+        else:
+            # For models that don't specify feature names, use the matrix order
+            model_feature_orders[test_param] = np.arange(padding_col, dtype=np.intp)
+    
+    model_set.material_index = material_index
+    model_set.model_feature_orders = model_feature_orders
+
+def build_tree_engine(model_set):
+    """Compile the loaded models into the flattened tree engine and check it against sklearn"""
+    models = model_set.models
+    feature_names = model_set.formulation_matrix.columns.tolist()
+    engine, skipped = compile_models(models, feature_names)
+    for test_param, reason in skipped.items():
+        print(f"Tree engine skipping {test_param}: {reason}")
+    
+    if engine is not None:
+        # Models whose engine output doesn't match model.predict on the known
+        # recipes stay on the sklearn path
+        X = build_feature_matrix(model_set, model_set.formulation_matrix.to_dict('records'))
+        mismatched = verify_engine(engine, models, X, model_set.model_feature_orders)
+        if mismatched:
+            print(f"Tree engine output differs from sklearn for {mismatched}; using sklearn for those")
+            engine, _ = compile_models(
+                {p: m for p, m in models.items() if p not in mismatched and p not in skipped},
+                feature_names
+            )
+    
+    model_set.tree_engine = engine
+    print(f"Tree engine compiled {len(engine.test_params) if engine else 0} models")
+
+def build_explainable(model_set):
+    """Index the tree models TreeSHAP can explain and precompute their leaf paths"""
+    engine = model_set.tree_engine
+    explainable = {}
+    if engine is not None:
+        for index, test_param in enumerate(engine.test_params):
+            if engine.has_trees(index):
+                # Tabulate the TreeSHAP terms now rather than on the first request
+                engine.shap_table(index)
+                explainable[test_param] = index
+    
+    contribution_params = []
+    registry = model_set.property_registry
+    for ids in KEY_PROPERTY_IDS.values():
+        matches = [registry.by_id[i] for i in ids if registry.by_id.get(i) in explainable]
+        if matches and matches[0] not in contribution_params:
+            contribution_params.append(matches[0])
+    
+    model_set.explainable = explainable
+    model_set.contribution_params = contribution_params
+
+def build_field_params(model_set):
+    """Index the test parameters behind each /predict response field"""
+    registry = model_set.property_registry
+    
+    def first_match(ids):
+        test_param = registry.first(ids)
+        return [test_param] if test_param is not None else []
+    
+    field_params = {field: first_match(ids) for field, ids in KEY_PROPERTY_IDS.items()}
+    for field, properties in MODULUS_PROPERTIES.items():
+        ids = [properties[0]] if field == "modulus50" else [i for i, _ in properties.values()]
+        field_params[field] = [registry.by_id[i] for i in ids if i in registry.by_id]
+    
+    # The properties get_recommended_uses reads
+    field_params["recommendedUses"] = (
+        field_params["tensileStrength"] + field_params["elongation"] + field_params["hardness"]
+        + field_params["abrasionResistance"] + first_match(MODULUS_100_IDS)
+    )
+    model_set.field_params = field_params
+
+def build_feature_matrix(model_set, new_formulations):
+    """Fill a preallocated feature matrix (one row per formulation) in formulation matrix column order"""
+    material_index = model_set.material_index
+    X = np.zeros((len(new_formulations), len(material_index) + 1))
+    for row, new_formulation in enumerate(new_formulations):
+        for material, amount in new_formulation.items():
+            col = material_index.get(material)
+            # Raw materials the models don't know about are ignored
+            if col is not None:
+                X[row, col] = amount
+    return X
+
+def predict_matrix(model_set, X, test_params=None):
     """
-    Predict test results for a new formulation
+    Predict test results for the rows of a feature matrix in one pass per model
     
     Parameters:
-    - new_formulation: Dictionary mapping raw material names to composition amounts
+    - model_set: ModelSet to predict with
+    - X: Feature matrix from build_feature_matrix
+    - test_params: Test parameters to predict (all models if None)
     
     Returns:
-    - Dictionary of predicted test results
+    - Dictionary mapping each test parameter to an array of predictions, or
+      None when its model failed
     """
-    # Create a DataFrame for the new formulation
-    raw_materials = formulation_matrix.columns.tolist()
-    new_form_df = pd.DataFrame([new_formulation], index=['new_formulation'])
+    if test_params is None:
+        test_params = list(model_set.models)
     
-    # Fill missing values with 0 (raw materials not used)
-    for rm in raw_materials:
-        if rm not in new_form_df.columns:
-            new_form_df[rm] = 0
+    # Evaluate the compiled models in one pass of the tree engine, walking
+    # only the trees of the requested ones
+    engine_columns = {}
+    engine = model_set.tree_engine
+    if engine is not None:
+        engine_params = [test_param for test_param in test_params if test_param in engine.model_index]
+        if engine_params:
+            models = None
+            if len(engine_params) < len(engine.test_params):
+                models = [engine.model_index[test_param] for test_param in engine_params]
+            else:
+                engine_params = engine.test_params
+            started = time.perf_counter()
+            engine_preds = engine.predict(X, models)
+            elapsed = time.perf_counter() - started
+            TREE_ENGINE_LATENCY.observe(elapsed)
+            # The engine walks all its trees at once; walking and summing leaves
+            # are linear in the trees, so each model is charged its trees' share
+            tree_counts = engine.model_tree_counts[models] if models is not None else engine.model_tree_counts
+            MODEL_LATENCY.observe_many(
+                (elapsed / tree_counts.sum() * tree_counts).tolist(), [(test_param,) for test_param in engine_params]
+            )
+            engine_columns = dict(zip(engine_params, engine_preds.T))
     
-    # Make predictions
-    predictions = {}
-    for test_param, model in models.items():
+    # Make predictions, calling each remaining model once on the whole matrix
+    columns = {}
+    for test_param in test_params:
         try:
-            # Make sure we have all the features the model expects
-            if hasattr(model, 'feature_names_in_'):
-                # For scikit-learn models that have feature_names_in_
-                missing_features = set(model.feature_names_in_) - set(new_form_df.columns)
-                for feature in missing_features:
-                    new_form_df[feature] = 0
-                
+            preds = engine_columns.get(test_param)
+            if preds is None:
                 # Reorder columns to match the model's expected feature order
-                new_form_df_ordered = new_form_df[model.feature_names_in_]
-            else:
-                # For models that don't specify feature names
-                new_form_df_ordered = new_form_df
-            
-            # Predict
-            pred = model.predict(new_form_df_ordered)[0]
-            predictions[test_param] = float(pred)  # Convert numpy types to Python float
+                model = model_set.models[test_param]
+                started = time.perf_counter()
+                preds = model.predict(X[:, model_set.model_feature_orders[test_param]])
+                MODEL_LATENCY.observe(time.perf_counter() - started, test_param)
+            columns[test_param] = np.asarray(preds, dtype=float)
         except Exception as e:
             print(f"Error predicting {test_param}: {str(e)}")
-            predictions[test_param] = None
+            MODEL_FAILURES.inc(test_param)
+            columns[test_param] = None
+    
+    return columns
+
+def predict_formulations(model_set, new_formulations, test_params=None):
+    """
+    Predict test results for several formulations in one pass per model
+    
+    Parameters:
+    - model_set: ModelSet to predict with
+    - new_formulations: List of dictionaries mapping raw material names to composition amounts
+    - test_params: Test parameters to predict (all models if None)
+    
+    Returns:
+    - List of dictionaries of predicted test results, one per formulation
+    """
+    # Build one dense feature matrix; raw materials not used in a formulation are 0
+    X = build_feature_matrix(model_set, new_formulations)
+    
+    predictions = [{} for _ in new_formulations]
+    for test_param, preds in predict_matrix(model_set, X, test_params).items():
+        for row, row_predictions in enumerate(predictions):
+            # Convert numpy types to Python float
+            row_predictions[test_param] = float(preds[row]) if preds is not None else None
+    
+    return predictions
+
+def predict_new_formulation(model_set, new_formulation, test_params=None):
+    """
+    Predict test results for a new formulation
+    
+    Parameters:
+    - model_set: ModelSet to predict with
+    - new_formulation: Dictionary mapping raw material names to composition amounts
+    - test_params: Test parameters to predict (all models if None)
+    
+    Returns:
+    - Dictionary of predicted test results
+    """
+    canonical = canonicalize_formulation(new_formulation, PREDICTION_CACHE_PRECISION)
+    
+    # Known recipes were predicted when the model set loaded
+    recipe_name = model_set.recipe_formulations.get(canonical)
+    if recipe_name is not None:
+        stored = model_set.recipe_predictions[recipe_name]
+        return dict(stored) if test_params is None else {test_param: stored[test_param] for test_param in test_params}
+    
+    # Keyed on the model set version too, so a reload never serves old results
+    cache_key = (model_set.version, canonical)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached) if test_params is None else {test_param: cached[test_param] for test_param in test_params}
+    
+    # Subsets are cached under their own key; a full prediction serves them too
+    if test_params is not None:
+        cache_key += (tuple(test_params),)
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+    
+    predictions = predict_formulations(model_set, [new_formulation], test_params)[0]
+    prediction_cache.put(cache_key, dict(predictions))
     
     # Add the specified test parameters if they're not in predictions
 #     default_parameters = {
@@ -251,14 +932,187 @@ def predict_new_formulation(new_formulation):
     
     return predictions
 
-def get_recommended_uses(predictions):
+class PredictionSession:
+    """
+    A formulation whose predictions are kept current as its materials change
+    
+    The tree engine models are updated incrementally (see
+    tree_engine.IncrementalState) and give the same results as predicting the
+    formulation from scratch; any other models are predicted in full.
+    """
+    
+    def __init__(self, model_set, new_formulation):
+        self.model_set = model_set
+        self.formulation = {material: amount for material, amount in new_formulation.items() if amount != 0}
+        engine = model_set.tree_engine
+        self.state = None
+        self.trees_evaluated = 0
+        if engine is not None:
+            self.state = IncrementalState(engine, build_feature_matrix(model_set, [self.formulation])[0])
+            self.trees_evaluated = engine.n_trees
+    
+    def update(self, changes):
+        """
+        Set the amounts of some materials, 0 removing them
+        
+        Parameters:
+        - changes: Dictionary mapping raw material names to their new amounts
+        """
+        for material, amount in changes.items():
+            if amount != 0:
+                self.formulation[material] = amount
+            else:
+                self.formulation.pop(material, None)
+        
+        self.trees_evaluated = 0
+        if self.state is not None:
+            material_index = self.model_set.material_index
+            # Raw materials the models don't know about are ignored
+            self.trees_evaluated = self.state.update({
+                material_index[material]: amount for material, amount in changes.items() if material in material_index
+            })
+    
+    def predict(self, test_params=None):
+        """Return the predicted test results of the current formulation (all models if test_params is None)"""
+        model_set = self.model_set
+        if test_params is None:
+            test_params = list(model_set.models)
+        
+        predictions = {}
+        engine = model_set.tree_engine
+        if self.state is not None:
+            predictions = dict(zip(engine.test_params, self.state.predict().tolist()))
+        remaining = [test_param for test_param in test_params if test_param not in predictions]
+        if remaining:
+            predictions.update(predict_formulations(model_set, [self.formulation], remaining)[0])
+        return {test_param: predictions[test_param] for test_param in test_params}
+
+def explain_formulations(model_set, new_formulations, test_params):
+    """
+    Compute per-material contributions (exact TreeSHAP) for several formulations
+    
+    Contributions are in the model's raw output space (log1p units for models
+    trained on a log1p target) and, per test parameter, add up to the raw
+    prediction minus the model's mean raw output over its training data.
+    
+    Parameters:
+    - model_set: ModelSet to explain with
+    - new_formulations: List of dictionaries mapping raw material names to composition amounts
+    - test_params: For each formulation, the explainable test parameters to explain
+    
+    Returns:
+    - List of dictionaries mapping test parameters to {material: contribution},
+      one per formulation; materials with no contribution are left out
+    """
+    results = [{} for _ in new_formulations]
+    
+    # Look up every (formulation, parameter) pair, collecting the misses per parameter
+    missing = {}
+    cache_keys = []
+    for row, (new_formulation, row_params) in enumerate(zip(new_formulations, test_params)):
+        canonical = canonicalize_formulation(new_formulation, PREDICTION_CACHE_PRECISION)
+        cache_keys.append(canonical)
+        for test_param in row_params:
+            cached = contribution_cache.get((model_set.version, canonical, test_param))
+            if cached is not None:
+                results[row][test_param] = dict(cached)
+            else:
+                missing.setdefault(test_param, []).append(row)
+    
+    if missing:
+        X = build_feature_matrix(model_set, new_formulations)
+        # Plain list: indexing the formulation matrix columns costs microseconds per lookup
+        materials = list(model_set.material_index)
+        
+        # Parameters missing for the same rows are explained in one batched TreeSHAP pass
+        groups = {}
+        for test_param, rows in missing.items():
+            groups.setdefault(tuple(rows), []).append(test_param)
+        for rows, group_params in groups.items():
+            indices = [model_set.explainable[test_param] for test_param in group_params]
+            phi = model_set.tree_engine.shap_values_many(X[list(rows)], indices)
+            for row, row_phi in zip(rows, phi[:, :, :-1].tolist()):
+                for test_param, param_phi in zip(group_params, row_phi):
+                    contributions = {material: value for material, value in zip(materials, param_phi) if value}
+                    contribution_cache.put((model_set.version, cache_keys[row], test_param), dict(contributions))
+                    results[row][test_param] = contributions
+    
+    return results
+
+def resolve_contribution_params(model_set, requested):
+    """Return the explainable test parameters a request asked for, or the default ones if it didn't"""
+    if requested is None:
+        return model_set.contribution_params
+    
+    test_params = []
+    for name in requested:
+        test_param = resolve_test_param(model_set, name)
+        if test_param is None:
+            raise InvalidRequestError(f"Unknown test parameter: {name}")
+        if test_param not in model_set.explainable:
+            raise InvalidRequestError(f"No contributions available for {name}")
+        if test_param not in test_params:
+            test_params.append(test_param)
+    return test_params
+
+def resolve_targets(model_set, targets):
+    """
+    Return the test parameters a request's targets name, in model order
+    
+    A target is a test parameter name (exact or normalized) or a property
+    group: words joined by underscores, matching every test parameter whose
+    name contains all of them, e.g. "unaged_modulus" or "tensile".
+    """
+    selected = set()
+    for name in targets:
+        test_param = resolve_test_param(model_set, name)
+        if test_param is not None:
+            selected.add(test_param)
+            continue
+        matches = model_set.property_registry.matching(normalize_test_param(name).lower().split())
+        if not matches:
+            raise InvalidRequestError(f"Unknown test parameter or property group: {name}")
+        selected.update(matches)
+    return [test_param for test_param in model_set.models if test_param in selected]
+
+def plan_prediction(model_set, targets=None, fields=None):
+    """
+    Work out what a /predict request needs computed
+    
+    Parameters:
+    - model_set: ModelSet the request runs on
+    - targets: Test parameters or property groups to return in testResults (all if None)
+    - fields: Response fields to return (all if None)
+    
+    Returns:
+    - (response fields, test parameters returned in testResults or None for
+      all, test parameters to predict in model order or None for all)
+    """
+    if fields is None:
+        fields = PREDICTION_FIELDS
+    else:
+        unknown = [field for field in fields if field not in PREDICTION_FIELDS]
+        if unknown:
+            raise InvalidRequestError(f"Unknown response fields: {', '.join(unknown)}")
+    
+    result_params = resolve_targets(model_set, targets) if targets is not None else None
+    if result_params is None and ("testResults" in fields or "confidenceScore" in fields):
+        return fields, None, None
+    
+    # testResults and the confidence score cover the targets; the other
+    # fields are read from a few fixed properties
+    needed = set(result_params or []) if ("testResults" in fields or "confidenceScore" in fields) else set()
+    for field in fields:
+        needed.update(model_set.field_params.get(field, []))
+    return fields, result_params, [test_param for test_param in model_set.models if test_param in needed]
+
+def get_recommended_uses(predictions, registry):
     """Generate recommended uses based on predicted properties"""
     uses = []
     
     # Check for tensile strength
-    tensile_keys = [k for k in predictions.keys() if 'Tensile strength' in k and 'Unaged' in k]
-    if tensile_keys:
-        tensile_value = predictions[tensile_keys[0]]
+    tensile_value = predictions.get(registry.first(KEY_PROPERTY_IDS["tensileStrength"]))
+    if tensile_value is not None:
         # Ensure tensile_value is numeric before comparison
         if tensile_value != "NA" and not isinstance(tensile_value, str):
             tensile = float(tensile_value)
@@ -268,9 +1122,8 @@ def get_recommended_uses(predictions):
                 uses.append("Medium-duty mechanical parts")
     
     # Check for elongation
-    elongation_keys = [k for k in predictions.keys() if 'Elongation at break' in k and 'Unaged' in k]
-    if elongation_keys:
-        elongation_value = predictions[elongation_keys[0]]
+    elongation_value = predictions.get(registry.first(KEY_PROPERTY_IDS["elongation"]))
+    if elongation_value is not None:
         # Ensure elongation_value is numeric before comparison
         if elongation_value != "NA" and not isinstance(elongation_value, str):
             elongation = float(elongation_value)
@@ -280,9 +1133,8 @@ def get_recommended_uses(predictions):
                 uses.append("Flexible sealing applications")
     
     # Check for hardness
-    hardness_keys = [k for k in predictions.keys() if 'Hardness Shore A' in k and 'Unaged' in k]
-    if hardness_keys:
-        hardness_value = predictions[hardness_keys[0]]
+    hardness_value = predictions.get(registry.first(KEY_PROPERTY_IDS["hardness"]))
+    if hardness_value is not None:
         # Ensure hardness_value is numeric before comparison
         if hardness_value != "NA" and not isinstance(hardness_value, str):
             hardness = float(hardness_value)
@@ -296,9 +1148,8 @@ def get_recommended_uses(predictions):
                 uses.append("Soft, high-compliance applications")
     
     # Check for abrasion resistance
-    abrasion_keys = [k for k in predictions.keys() if 'Abrasion Loss' in k]
-    if abrasion_keys:
-        abrasion_value = predictions[abrasion_keys[0]]
+    abrasion_value = predictions.get(registry.first(KEY_PROPERTY_IDS["abrasionResistance"]))
+    if abrasion_value is not None:
         # Ensure abrasion_value is numeric before comparison
         if abrasion_value != "NA" and not isinstance(abrasion_value, str):
             abrasion = float(abrasion_value)
@@ -306,9 +1157,8 @@ def get_recommended_uses(predictions):
                 uses.append("Wear-resistant surfaces")
     
     # Check for modulus
-    modulus_keys = [k for k in predictions.keys() if '100 Modulus MPa' in k and 'Unaged' in k]
-    if modulus_keys:
-        modulus_value = predictions[modulus_keys[0]]
+    modulus_value = predictions.get(registry.first(MODULUS_100_IDS))
+    if modulus_value is not None:
         # Ensure modulus_value is numeric before comparison
         if modulus_value != "NA" and not isinstance(modulus_value, str):
             modulus = float(modulus_value)
@@ -323,15 +1173,15 @@ def get_recommended_uses(predictions):
     
     return uses
 
-def extract_key_properties(predictions):
-    """Extract key properties from the full prediction set"""
+def extract_key_properties(predictions, registry):
+    """Extract key properties from the predictions, looking test parameters up by canonical ID in the registry"""
     # Initialize with default values
     props = {
         "tensileStrength": 0,
         "elongation": 0,
         "hardness": 0,
         "abrasionResistance": 0,
-        "teaftrength": 0,
+        "tearStrength": 0,
         "modulus100": {},
         "modulus200": {},
         "modulus300": {},
@@ -347,57 +1197,40 @@ def extract_key_properties(predictions):
         return default
     
     # Extract tensile strength
-    tensile_keys = [k for k in predictions.keys() if 'Tensile strength' in k and 'Unaged' in k]
-    if tensile_keys:
-        props["tensileStrength"] = safe_float(predictions[tensile_keys[0]])
+    tensile_value = predictions.get(registry.first(KEY_PROPERTY_IDS["tensileStrength"]))
+    if tensile_value is not None:
+        props["tensileStrength"] = safe_float(tensile_value)
     
     # Extract elongation
-    elongation_keys = [k for k in predictions.keys() if 'Elongation at break' in k and 'Unaged' in k]
-    if elongation_keys:
-        props["elongation"] = safe_float(predictions[elongation_keys[0]])
+    elongation_value = predictions.get(registry.first(KEY_PROPERTY_IDS["elongation"]))
+    if elongation_value is not None:
+        props["elongation"] = safe_float(elongation_value)
     
     # Extract hardness
-    hardness_keys = [k for k in predictions.keys() if 'Hardness Shore A' in k and 'Unaged' in k]
-    if hardness_keys:
-        props["hardness"] = safe_float(predictions[hardness_keys[0]])
+    hardness_value = predictions.get(registry.first(KEY_PROPERTY_IDS["hardness"]))
+    if hardness_value is not None:
+        props["hardness"] = safe_float(hardness_value)
     
     # Extract abrasion resistance
-    abrasion_keys = [k for k in predictions.keys() if 'Abrasion Loss mg m' in k]
-    if abrasion_keys:
-        props["abrasionResistance"] = safe_float(predictions[abrasion_keys[0]])
+    abrasion_value = predictions.get(registry.first(KEY_PROPERTY_IDS["abrasionResistance"]))
+    if abrasion_value is not None:
+        props["abrasionResistance"] = safe_float(abrasion_value)
     
     # Extract tear strength
-    tear_keys = [k for k in predictions.keys() if 'Tear strength' in k and 'Unaged' in k]
-    if tear_keys:
-        props["tearStrength"] = safe_float(predictions[tear_keys[0]])
+    tear_value = predictions.get(registry.first(KEY_PROPERTY_IDS["tearStrength"]))
+    if tear_value is not None:
+        props["tearStrength"] = safe_float(tear_value)
     
     # Extract modulus values with safe conversion
-    # 100 Modulus
-    props["modulus100"] = {
-        "unaged_15min": safe_float(predictions.get("100 Modulus MPa Unaged Condition 160⁰C 15 minutes", 2.1100), 2.1100),
-        "unaged_30min": safe_float(predictions.get("100 Modulus MPa Unaged Condition 160⁰C 30 minutes", 1.1390), 1.1390),
-        "aged_100C_48hrs": safe_float(predictions.get("100 Modulus MPa Aged 100⁰C 48Hrs", 3.2700), 3.2700),
-        "aged_70C_7days": safe_float(predictions.get("100 Modulus MPa Aged 70⁰C 7Days", 2.8147), 2.8147)
-    }
-    
-    # 200 Modulus
-    props["modulus200"] = {
-        "unaged_15min": safe_float(predictions.get("200 Modulus MPa Unaged Condition 160⁰C 15 minutes", 6.0800), 6.0800),
-        "unaged_30min": safe_float(predictions.get("200 Modulus MPa Unaged Condition 160⁰C 30 minutes", 2.8721), 2.8721),
-        "aged_100C_48hrs": safe_float(predictions.get("200 Modulus MPa Aged 100⁰C 48Hrs", 8.5300), 8.5300),
-        "aged_70C_7days": safe_float(predictions.get("200 Modulus MPa Aged 70⁰C 7Days", 6.5362), 6.5362)
-    }
-    
-    # 300 Modulus
-    props["modulus300"] = {
-        "unaged_15min": safe_float(predictions.get("300 Modulus MPa Unaged Condition 160⁰C 15 minutes", 11.9731), 11.9731),
-        "unaged_30min": safe_float(predictions.get("300 Modulus MPa Unaged Condition 160⁰C 30 minutes", 5.9926), 5.9926),
-        "aged_100C_48hrs": safe_float(predictions.get("300 Modulus MPa Aged 100⁰C 48Hrs", 14.5008), 14.5008),
-        "aged_70C_7days": safe_float(predictions.get("300 Modulus MPa Aged 70⁰C 7Days", 11.4306), 11.4306)
-    }
-    
-    # 50 Modulus
-    props["modulus50"] = safe_float(predictions.get("50 Modulus MPa Unaged Condition 160⁰C 15 minutes", 1.2300), 1.2300)
+    for field, properties in MODULUS_PROPERTIES.items():
+        if field == "modulus50":
+            property_id, default = properties
+            props[field] = safe_float(predictions.get(registry.by_id.get(property_id), default), default)
+        else:
+            props[field] = {
+                key: safe_float(predictions.get(registry.by_id.get(property_id), default), default)
+                for key, (property_id, default) in properties.items()
+            }
     
     return props
 
@@ -427,10 +1260,25 @@ def get_confidence_score(predictions):
     return round(confidence, 2)
 
 
-def get_material_impacts(new_formulation):
-    """Calculate estimated impact of each material on properties"""
-    # This would ideally be based on model feature importances
-    # For now, we'll return a simplified estimation
+def get_material_impacts(new_formulation, contributions=None):
+    """
+    Calculate estimated impact of each material on properties
+    
+    With contributions (from explain_formulations), each explained test
+    parameter's absolute contributions of the formulation's materials are
+    scaled to 100 and averaged over the parameters. Without them, or when no
+    material contributes, each material's share of the total amount is used.
+    """
+    if contributions:
+        shares = []
+        for material_contributions in contributions.values():
+            magnitudes = {m: abs(material_contributions.get(m, 0.0)) for m in new_formulation}
+            total = sum(magnitudes.values())
+            if total > 0:
+                shares.append({m: v / total * 100 for m, v in magnitudes.items()})
+        if shares:
+            return {m: round(sum(share[m] for share in shares) / len(shares), 1) for m in new_formulation}
+    
     impacts = {}
     total = sum(float(amount) for amount in new_formulation.values() if isinstance(amount, (int, float)) or (isinstance(amount, str) and amount.replace('.', '', 1).isdigit()))
     
@@ -446,108 +1294,781 @@ def get_material_impacts(new_formulation):
     
     return impacts
 
-def get_recipe_composition(recipe_name):
-    """Get the composition of a specific recipe"""
-    global formulation_df
-    
-    if recipe_name not in formulation_df.columns:
-        return None
+def build_recipe_compositions(model_set):
+    """Precompute the composition of every recipe from the formulation sheet"""
+    formulation_df = model_set.formulation_df
     
     # Get raw materials column name (typically the second column)
     raw_material_col = formulation_df.columns[1]
+    materials = formulation_df[raw_material_col].tolist()
+    
+    compositions = {}
+    for recipe_name in model_set.recipes:
+        # Keep only the raw materials the recipe uses (skips NaN and 0)
+        amounts = formulation_df[recipe_name].to_numpy(dtype=float)
+        compositions[recipe_name] = [(materials[i], float(amounts[i])) for i in np.flatnonzero(amounts > 0)]
+    
+    model_set.recipe_compositions = compositions
+
+def build_measured_results(model_set, evaluation_long):
+    """Group the measured test results by recipe"""
+    measured_results = {}
+    # First column holds the test parameter names
+    for test_param, recipe_name, result in evaluation_long.iloc[:, :3].itertuples(index=False):
+        measured_results.setdefault(recipe_name, {})[test_param] = float(result)
+    model_set.measured_results = measured_results
+
+def build_recipe_predictions(model_set):
+    """
+    Predict every known recipe in one batched pass per model
+    
+    Also pairs each recipe's measured results with the model test parameters
+    (measured names differ in punctuation) and indexes the recipes by
+    canonical formulation, so /predict can answer them without the models.
+    """
+    recipe_names = list(model_set.recipe_compositions)
+    formulations = [dict(model_set.recipe_compositions[recipe_name]) for recipe_name in recipe_names]
+    predictions = predict_formulations(model_set, formulations) if formulations else []
+    
+    registry = model_set.property_registry
+    recipe_measured = {}
+    for recipe_name in recipe_names:
+        measured = {}
+        for test_param, result in model_set.measured_results.get(recipe_name, {}).items():
+            measured[registry.resolve(test_param) or test_param] = result
+        recipe_measured[recipe_name] = measured
     
-    # Get composition values for the recipe
-    recipe_data = formulation_df[[raw_material_col, recipe_name]]
+    recipe_formulations = {}
+    for recipe_name, formulation in zip(recipe_names, formulations):
+        # Recipes with identical compositions answer as the first of them
+        recipe_formulations.setdefault(canonicalize_formulation(formulation, PREDICTION_CACHE_PRECISION), recipe_name)
+    
+    model_set.recipe_predictions = dict(zip(recipe_names, predictions))
+    model_set.recipe_measured = recipe_measured
+    model_set.recipe_formulations = recipe_formulations
+
+def build_recipe_index(model_set, previous=None):
+    """
+    Build the nearest-recipe index over the formulation matrix
     
-    # Filter out rows where the recipe doesn't use the material (NaN or 0)
-    recipe_data = recipe_data.dropna(subset=[recipe_name])
+    When the previous model set's index covers the same materials and all of
+    its recipes are unchanged, it is extended with the new recipes instead of
+    being rebuilt.
+    """
+    matrix = model_set.formulation_matrix
+    materials = matrix.columns.tolist()
+    index = previous.recipe_index if previous is not None else None
     
-    # Ensure numeric comparison by converting the recipe column to numeric
-    recipe_data[recipe_name] = pd.to_numeric(recipe_data[recipe_name], errors='coerce')
-    recipe_data = recipe_data[recipe_data[recipe_name] > 0]
+    if (index is not None and index.materials == materials
+            and all(name in matrix.index for name in index.names)
+            and np.array_equal(matrix.loc[index.names].to_numpy(dtype=float), index.matrix)):
+        added = [name for name in matrix.index if name not in set(index.names)]
+        if added:
+            index = index.with_recipes(added, matrix.loc[added].to_numpy(dtype=float))
+    else:
+        index = RecipeIndex(materials, matrix.index.tolist(), matrix.to_numpy(dtype=float))
+    
+    model_set.recipe_index = index
+
+def find_similar_recipes(model_set, new_formulation, k=5):
+    """
+    Find the known recipes closest to a formulation
+    
+    Returns:
+    - (list of (recipe name, distance, measured results) nearest first,
+      materials of the formulation the formulation matrix doesn't have)
+    """
+    material_index = model_set.material_index
+    x = np.zeros(len(model_set.recipe_index.materials))
+    unknown = []
+    for material, amount in new_formulation.items():
+        col = material_index.get(material)
+        if col is None:
+            unknown.append(material)
+        else:
+            x[col] = amount
+    
+    neighbours = [
+        (recipe_name, distance, model_set.measured_results.get(recipe_name, {}))
+        for recipe_name, distance in model_set.recipe_index.query(x, k)
+    ]
+    return neighbours, unknown
+
+def get_recipe_composition(model_set, recipe_name):
+    """Get the composition of a specific recipe"""
+    composition = model_set.recipe_compositions.get(recipe_name)
+    if composition is None:
+        return None
     
     # Convert to the format expected by the frontend
-    composition = []
-    for _, row in recipe_data.iterrows():
-        composition.append({
-            "material": row[raw_material_col],
-            "composition": float(row[recipe_name])
-        })
+    return [{"material": material, "composition": amount} for material, amount in composition]
+
+class InvalidRequestError(ValueError):
+    """A request naming unknown test parameters, materials or recipes, or giving invalid bounds"""
+
+def resolve_test_param(model_set, name):
+    """Return the model name matching a test parameter exactly, in normalized form or by canonical ID"""
+    return model_set.property_registry.resolve(name)
+
+def optimize_formulation(model_set, targets, materials, base_recipe=None, top_k=5,
+                         max_evaluations=OPTIMIZE_MAX_EVALUATIONS, time_limit=OPTIMIZE_TIME_LIMIT, seed=None):
+    """
+    Search formulations whose predicted test results fall inside target ranges
+    
+    Parameters:
+    - model_set: ModelSet to predict with
+    - targets: List of (test parameter, min, max); None leaves a side open
+    - materials: List of (material, min, max) the search may vary
+    - base_recipe: Recipe supplying the amounts of the materials not searched
+      (they are 0 if None) and the starting point of the search
+    
+    Returns:
+    - (list of (formulation, predictions, violation) best first, search statistics)
+    """
+    if not targets:
+        raise InvalidRequestError("At least one target is required")
+    if not materials:
+        raise InvalidRequestError("At least one material is required")
+    
+    target_params = []
+    for name, low, high in targets:
+        test_param = resolve_test_param(model_set, name)
+        if test_param is None:
+            raise InvalidRequestError(f"Unknown test parameter: {name}")
+        if low is None and high is None:
+            raise InvalidRequestError(f"Target {name} needs a min or a max")
+        if low is not None and high is not None and low > high:
+            raise InvalidRequestError(f"Target {name} has min above max")
+        target_params.append(test_param)
+    
+    for material, low, high in materials:
+        if material not in model_set.material_index:
+            raise InvalidRequestError(f"Unknown material: {material}")
+        if low < 0 or low > high:
+            raise InvalidRequestError(f"Material {material} needs 0 <= min <= max")
+    
+    base = {}
+    if base_recipe is not None:
+        if base_recipe not in model_set.recipe_compositions:
+            raise InvalidRequestError(f"Unknown recipe: {base_recipe}")
+        base = dict(model_set.recipe_compositions[base_recipe])
+    
+    searched = [material for material, _, _ in materials]
+    cols = np.array([model_set.material_index[m] for m in searched], dtype=np.intp)
+    template = build_feature_matrix(model_set, [base])
+    
+    def predict(candidates):
+        # Searched materials vary per row, all others keep their base amounts
+        X = np.repeat(template, len(candidates), axis=0)
+        X[:, cols] = candidates
+        columns = predict_matrix(model_set, X, target_params)
+        return np.column_stack([
+            columns[p] if columns[p] is not None else np.full(len(candidates), np.nan)
+            for p in target_params
+        ])
+    
+    result = search_formulations(
+        predict,
+        lower=[low for _, low, _ in materials],
+        upper=[high for _, _, high in materials],
+        target_lower=[-np.inf if low is None else low for _, low, _ in targets],
+        target_upper=[np.inf if high is None else high for _, _, high in targets],
+        start=[base.get(m, 0.0) for m in searched] if base_recipe is not None else None,
+        top_k=top_k,
+        population=OPTIMIZE_POPULATION,
+        max_evaluations=max_evaluations,
+        time_limit=time_limit,
+        precision=PREDICTION_CACHE_PRECISION,
+        seed=seed,
+    )
+    
+    formulations = []
+    for amounts in result["amounts"]:
+        formulation = dict(base)
+        formulation.update(zip(searched, (float(a) for a in amounts)))
+        formulations.append({m: a for m, a in formulation.items() if a > 0})
+    
+    # Full predictions for the few formulations returned, in one batch
+    best = list(zip(formulations, predict_formulations(model_set, formulations), result["violation"]))
+    stats = {k: result[k] for k in ("evaluations", "iterations", "elapsed")}
+    return best, stats
+
+def sweep_material(model_set, base_formulation, material, start, stop, steps):
+    """
+    Predict every test parameter while one material's amount moves over a grid
+    
+    The base formulation is repeated once per grid point with the material's
+    amount replaced, and the whole grid is predicted as one feature matrix.
+    
+    Returns:
+    - (grid values, dictionary mapping each test parameter to its predictions
+      along the grid, None where its model failed)
+    """
+    col = model_set.material_index.get(material)
+    if col is None:
+        raise ValueError(f"Unknown material: {material}")
+    
+    values = np.linspace(start, stop, steps)
+    X = np.repeat(build_feature_matrix(model_set, [base_formulation]), steps, axis=0)
+    X[:, col] = values
+    
+    curves = {
+        test_param: preds.tolist() if preds is not None else [None] * steps
+        for test_param, preds in predict_matrix(model_set, X).items()
+    }
+    return values.tolist(), curves
+
+def match_upload_columns(model_set, columns, id_column=None):
+    """
+    Match the columns of an uploaded file to the formulation matrix
+    
+    Names are matched exactly, then with surrounding whitespace ignored.
+    
+    Returns:
+    - (uploaded columns, their formulation matrix column indices, unknown columns)
+    """
+    stripped_index = {material.strip(): col for material, col in model_set.material_index.items()}
+    source_columns, matrix_columns, unknown = [], [], []
+    for column in columns:
+        if column == id_column:
+            continue
+        col = model_set.material_index.get(str(column))
+        if col is None:
+            col = stripped_index.get(str(column).strip())
+        if col is None:
+            unknown.append(str(column))
+        else:
+            source_columns.append(column)
+            matrix_columns.append(col)
+    return source_columns, np.array(matrix_columns, dtype=np.intp), unknown
+
+def is_parquet_upload(upload):
+    """Tell an uploaded Parquet file from a CSV one by its magic bytes"""
+    upload.seek(0)
+    is_parquet = upload.read(4) == b"PAR1"
+    upload.seek(0)
+    return is_parquet
+
+def iter_upload_chunks(upload, chunk_rows):
+    """Read an uploaded CSV or Parquet file in DataFrame chunks"""
+    if is_parquet_upload(upload):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(upload).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(upload, chunksize=chunk_rows)
+
+def upload_columns(upload):
+    """Return the column names of an uploaded CSV or Parquet file without reading its rows"""
+    if is_parquet_upload(upload):
+        import pyarrow.parquet as pq
+        columns = pq.ParquetFile(upload).schema_arrow.names
+    else:
+        columns = pd.read_csv(upload, nrows=0).columns.tolist()
+    upload.seek(0)
+    return columns
+
+def call_locked(lock, func, *args):
+    """Call func holding lock, so work on a shared upload never overlaps"""
+    with lock:
+        return func(*args)
+
+def close_upload(upload, chunks=None):
+    """Close an upload's chunk reader, then the file it reads"""
+    if chunks is not None:
+        chunks.close()
+    upload.close()
+
+def run_matrix_prediction(amounts, matrix_columns):
+    """Predict rows of uploaded amounts (in matrix_columns order), with the model set version used"""
+    model_set = active_model_set
+    X = np.zeros((len(amounts), len(model_set.material_index) + 1))
+    X[:, matrix_columns] = amounts
+    columns = predict_matrix(model_set, X)
+    return model_set.version, {
+        test_param: preds.tolist() if preds is not None else None
+        for test_param, preds in columns.items()
+    }
+
+def create_prediction_executor():
+    """Create the executor for the configured prediction backend"""
+    if PREDICTION_BACKEND == "process":
+        # Spawned workers import this module fresh and load the models once
+        return ProcessPoolExecutor(
+            max_workers=PREDICTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_prediction_worker
+        )
+    if PREDICTION_BACKEND == "thread":
+        return ThreadPoolExecutor(max_workers=PREDICTION_WORKERS, thread_name_prefix="predict")
+    if PREDICTION_BACKEND != "inline":
+        print(f"Unknown PREDICTION_BACKEND {PREDICTION_BACKEND!r}; predicting inline")
+    return None
+
+def init_prediction_worker():
+    """Load data and models in a prediction worker process"""
+    load_data()
+
+def needs_contributions(fields):
+    """Whether a response with these fields reports material impacts or contributions"""
+    return "materialImpacts" in fields or "materialContributions" in fields
+
+def run_prediction(new_formulation, contribution_params=None, targets=None, fields=None, timings=None,
+                   session=None):
+    """
+    Predict a formulation and build its /predict response body, with the model set version used
     
-    return composition
+    With a PredictionSession the predictions are read from it (and
+    new_formulation should be its formulation).
+    """
+    timings = timings if timings is not None else StageTimings()
+    # Take the model set once so the whole request runs on one version
+    model_set = session.model_set if session is not None else active_model_set
+    fields, result_params, test_params = plan_prediction(model_set, targets, fields)
+    explained = resolve_contribution_params(model_set, contribution_params) if needs_contributions(fields) else []
+    with timings.stage("predict"):
+        if session is not None:
+            predictions = session.predict(test_params)
+        else:
+            predictions = predict_new_formulation(model_set, new_formulation, test_params)
+    contributions = {}
+    if explained:
+        with timings.stage("contributions"):
+            contributions = explain_formulations(model_set, [new_formulation], [explained])[0]
+    return model_set.version, build_prediction_response(
+        model_set, new_formulation, predictions, contributions, timings, fields, result_params
+    )
+
+def run_batch_prediction(new_formulations, contribution_params=None, targets=None, fields=None, timings=None):
+    """
+    Predict many formulations and build their /predict response bodies, with the model set version used
+    
+    contribution_params, targets and fields hold one entry per formulation
+    (None for all of them when omitted); models are run once on the union of
+    what the formulations need.
+    """
+    timings = timings if timings is not None else StageTimings()
+    model_set = active_model_set
+    count = len(new_formulations)
+    contribution_params = contribution_params if contribution_params is not None else [None] * count
+    targets = targets if targets is not None else [None] * count
+    fields = fields if fields is not None else [None] * count
+    
+    plans = [plan_prediction(model_set, row_targets, row_fields) for row_targets, row_fields in zip(targets, fields)]
+    explained = [
+        resolve_contribution_params(model_set, requested) if needs_contributions(plan[0]) else []
+        for requested, plan in zip(contribution_params, plans)
+    ]
+    
+    test_params = None
+    if plans and all(plan[2] is not None for plan in plans):
+        needed = set().union(*(plan[2] for plan in plans))
+        test_params = [test_param for test_param in model_set.models if test_param in needed]
+    
+    with timings.stage("predict"):
+        batch_predictions = predict_formulations(model_set, new_formulations, test_params) if new_formulations else []
+    batch_contributions = [{} for _ in new_formulations]
+    if any(explained):
+        with timings.stage("contributions"):
+            batch_contributions = explain_formulations(model_set, new_formulations, explained)
+    return model_set.version, [
+        build_prediction_response(model_set, new_formulation, predictions, contributions, timings, row_fields, result_params)
+        for new_formulation, predictions, contributions, (row_fields, result_params, _) in zip(
+            new_formulations, batch_predictions, batch_contributions, plans
+        )
+    ]
+
+def run_traced(func, profile, *args):
+    """
+    Run prediction pipeline work with per-stage timings, under cProfile when asked
+    
+    Returns:
+    - (result of func, stage timings in seconds, profile file or None)
+    """
+    timings = StageTimings()
+    if profile:
+        result, profile_path = profile_call(
+            PROFILE_DIR, func.__name__, func, *args, keep=PROFILE_MAX_FILES, timings=timings
+        )
+    else:
+        result, profile_path = func(*args, timings=timings), None
+    return result, timings.stages, profile_path
+
+def should_profile(http_request):
+    """Decide whether a request runs under the profiler: sampled, or asked for with X-Profile"""
+    # Every profiled request writes a file, so only admins may ask for one
+    if http_request.headers.get("X-Profile") == "1" and ADMIN_TOKEN:
+        token = http_request.headers.get("X-Admin-Token") or ""
+        if hmac.compare_digest(token, ADMIN_TOKEN):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def start_traced(http_request):
+    """Start recording stage timings on a request, counting the time since it arrived as parsing"""
+    timings = StageTimings()
+    started = time.perf_counter()
+    timings.add("parse", started - getattr(http_request.state, "started", started))
+    http_request.state.timings = timings
+    return timings
+
+async def submit_traced(http_request, func, *args):
+    """
+    Run prediction pipeline work on the backend, recording its stage timings on the request
+    
+    Time from the request arriving to this call is recorded as "parse" and
+    the wait for the backend beyond the work itself as "queue".
+    """
+    timings = start_traced(http_request)
+    started = time.perf_counter()
+    
+    result, stages, profile_path = await submit_prediction(run_traced, func, should_profile(http_request), *args)
+    timings.add("queue", max(time.perf_counter() - started - sum(stages.values()), 0.0))
+    timings.update(stages)
+    http_request.state.profile_path = profile_path
+    return result
+
+def finish_traced(http_request):
+    """Mark the endpoint as done, so the middleware can time response validation and encoding"""
+    http_request.state.handler_finished = time.perf_counter()
+
+def run_optimization(targets, materials, base_recipe, top_k, max_evaluations, time_limit, seed):
+    """Run an inverse-design search and build its /optimize response body, with the model set version used"""
+    model_set = active_model_set
+    best, stats = optimize_formulation(
+        model_set, targets, materials, base_recipe, top_k, max_evaluations, time_limit, seed
+    )
+    return model_set.version, {
+        "results": [
+            {
+                "materialCompositions": [{"material": m, "composition": a} for m, a in formulation.items()],
+                "testResults": predictions,
+                "targetsMet": bool(violation == 0),
+                "targetViolation": float(violation),
+            }
+            for formulation, predictions, violation in best
+        ],
+        "evaluations": stats["evaluations"],
+        "iterations": stats["iterations"],
+        "elapsedSeconds": round(stats["elapsed"], 3),
+    }
+
+def run_sweep(base_formulation, material, start, stop, steps):
+    """Sweep one material and build the /sweep response body, with the model set version used"""
+    model_set = active_model_set
+    values, curves = sweep_material(model_set, base_formulation, material, start, stop, steps)
+    return model_set.version, {"material": material, "values": values, "curves": curves}
+
+async def submit_prediction(func, *args):
+    """Run prediction work on the configured backend, rejecting it with 503 past the in-flight cap"""
+    global inflight_predictions
+    
+    if MAX_INFLIGHT_PREDICTIONS > 0 and inflight_predictions >= MAX_INFLIGHT_PREDICTIONS:
+        raise HTTPException(status_code=503, detail="Too many predictions in progress, retry later")
+    
+    inflight_predictions += 1
+    try:
+        if prediction_executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(prediction_executor, func, *args)
+    finally:
+        inflight_predictions -= 1
+
+def set_model_version(response, version):
+    """Report the model set version a response was computed with"""
+    if version is not None:
+        response.headers["X-Model-Version"] = version
+
+def load_validated_model_set(previous):
+    """Load the next model set and validate it against the current one"""
+    model_set = load_model_set(previous.generation + 1, previous)
+    validate_model_set(model_set, previous)
+    return model_set
+
+async def reload_models():
+    """
+    Load, validate and activate a new model set without blocking requests
+    
+    Loading runs on a background thread while the active set keeps serving.
+    If loading or validation fails the active set is kept and the error raised.
+    
+    Returns:
+    - (previous model set, new model set)
+    """
+    global prediction_executor
+    
+    # One reload at a time
+    async with reload_lock:
+        previous = active_model_set
+        model_set = await asyncio.to_thread(load_validated_model_set, previous)
+        activate_model_set(model_set)
+        
+        # Process workers hold their own copy of the models: start a fresh pool,
+        # whose workers load the new set, and let the old one finish its work
+        if PREDICTION_BACKEND == "process" and prediction_executor is not None:
+            old_executor = prediction_executor
+            prediction_executor = create_prediction_executor()
+            old_executor.shutdown(wait=False)
+        
+        print(f"Reloaded models: model set {previous.version} -> {model_set.version}")
+        return previous, model_set
+
+async def watch_models():
+    """Poll the model files and workbook, reloading the model set when they change"""
+    pending = None
+    rejected = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        fingerprint = None
+        try:
+            fingerprint = await asyncio.to_thread(source_fingerprint)
+            if fingerprint in (active_model_set.version, rejected):
+                pending = None
+                continue
+            
+            # Wait for the files to stay unchanged for one more interval, so a
+            # retrain that is still writing models isn't picked up halfway
+            if fingerprint != pending:
+                pending = fingerprint
+                continue
+            
+            pending = None
+            print(f"Model files changed ({fingerprint}), reloading")
+            await reload_models()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Don't retry the same files every interval
+            rejected = fingerprint
+            print(f"Model reload failed, keeping model set {active_model_set.version}: {str(e)}")
+
+def check_admin_token(token):
+    """Reject admin requests without the configured ADMIN_TOKEN"""
+    if ADMIN_TOKEN and not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def describe_model_set(model_set):
+    """Summarize a model set for the admin endpoints"""
+    return {
+        "version": model_set.version,
+        "generation": model_set.generation,
+        "loadedAt": model_set.loaded_at,
+        "models": len(model_set.models),
+        "engineModels": len(model_set.tree_engine.test_params) if model_set.tree_engine is not None else 0,
+    }
 
 @app.on_event("startup")
 async def startup_event():
     """Load data and models on startup"""
+    global prediction_executor, model_watcher
     try:
         load_data()
     except Exception as e:
         print(f"Startup error: {str(e)}")
+    
+    prediction_executor = create_prediction_executor()
+    
+    if MODEL_WATCH_INTERVAL > 0:
+        model_watcher = asyncio.create_task(watch_models())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the model watcher and the prediction backend"""
+    if model_watcher is not None:
+        model_watcher.cancel()
+    if prediction_executor is not None:
+        prediction_executor.shutdown(wait=False, cancel_futures=True)
 
 @app.get("/")
 def read_root():
     return {"message": "Compound Prediction API"}
 
 @app.get("/materials", response_model=MaterialListResponse)
-def get_materials():
+def get_materials(response: Response):
     """Return list of available raw materials"""
-    return {"materials": raw_materials}
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    return {"materials": model_set.raw_materials}
 
 @app.get("/recipes", response_model=RecipeListResponse)
-def get_recipes():
+def get_recipes(response: Response):
     """Return list of available recipes"""
-    return {"recipes": recipes}
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    return {"recipes": model_set.recipes}
+
+@app.get("/recipes/{recipe_name:path}/predictions", response_model=RecipePredictionsResponse)
+def get_recipe_predictions(recipe_name: str, response: Response):
+    """Return the stored predictions for a known recipe next to its measured test results"""
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    predictions = model_set.recipe_predictions.get(recipe_name)
+    if predictions is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    
+    measured = model_set.recipe_measured.get(recipe_name, {})
+    results = {
+        test_param: {"predicted": predicted, "measured": measured.get(test_param)}
+        for test_param, predicted in predictions.items()
+    }
+    # Measurements with no model to compare against
+    for test_param, result in measured.items():
+        results.setdefault(test_param, {"predicted": None, "measured": result})
+    return {"recipeName": recipe_name, "results": results}
+
+@app.get("/properties", response_model=PropertyListResponse)
+def get_properties(response: Response):
+    """Return the predicted test parameters with their canonical IDs and parsed conditions"""
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    return {"properties": [record.as_dict() for record in model_set.property_registry.records.values()]}
+
+@app.get("/metrics")
+def get_metrics():
+    """Return request, model latency, load time and memory metrics in the Prometheus text format"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats", response_model=CacheStatsResponse)
+def get_cache_stats():
+    """Return prediction cache size and hit/miss/eviction counters"""
+    return prediction_cache.stats()
+
+@app.get("/admin/model-set", response_model=ModelSetResponse)
+def get_model_set(x_admin_token: Optional[str] = Header(None)):
+    """Return the version and size of the active model set"""
+    check_admin_token(x_admin_token)
+    return describe_model_set(active_model_set)
+
+@app.post("/admin/reload", response_model=ReloadResponse)
+async def reload(x_admin_token: Optional[str] = Header(None)):
+    """Load the current model files in the background and swap them in once validated"""
+    check_admin_token(x_admin_token)
+    try:
+        previous, model_set = await reload_models()
+    except Exception as e:
+        print(f"Model reload failed, keeping model set {active_model_set.version}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Reload failed: {str(e)}")
+    
+    return {**describe_model_set(model_set), "previousVersion": previous.version}
 
 @app.post("/get-recipe-composition", response_model=RecipeCompositionResponse)
-def get_composition(request: RecipeRequest):
+def get_composition(request: RecipeRequest, response: Response):
     """Get the composition of a specific recipe"""
-    composition = get_recipe_composition(request.recipeName)
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    composition = get_recipe_composition(model_set, request.recipeName)
     
     if composition is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
     
     return {"materialCompositions": composition}
 
-@app.post("/predict", response_model=PredictionResponse)
-async def predict(request: PredictionRequest):
+def build_prediction_response(model_set, new_formulation, predictions, contributions=None, timings=None,
+                              fields=None, result_params=None):
+    """
+    Assemble the /predict response body from a formulation, its predictions and material contributions
+    
+    Only the given fields (all if None) are computed and returned; testResults
+    and the confidence score cover result_params (all predictions if None).
+    """
+    timings = timings if timings is not None else StageTimings()
+    fields = fields if fields is not None else PREDICTION_FIELDS
+    body = {}
+    
+    # Extract key properties
+    key_fields = [field for field in KEY_PROPERTY_FIELDS if field in fields]
+    if key_fields:
+        with timings.stage("key_properties"):
+            key_props = extract_key_properties(predictions, model_set.property_registry)
+        for field in key_fields:
+            body[field] = key_props[field]
+    
+    # Get recommended uses
+    if "recommendedUses" in fields:
+        with timings.stage("uses"):
+            body["recommendedUses"] = get_recommended_uses(predictions, model_set.property_registry)
+    
+    # plan_prediction only predicts result_params for these two fields
+    if "testResults" in fields or "confidenceScore" in fields:
+        test_results = predictions
+        if result_params is not None:
+            test_results = {test_param: predictions[test_param] for test_param in result_params}
+        if "testResults" in fields:
+            body["testResults"] = test_results
+        
+        # Calculate confidence score
+        if "confidenceScore" in fields:
+            body["confidenceScore"] = get_confidence_score(test_results)
+    
+    if "propertyRanges" in fields:
+        body["propertyRanges"] = generate_property_ranges()
+    
+    # Get material impacts
+    if "materialImpacts" in fields:
+        with timings.stage("impacts"):
+            body["materialImpacts"] = get_material_impacts(new_formulation, contributions)
+    
+    if "materialContributions" in fields:
+        body["materialContributions"] = contributions or {}
+    
+    return body
+
+@app.post("/similar", response_model=SimilarResponse)
+def similar(request: SimilarRequest, response: Response):
+    """Return the known recipes closest to a composition, with their measured test results"""
+    if request.k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    
+    model_set = active_model_set
+    if model_set.recipe_index is None:
+        raise HTTPException(status_code=503, detail="Models are not loaded")
+    set_model_version(response, model_set.version)
+    
+    new_formulation = {item.material: float(item.composition) for item in request.materialCompositions}
+    neighbours, unknown = find_similar_recipes(model_set, new_formulation, request.k)
+    return {
+        "recipes": [
+            {"recipeName": recipe_name, "distance": distance, "measuredResults": measured}
+            for recipe_name, distance, measured in neighbours
+        ],
+        "unknownMaterials": unknown,
+    }
+
+@app.post("/get-recipe-compositions", response_model=BulkRecipeCompositionResponse)
+def get_compositions(request: BulkRecipeRequest, response: Response):
+    """Get the compositions of many recipes in one response"""
+    model_set = active_model_set
+    set_model_version(response, model_set.version)
+    compositions = {}
+    missing = []
+    for recipe_name in request.recipeNames:
+        composition = get_recipe_composition(model_set, recipe_name)
+        if composition is None:
+            missing.append(recipe_name)
+        else:
+            compositions[recipe_name] = composition
+    
+    return {"compositions": compositions, "missing": missing}
+
+@app.post("/predict", response_model=PredictionResponse, response_model_exclude_unset=True)
+async def predict(request: PredictionRequest, response: Response, http_request: Request):
     """Predict compound properties based on composition"""
     try:
         # Convert the request to the format expected by the prediction function
         # Ensure all composition values are properly converted to float
         new_formulation = {item.material: float(item.composition) for item in request.materialCompositions}
         
-        # Make predictions
-        predictions = predict_new_formulation(new_formulation)
-        
-        # Extract key properties
-        key_props = extract_key_properties(predictions)
-        
-        # Get recommended uses
-        uses = get_recommended_uses(predictions)
-        
-        # Calculate confidence score
-        confidence = get_confidence_score(predictions)
-        
-        # Get material impacts
-        impacts = get_material_impacts(new_formulation)
-        
-        # Return the response
-        return {
-            "testResults": predictions,
-            "confidenceScore": confidence,
-            "recommendedUses": uses,
-            "tensileStrength": key_props["tensileStrength"],
-            "elongation": key_props["elongation"],
-            "hardness": key_props["hardness"],
-            "abrasionResistance": key_props["abrasionResistance"],
-            "tearStrength": key_props["tearStrength"],
-            "modulus100": key_props["modulus100"],
-            "modulus200": key_props["modulus200"],
-            "modulus300": key_props["modulus300"],
-            "modulus50": key_props["modulus50"],
-            "propertyRanges": generate_property_ranges(),
-            "materialImpacts": impacts
-        }
+        # Make predictions and build the response off the event loop
+        version, result = await submit_traced(
+            http_request, run_prediction, new_formulation, request.contributionParameters, request.targets, request.fields
+        )
+        set_model_version(response, version)
+        finish_traced(http_request)
+        return result
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         # Log the error for debugging
         print(f"Error processing prediction: {str(e)}")
@@ -558,6 +2079,281 @@ async def predict(request: PredictionRequest):
         # Raise HTTPException to return a clean error response
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+@app.post("/predict/batch", response_model=BatchPredictionResponse, response_model_exclude_unset=True)
+async def predict_batch(request: BatchPredictionRequest, response: Response, http_request: Request):
+    """Predict compound properties for many compositions in one vectorized pass"""
+    try:
+        new_formulations = [
+            {item.material: float(item.composition) for item in formulation.materialCompositions}
+            for formulation in request.formulations
+        ]
+        
+        # Make predictions for all formulations at once
+        contribution_params = [formulation.contributionParameters for formulation in request.formulations]
+        targets = [formulation.targets for formulation in request.formulations]
+        fields = [formulation.fields for formulation in request.formulations]
+        version, results = await submit_traced(
+            http_request, run_batch_prediction, new_formulations, contribution_params, targets, fields
+        )
+        set_model_version(response, version)
+        finish_traced(http_request)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error processing batch prediction: {str(e)}")
+        import traceback
+        traceback_str = traceback.format_exc()
+        print(traceback_str)
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
+
+def run_session_prediction(session_id, session, contribution_params, targets, fields, timings):
+    """Store a prediction session and build its /predict/session response body"""
+    prediction_sessions.put(session_id, session)
+    fields = fields if fields is not None else SESSION_FIELDS
+    version, result = run_prediction(
+        session.formulation, contribution_params, targets, fields, timings, session=session
+    )
+    result["sessionId"] = session_id
+    result["treesEvaluated"] = session.trees_evaluated
+    return version, result
+
+# Sessions live in this process and an update walks a few dozen trees, so they
+# run on the event loop instead of the prediction backend (see SESSION_FIELDS)
+@app.post("/predict/session", response_model=SessionPredictionResponse, response_model_exclude_unset=True)
+async def start_prediction_session(request: PredictionRequest, response: Response, http_request: Request):
+    """
+    Predict a formulation and keep it as a session for incremental updates
+    
+    Without fields, responses leave out materialImpacts and materialContributions.
+    """
+    try:
+        timings = start_traced(http_request)
+        new_formulation = {item.material: float(item.composition) for item in request.materialCompositions}
+        with timings.stage("session"):
+            session = PredictionSession(active_model_set, new_formulation)
+        version, result = run_session_prediction(
+            uuid.uuid4().hex, session, request.contributionParameters, request.targets, request.fields, timings
+        )
+        set_model_version(response, version)
+        finish_traced(http_request)
+        return result
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error starting prediction session: {str(e)}")
+        import traceback
+        traceback_str = traceback.format_exc()
+        print(traceback_str)
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+@app.post("/predict/session/{session_id}", response_model=SessionPredictionResponse, response_model_exclude_unset=True)
+async def update_prediction_session(session_id: str, request: PredictionRequest, response: Response,
+                                    http_request: Request):
+    """
+    Change materials of a session's formulation and predict it again
+    
+    materialCompositions lists only the materials that changed, with their new
+    amounts (0 removes a material); the others keep their amounts.
+    """
+    try:
+        timings = start_traced(http_request)
+        session = prediction_sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Prediction session '{session_id}' not found or expired")
+        
+        changes = {item.material: float(item.composition) for item in request.materialCompositions}
+        with timings.stage("session"):
+            if session.model_set is not active_model_set:
+                # The models were reloaded: start over from the formulation on the new ones
+                session = PredictionSession(active_model_set, {**session.formulation, **changes})
+            else:
+                session.update(changes)
+        version, result = run_session_prediction(
+            session_id, session, request.contributionParameters, request.targets, request.fields, timings
+        )
+        set_model_version(response, version)
+        finish_traced(http_request)
+        return result
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error updating prediction session: {str(e)}")
+        import traceback
+        traceback_str = traceback.format_exc()
+        print(traceback_str)
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+@app.delete("/predict/session/{session_id}", status_code=204)
+def end_prediction_session(session_id: str):
+    """Discard a prediction session"""
+    if not prediction_sessions.discard(session_id):
+        raise HTTPException(status_code=404, detail=f"Prediction session '{session_id}' not found or expired")
+    return Response(status_code=204)
+
+@app.post("/optimize", response_model=OptimizationResponse)
+async def optimize(request: OptimizationRequest, response: Response):
+    """Search formulations whose predicted properties fall inside the target ranges"""
+    # The request may lower the evaluation budget and time limit, not raise them
+    max_evaluations = min(request.maxEvaluations or OPTIMIZE_MAX_EVALUATIONS, OPTIMIZE_MAX_EVALUATIONS)
+    time_limit = min(request.timeLimit or OPTIMIZE_TIME_LIMIT, OPTIMIZE_TIME_LIMIT)
+    top_k = max(1, min(request.topK, OPTIMIZE_MAX_TOP_K))
+    
+    targets = [(t.testParameter, t.min, t.max) for t in request.targets]
+    materials = [(m.material, float(m.min), float(m.max)) for m in request.materials]
+    try:
+        version, result = await submit_prediction(
+            run_optimization, targets, materials, request.baseRecipe,
+            top_k, max_evaluations, time_limit, request.seed
+        )
+        set_model_version(response, version)
+        return result
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error processing optimization: {str(e)}")
+        import traceback
+        traceback_str = traceback.format_exc()
+        print(traceback_str)
+        raise HTTPException(status_code=500, detail=f"Optimization error: {str(e)}")
+
+@app.post("/sweep", response_model=SweepResponse)
+async def sweep(request: SweepRequest, response: Response):
+    """Predict how every property changes as one material's amount is varied"""
+    if not 2 <= request.steps <= SWEEP_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"steps must be between 2 and {SWEEP_MAX_STEPS}")
+    if request.start < 0 or request.stop < 0:
+        raise HTTPException(status_code=400, detail="Sweep amounts must not be negative")
+    if request.material not in active_model_set.material_index:
+        raise HTTPException(status_code=400, detail=f"Unknown material: {request.material}")
+    
+    try:
+        base_formulation = {item.material: float(item.composition) for item in request.materialCompositions}
+        
+        # The whole grid is scored in one batched pass off the event loop
+        version, result = await submit_prediction(
+            run_sweep, base_formulation, request.material, request.start, request.stop, request.steps
+        )
+        set_model_version(response, version)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing sweep: {str(e)}")
+        import traceback
+        traceback_str = traceback.format_exc()
+        print(traceback_str)
+        raise HTTPException(status_code=500, detail=f"Sweep error: {str(e)}")
+
+async def spool_upload(request):
+    """
+    Copy the request body into a temporary file that moves to disk past UPLOAD_SPOOL_BYTES
+    
+    Bodies over UPLOAD_MAX_BYTES are refused with 413: up front when the
+    Content-Length says so, otherwise as soon as the bytes received pass it
+    (chunked requests carry no length, and the header may understate it).
+    """
+    too_large = HTTPException(status_code=413, detail=f"Upload exceeds the {UPLOAD_MAX_BYTES} byte limit")
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        raise too_large
+    
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    received = 0
+    try:
+        # Writes go to disk once the file has rolled over; keep them off the event loop
+        async for block in request.stream():
+            received += len(block)
+            if received > UPLOAD_MAX_BYTES:
+                raise too_large
+            await asyncio.to_thread(upload.write, block)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+async def stream_upload_predictions(upload, id_column):
+    """Score an uploaded file chunk by chunk, yielding NDJSON lines"""
+    # Reads run in worker threads; the lock keeps the upload from being closed
+    # under one still running after the client went away
+    lock = threading.Lock()
+    chunks = None
+    try:
+        model_set = active_model_set
+        columns = await asyncio.to_thread(call_locked, lock, upload_columns, upload)
+        source_columns, matrix_columns, unknown = match_upload_columns(model_set, columns, id_column)
+        if id_column is not None and id_column not in columns:
+            unknown.append(id_column)
+        
+        # Unknown materials are reported once, before any results
+        version = model_set.version
+        yield json.dumps({"modelVersion": version, "unknownMaterials": unknown}) + "\n"
+        
+        chunks = iter_upload_chunks(upload, UPLOAD_CHUNK_ROWS)
+        rows = 0
+        while True:
+            chunk = await asyncio.to_thread(call_locked, lock, next, chunks, None)
+            if chunk is None:
+                break
+            
+            # Empty or non-numeric cells count as an unused material
+            amounts = chunk[source_columns].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+            ids = chunk[id_column].tolist() if id_column in chunk.columns else None
+            
+            chunk_version, predictions = await submit_prediction(run_matrix_prediction, amounts, matrix_columns)
+            if chunk_version != version:
+                # A reload happened while the file was being scored
+                version = chunk_version
+                yield json.dumps({"modelVersion": version}) + "\n"
+            
+            lines = []
+            for i in range(len(chunk)):
+                line = {"row": rows + i}
+                if ids is not None:
+                    line["id"] = ids[i] if not pd.isna(ids[i]) else None
+                line["testResults"] = {
+                    test_param: preds[i] if preds is not None else None
+                    for test_param, preds in predictions.items()
+                }
+                lines.append(json.dumps(line))
+            rows += len(chunk)
+            yield "\n".join(lines) + "\n"
+        
+        yield json.dumps({"rows": rows}) + "\n"
+    except HTTPException as e:
+        # The status line has already been sent; report the error in the stream
+        yield json.dumps({"error": e.detail}) + "\n"
+    except Exception as e:
+        print(f"Error scoring upload: {str(e)}")
+        yield json.dumps({"error": f"Upload scoring error: {str(e)}"}) + "\n"
+    finally:
+        await asyncio.to_thread(call_locked, lock, close_upload, upload, chunks)
+
+@app.post("/predict/upload")
+async def predict_upload(request: Request, idColumn: Optional[str] = None):
+    """
+    Score a CSV or Parquet file of formulations, streaming NDJSON results
+    
+    The request body is the file itself: one row per formulation, one column
+    per raw material, plus the optional idColumn echoed with each result.
+    The first line reports the model set version and the columns that are
+    not raw materials; then one line per row and a final row count.
+    
+    The body is spooled in full before scoring starts: Parquet keeps its
+    schema in a footer at the end of the file, and reading the body while the
+    response streams would race Starlette's disconnect listener for messages.
+    """
+    upload = await spool_upload(request)
+    return StreamingResponse(stream_upload_predictions(upload, idColumn), media_type="application/x-ndjson")
+
 # Run with: uvicorn main:app --reload
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonicalize_formulation(formulation, precision):
+    """
+    Return a hashable canonical form of a formulation
+
+    Materials are sorted, amounts are rounded to the given number of decimals
+    and materials whose rounded amount is 0 are dropped, so formulations that
+    only differ in ordering, unused materials or float noise share one key.
+    """
+    canonical = []
+    for material, amount in formulation.items():
+        amount = round(float(amount), precision)
+        if amount != 0:
+            canonical.append((material, amount))
+    return tuple(sorted(canonical))
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with a size bound, per-entry TTL and usage counters"""
+
+    def __init__(self, maxsize=1024, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries past maxsize"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl and self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        """Drop the entry for key; return whether there was one"""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache configuration, size and counters"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,85 @@
+import cProfile
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# cProfile can't profile two calls of the same interpreter at once; requests
+# that find the profiler busy simply run unprofiled
+_profile_lock = threading.Lock()
+
+
+class StageTimings:
+    """Wall-clock seconds spent per named stage of one request, in the order stages first ran"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def update(self, stages):
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def server_timing(self):
+        """Render the stages as a Server-Timing header value (durations in milliseconds)"""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items())
+
+
+def prune_profiles(directory, keep):
+    """Delete all but the newest keep .prof files in directory"""
+    paths = [os.path.join(directory, entry) for entry in os.listdir(directory) if entry.endswith(".prof")]
+    if len(paths) <= keep:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for path in paths[:len(paths) - keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def profile_call(directory, name, func, *args, keep=None, **kwargs):
+    """
+    Call func under cProfile and write its stats to a .prof file in directory
+
+    If another call is being profiled, func runs unprofiled. With keep, older
+    profiles past the newest keep files in directory are deleted.
+
+    Returns:
+    - (result of func, path of the profile file or None)
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return func(*args, **kwargs), None
+
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.prof"
+        )
+        profiler.dump_stats(path)
+        if keep is not None:
+            prune_profiles(directory, keep)
+        return result, path
+    finally:
+        _profile_lock.release()
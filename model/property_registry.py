@@ -0,0 +1,154 @@
+import re
+
+# Leading words of a normalized, lowercased test parameter name -> (property, unit).
+# Longer prefixes sharing words with shorter ones come first.
+PROPERTIES = [
+    ("tensile strength mpa", "tensile_strength", "MPa"),
+    ("elongation at break", "elongation_at_break", "%"),
+    ("hardness shore a", "hardness", "Shore A"),
+    ("bulk tear strength n", "bulk_tear_strength", "N"),
+    ("tear strength n mm", "tear_strength", "N/mm"),
+    ("toughness", "toughness", None),
+    ("50 modulus mpa", "modulus_50", "MPa"),
+    ("100 modulus mpa", "modulus_100", "MPa"),
+    ("200 modulus mpa", "modulus_200", "MPa"),
+    ("300 modulus mpa", "modulus_300", "MPa"),
+    ("abrasion loss index", "abrasion_loss_index", None),
+    ("abrasion loss mg m", "abrasion_loss", "mg/m"),
+    ("e double prime mpa", "e_double_prime", "MPa"),
+    ("e prime mpa", "e_prime", "MPa"),
+    ("loss complience mpa 1", "loss_compliance", "1/MPa"),
+    ("tan delta", "tan_delta", None),
+    ("hbu dt at base 0c", "heat_buildup_base", "°C"),
+    ("hbu dt at centre 0c", "heat_buildup_centre", "°C"),
+    ("slope 9 deg slip to 16 deg slip", "slip_slope_9_16deg", None),
+    ("set", "set", None),
+]
+
+# Suffixes of the durations in names ("15 minutes", "48Hrs", "7Days")
+DURATION_UNITS = {"minutes": "min", "hrs": "h", "days": "d"}
+
+_TEMPERATURE = re.compile(r"\b(\d+)⁰?c\b")
+_DURATION = re.compile(r"\b(\d+) ?(minutes|hrs|days)\b")
+_SLIP_ANGLE = re.compile(r"\b(\d+(?: \d+)?)⁰ slip angle\b")
+
+
+def normalize_test_param(test_param):
+    """Reduce a test parameter name to alphanumeric words separated by single spaces"""
+    return " ".join("".join(c if c.isalnum() else " " for c in test_param).split())
+
+
+class PropertyRecord:
+    """
+    Structured form of one test parameter name
+
+    Unaged and "Aged Condition" tests carry the cure temperature and time,
+    oven-aged ones ("Aged 100⁰C 48Hrs") the ageing temperature and duration
+    and dynamic tests ("Tan delta 70C") the test temperature. The canonical
+    ID joins the parts present with dots, e.g. "tensile_strength.unaged.160c_15min".
+    """
+
+    def __init__(self, test_param, prop, unit=None, condition=None, temperature=None,
+                 duration=None, qualifier=None):
+        self.test_param = test_param
+        self.property = prop
+        self.unit = unit
+        self.condition = condition
+        self.temperature = temperature
+        self.duration = duration
+        self.qualifier = qualifier
+        self.words = frozenset(normalize_test_param(test_param).lower().split())
+
+    @property
+    def id(self):
+        timing = "_".join(part for part in (
+            f"{self.temperature}c" if self.temperature is not None else None, self.duration
+        ) if part)
+        return ".".join(part for part in (self.property, self.condition, timing, self.qualifier) if part)
+
+    @classmethod
+    def parse(cls, test_param):
+        """Parse a test parameter name, falling back to its words as the property for unknown names"""
+        name = normalize_test_param(test_param).lower()
+        for prefix, prop, unit in PROPERTIES:
+            if name == prefix or name.startswith(prefix + " "):
+                rest = name[len(prefix):]
+                break
+        else:
+            return cls(test_param, name.replace(" ", "_"))
+
+        words = rest.split()
+        condition = "unaged" if "unaged" in words else "aged" if "aged" in words else None
+        temperature = _TEMPERATURE.search(rest)
+        duration = _DURATION.search(rest)
+        slip_angle = _SLIP_ANGLE.search(rest)
+        return cls(
+            test_param, prop, unit, condition,
+            temperature=int(temperature.group(1)) if temperature else None,
+            duration=f"{duration.group(1)}{DURATION_UNITS[duration.group(2)]}" if duration else None,
+            qualifier=f"slip_{slip_angle.group(1).replace(' ', '_')}deg" if slip_angle else None,
+        )
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "testParameter": self.test_param,
+            "property": self.property,
+            "unit": self.unit,
+            "condition": self.condition,
+            "temperature": self.temperature,
+            "duration": self.duration,
+            "qualifier": self.qualifier,
+        }
+
+
+class PropertyRegistry:
+    """
+    Index of a model set's test parameters by canonical ID and normalized name
+
+    Built once per model set; lookups are dictionary hits instead of scans
+    over the prediction keys.
+    """
+
+    def __init__(self, test_params=()):
+        self.records = {}
+        self.by_id = {}
+        self.by_name = {}
+        for test_param in test_params:
+            record = PropertyRecord.parse(test_param)
+            record_id = record.id
+            if record_id in self.by_id:
+                # Two names parsing alike keep distinct IDs: the later one falls back to its full name
+                print(f"Test parameter {test_param!r} parses like {self.by_id[record_id]!r}; using its full name as ID")
+                record = PropertyRecord(test_param, normalize_test_param(test_param).lower().replace(" ", "_"))
+                record_id = record.id
+            self.records[test_param] = record
+            self.by_id[record_id] = test_param
+            self.by_name.setdefault(normalize_test_param(test_param), test_param)
+
+    def __len__(self):
+        return len(self.records)
+
+    def resolve(self, name):
+        """Return the test parameter a name refers to: exactly, in normalized form or by canonical ID"""
+        if name in self.records:
+            return name
+        test_param = self.by_name.get(normalize_test_param(name))
+        if test_param is None:
+            test_param = self.by_id.get(name.strip().lower())
+        return test_param
+
+    def first(self, ids):
+        """Return the test parameter of the first canonical ID present, or None"""
+        for property_id in ids:
+            test_param = self.by_id.get(property_id)
+            if test_param is not None:
+                return test_param
+        return None
+
+    def matching(self, words):
+        """Return the test parameters whose name contains all of the given lowercase words"""
+        words = set(words)
+        if not words:
+            return []
+        return [test_param for test_param, record in self.records.items() if words <= record.words]
@@ -0,0 +1,78 @@
+import numpy as np
+from sklearn.neighbors import KDTree
+
+# Recipes added since the KD-tree was built are searched by brute force until
+# they make up this share of the index, then the tree is rebuilt
+REBUILD_FRACTION = 0.25
+LEAF_SIZE = 16
+
+
+class RecipeIndex:
+    """
+    Nearest-neighbour index over recipe compositions
+
+    Each material is divided by its largest amount over the recipes the index
+    was built from, so polymers and fillers dosed at tens of phr don't drown
+    out curatives dosed at one or two. Distances are Euclidean in that space.
+    An index is never modified: with_recipes returns a new one that shares
+    the KD-tree and searches the added recipes alongside it.
+    """
+
+    def __init__(self, materials, names, matrix, scale=None, tree=None, tree_size=None):
+        self.materials = list(materials)
+        self.names = list(names)
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        matrix = self.matrix
+
+        if scale is None:
+            scale = matrix.max(axis=0) if len(matrix) else np.ones(len(self.materials))
+            scale = np.where(scale > 0, scale, 1.0)
+        self.scale = scale
+        self.points = matrix / scale
+
+        if tree is None:
+            tree = KDTree(self.points, leaf_size=LEAF_SIZE)
+            tree_size = len(self.points)
+        self.tree = tree
+        self.tree_size = tree_size
+
+    def __len__(self):
+        return len(self.names)
+
+    def with_recipes(self, names, matrix):
+        """
+        Return an index that also holds the given recipes
+
+        The KD-tree and scale are reused while the added recipes stay under
+        REBUILD_FRACTION of the index; past that everything is rebuilt.
+        """
+        names = list(self.names) + list(names)
+        matrix = np.vstack([self.matrix, np.asarray(matrix, dtype=np.float64).reshape(-1, len(self.materials))])
+        if len(names) - self.tree_size > REBUILD_FRACTION * len(names):
+            return RecipeIndex(self.materials, names, matrix)
+        return RecipeIndex(self.materials, names, matrix, scale=self.scale, tree=self.tree, tree_size=self.tree_size)
+
+    def query(self, x, k=5):
+        """
+        Return the k recipes nearest to a composition vector (in material order)
+
+        Returns:
+        - List of (recipe name, distance), nearest first
+        """
+        k = min(k, len(self.names))
+        if k <= 0:
+            return []
+        point = np.asarray(x, dtype=np.float64) / self.scale
+
+        distances, indices = self.tree.query(point[None, :], k=min(k, self.tree_size))
+        distances, indices = distances[0], indices[0]
+
+        # Recipes added after the tree was built
+        if len(self.names) > self.tree_size:
+            extra = np.sqrt(np.sum((self.points[self.tree_size:] - point) ** 2, axis=1))
+            distances = np.concatenate([distances, extra])
+            indices = np.concatenate([indices, np.arange(self.tree_size, len(self.names))])
+            order = np.argsort(distances, kind="stable")[:k]
+            distances, indices = distances[order], indices[order]
+
+        return [(self.names[i], float(d)) for i, d in zip(indices, distances)]
@@ -0,0 +1,63 @@
+import os
+import sys
+import warnings
+from contextlib import contextmanager
+
+import pytest
+
+# main.py resolves its data files relative to the model directory
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MODEL_DIR)
+
+
+@contextmanager
+def model_loading():
+    """
+    Silence the feature name warnings of checking the tree engine against sklearn
+
+    main filters them at import, but pytest resets warning filters around each test.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        yield
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    """main with the model set loaded from the repository's models and workbook"""
+    cwd = os.getcwd()
+    os.chdir(MODEL_DIR)
+    try:
+        with model_loading():
+            import main
+            if main.active_model_set.version is None:
+                main.load_data()
+        yield main
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(main_module):
+    from fastapi.testclient import TestClient
+    # Entering the client runs the startup event, which loads the models again
+    with model_loading():
+        client = TestClient(main_module.app).__enter__()
+    try:
+        yield client
+    finally:
+        client.__exit__(None, None, None)
+
+
+@pytest.fixture
+def formulation(main_module):
+    """A formulation of ten materials of the formulation matrix"""
+    materials = main_module.active_model_set.formulation_matrix.columns.tolist()
+    return {materials[i]: 5.0 + i for i in range(0, 40, 4)}
+
+
+def request_body(formulation, **fields):
+    return {
+        "materialCompositions": [{"material": m, "composition": a} for m, a in formulation.items()],
+        **fields,
+    }
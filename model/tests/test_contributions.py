@@ -0,0 +1,56 @@
+import statistics
+import time
+
+import numpy as np
+import pytest
+
+from conftest import request_body
+
+
+@pytest.fixture(scope="module")
+def model_set(main_module):
+    if not main_module.active_model_set.explainable:
+        pytest.skip("no explainable models")
+    return main_module.active_model_set
+
+
+def random_formulations(model_set, count, seed=0):
+    rng = np.random.default_rng(seed)
+    materials = model_set.formulation_matrix.columns.tolist()
+    return [
+        {materials[i]: float(rng.uniform(0.5, 20)) for i in rng.choice(len(materials), size=10, replace=False)}
+        for _ in range(count)
+    ]
+
+
+def test_shap_values_add_up_to_prediction(main_module, model_set):
+    engine = model_set.tree_engine
+    X = main_module.build_feature_matrix(model_set, random_formulations(model_set, 20))
+    indices = list(model_set.explainable.values())
+    phi = engine.shap_values_many(X, indices)
+    raw = engine.predict_raw(X, indices)
+    for position, index in enumerate(indices):
+        np.testing.assert_allclose(phi[:, position].sum(axis=1), raw[:, position] - engine.expected_raw(index),
+                                   rtol=1e-9, atol=1e-9)
+        np.testing.assert_array_equal(phi[:, position], engine.shap_values(X, index))
+
+
+def test_contributions_at_most_double_predict_latency(main_module, model_set, client, monkeypatch):
+    # Uncached /predict latency with and without the contribution fields
+    monkeypatch.setattr(main_module.prediction_cache, "maxsize", 0)
+    monkeypatch.setattr(main_module.contribution_cache, "maxsize", 0)
+    without = [field for field in main_module.PREDICTION_FIELDS
+               if field not in ("materialImpacts", "materialContributions")]
+    formulations = random_formulations(model_set, 100, seed=1)
+
+    def median_seconds(fields):
+        times = []
+        for formulation in formulations:
+            body = request_body(formulation, **({"fields": fields} if fields is not None else {}))
+            started = time.perf_counter()
+            assert client.post("/predict", json=body).status_code == 200
+            times.append(time.perf_counter() - started)
+        return statistics.median(times)
+
+    median_seconds(None)
+    assert median_seconds(None) <= 2 * median_seconds(without)
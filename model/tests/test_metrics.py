@@ -0,0 +1,27 @@
+import re
+
+from conftest import request_body
+
+
+def metric_values(client, name):
+    """Map the label sets of a metric's samples on /metrics to their values"""
+    values = {}
+    for line in client.get("/metrics").text.splitlines():
+        match = re.fullmatch(re.escape(name) + r"(\{.*\})? (\S+)", line)
+        if match:
+            values[match.group(1) or ""] = float(match.group(2))
+    return values
+
+
+def test_per_model_latency_after_predict(main_module, client, formulation):
+    formulation = {material: amount + 0.123 for material, amount in formulation.items()}
+    before = metric_values(client, "model_predict_duration_seconds_count")
+    assert client.post("/predict", json=request_body(formulation)).status_code == 200
+    after = metric_values(client, "model_predict_duration_seconds_count")
+
+    for test_param in main_module.active_model_set.models:
+        labels = '{test_param="' + test_param + '"}'
+        assert after.get(labels, 0) == before.get(labels, 0) + 1, test_param
+
+    sums = metric_values(client, "model_predict_duration_seconds_sum")
+    assert all(value > 0 for value in sums.values())
@@ -0,0 +1,31 @@
+import pytest
+
+
+def optimization_request(main_module, **limits):
+    model_set = main_module.active_model_set
+    test_param = model_set.property_registry.first(["hardness.unaged.160c_15min"]) or next(iter(model_set.models))
+    materials = model_set.formulation_matrix.columns.tolist()[:3]
+    return {
+        "targets": [{"testParameter": test_param, "min": 0}],
+        "materials": [{"material": material, "max": 10} for material in materials],
+        "seed": 0,
+        **limits,
+    }
+
+
+@pytest.mark.parametrize("limits", [
+    {"maxEvaluations": 0},
+    {"maxEvaluations": -5},
+    {"timeLimit": 0},
+    {"timeLimit": -1.5},
+])
+def test_optimize_rejects_non_positive_limits(main_module, client, limits):
+    response = client.post("/optimize", json=optimization_request(main_module, **limits))
+    assert response.status_code == 422
+
+
+def test_optimize_with_small_budget(main_module, client):
+    response = client.post("/optimize", json=optimization_request(main_module, maxEvaluations=200, timeLimit=2))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["results"] and 0 < body["evaluations"] <= 200
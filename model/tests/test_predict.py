@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import request_body
+
+
+def test_targets_with_fields_without_test_results(client, formulation):
+    response = client.post(
+        "/predict", json=request_body(formulation, targets=["unaged_modulus"], fields=["tensileStrength"])
+    )
+    assert response.status_code == 200
+    assert set(response.json()) == {"tensileStrength"}
+
+
+def test_batch_targets_with_fields_without_test_results(client, formulation):
+    row = request_body(formulation, targets=["tensile"], fields=["hardness"])
+    response = client.post("/predict/batch", json={"formulations": [row, row]})
+    assert response.status_code == 200
+    assert [set(result) for result in response.json()["results"]] == [{"hardness"}, {"hardness"}]
+
+
+def test_targets_limit_test_results(client, formulation):
+    body = client.post(
+        "/predict", json=request_body(formulation, targets=["tensile"], fields=["testResults", "confidenceScore"])
+    ).json()
+    assert set(body) == {"testResults", "confidenceScore"}
+    assert body["testResults"] and all("Tensile" in test_param for test_param in body["testResults"])
+
+
+def test_recipe_predictions_match_model_pass(main_module, client):
+    model_set = main_module.active_model_set
+    for recipe_name in model_set.recipes[:5]:
+        composition = dict(model_set.recipe_compositions[recipe_name])
+        expected = main_module.predict_formulations(model_set, [composition])[0]
+        assert model_set.recipe_predictions[recipe_name] == pytest.approx(expected)
+
+        body = client.get(f"/recipes/{recipe_name}/predictions").json()
+        assert body["recipeName"] == recipe_name
+        assert {test_param: result["predicted"] for test_param, result in body["results"].items()} == (
+            pytest.approx(expected)
+        )
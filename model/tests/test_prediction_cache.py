@@ -0,0 +1,68 @@
+import prediction_cache
+from prediction_cache import PredictionCache, canonicalize_formulation
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    cache = PredictionCache(maxsize=2, ttl=0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(prediction_cache.time, "monotonic", clock)
+    cache = PredictionCache(maxsize=10, ttl=60)
+    cache.put("a", 1)
+
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 1
+    assert cache.get("a") is None
+
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["expirations"]) == (0, 1, 1, 1)
+
+
+def test_zero_ttl_never_expires(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(prediction_cache.time, "monotonic", clock)
+    cache = PredictionCache(maxsize=10, ttl=0)
+    cache.put("a", 1)
+
+    clock.now += 1e9
+    assert cache.get("a") == 1
+
+
+def test_zero_maxsize_disables_cache():
+    cache = PredictionCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_canonicalize_collapses_equivalent_formulations():
+    key = canonicalize_formulation({"Resin": 50.0, "Filler": 30.1, "Oil": 0.0}, 6)
+    assert canonicalize_formulation({"Filler": 30.1 + 1e-9, "Resin": 50}, 6) == key
+    assert canonicalize_formulation({"Oil": 1e-9, "Resin": 50.0, "Filler": 30.1}, 6) == key
+    assert key == (("Filler", 30.1), ("Resin", 50.0))
+
+
+def test_canonicalize_keeps_distinct_formulations_apart():
+    key = canonicalize_formulation({"Resin": 50.0, "Filler": 30.1}, 6)
+    assert canonicalize_formulation({"Resin": 50.0, "Filler": 30.2}, 6) != key
+    assert canonicalize_formulation({"Resin": 50.0, "Filler": 30.1, "Oil": 0.5}, 6) != key
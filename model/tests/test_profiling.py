@@ -0,0 +1,42 @@
+import os
+import time
+
+from conftest import request_body
+from profiling import prune_profiles
+
+
+def test_prune_profiles_keeps_newest(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"run-{i}.prof"
+        path.write_bytes(b"")
+        os.utime(path, (time.time() + i, time.time() + i))
+    (tmp_path / "notes.txt").write_text("kept")
+
+    prune_profiles(str(tmp_path), 2)
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt", "run-3.prof", "run-4.prof"]
+
+
+def test_profile_header_needs_admin_token(main_module, client, formulation, monkeypatch, tmp_path):
+    monkeypatch.setattr(main_module, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(main_module, "ADMIN_TOKEN", "")
+    response = client.post("/predict", json=request_body(formulation), headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "X-Profile-File" not in response.headers
+
+    monkeypatch.setattr(main_module, "ADMIN_TOKEN", "secret")
+    response = client.post(
+        "/predict", json=request_body(formulation), headers={"X-Profile": "1", "X-Admin-Token": "wrong"}
+    )
+    assert "X-Profile-File" not in response.headers
+    assert not os.path.exists(tmp_path) or os.listdir(tmp_path) == []
+
+
+def test_profile_files_are_capped(main_module, client, formulation, monkeypatch, tmp_path):
+    monkeypatch.setattr(main_module, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(main_module, "PROFILE_MAX_FILES", 2)
+    monkeypatch.setattr(main_module, "ADMIN_TOKEN", "secret")
+    headers = {"X-Profile": "1", "X-Admin-Token": "secret"}
+    for _ in range(4):
+        response = client.post("/predict", json=request_body(formulation), headers=headers)
+        assert response.headers["X-Profile-File"].endswith(".prof")
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import recipe_index
+from recipe_index import RecipeIndex
+
+
+def random_recipes(rng, count, n_materials=12):
+    """Sparse compositions with materials dosed on very different scales"""
+    scales = np.geomspace(1, 100, n_materials)
+    matrix = rng.uniform(0, 1, (count, n_materials)) * scales
+    matrix[rng.random((count, n_materials)) < 0.6] = 0
+    return matrix
+
+
+def brute_force(names, matrix, scale, x, k):
+    distances = np.sqrt(np.sum((matrix / scale - x / scale) ** 2, axis=1))
+    order = np.argsort(distances, kind="stable")[:k]
+    return [(names[i], distances[i]) for i in order]
+
+
+def assert_same_neighbours(found, expected):
+    assert [name for name, _ in found] == [name for name, _ in expected]
+    assert [distance for _, distance in found] == pytest.approx([distance for _, distance in expected])
+
+
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_query_matches_brute_force(k):
+    rng = np.random.default_rng(0)
+    matrix = random_recipes(rng, 300)
+    names = [f"R{i}" for i in range(len(matrix))]
+    index = RecipeIndex(range(matrix.shape[1]), names, matrix)
+
+    for x in random_recipes(rng, 25):
+        assert_same_neighbours(index.query(x, k), brute_force(names, matrix, index.scale, x, k))
+
+
+def test_query_with_added_recipes_matches_brute_force():
+    rng = np.random.default_rng(1)
+    matrix = random_recipes(rng, 200)
+    names = [f"R{i}" for i in range(len(matrix))]
+    index = RecipeIndex(range(matrix.shape[1]), names, matrix)
+
+    # Few enough to be searched alongside the existing tree
+    added = random_recipes(rng, 20)
+    added_names = [f"N{i}" for i in range(len(added))]
+    grown = index.with_recipes(added_names, added)
+    assert grown.tree is index.tree and len(grown) == 220
+    assert len(index) == 200
+
+    all_names = names + added_names
+    all_matrix = np.vstack([matrix, added])
+    for x in np.vstack([random_recipes(rng, 20), added[:5]]):
+        assert_same_neighbours(grown.query(x, 8), brute_force(all_names, all_matrix, grown.scale, x, 8))
+
+
+def test_with_recipes_rebuilds_past_rebuild_fraction():
+    rng = np.random.default_rng(2)
+    matrix = random_recipes(rng, 40)
+    names = [f"R{i}" for i in range(len(matrix))]
+    index = RecipeIndex(range(matrix.shape[1]), names, matrix)
+
+    count = int(len(matrix) * recipe_index.REBUILD_FRACTION / (1 - recipe_index.REBUILD_FRACTION)) + 1
+    added = random_recipes(rng, count)
+    added_names = [f"N{i}" for i in range(count)]
+    grown = index.with_recipes(added_names, added)
+    assert grown.tree is not index.tree and grown.tree_size == len(grown)
+
+    all_names = names + added_names
+    all_matrix = np.vstack([matrix, added])
+    for x in random_recipes(rng, 10):
+        assert_same_neighbours(grown.query(x, 5), brute_force(all_names, all_matrix, grown.scale, x, 5))
+
+
+def test_query_k_larger_than_index():
+    matrix = np.array([[1.0, 0.0], [0.0, 2.0]])
+    index = RecipeIndex(["A", "B"], ["R0", "R1"], matrix)
+    assert [name for name, _ in index.query([1.0, 0.0], k=5)] == ["R0", "R1"]
@@ -0,0 +1,20 @@
+import os
+
+from compound_predictor import model_files_fingerprint
+
+
+def test_model_files_fingerprint_tracks_model_changes(tmp_path):
+    model_file = tmp_path / "Tensile_model.joblib"
+    model_file.write_bytes(b"model")
+    (tmp_path / "training_manifest.json").write_text("{}")
+    fingerprint = model_files_fingerprint(str(tmp_path))
+    
+    assert model_files_fingerprint(str(tmp_path)) == fingerprint
+    
+    stat = model_file.stat()
+    os.utime(model_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    retrained = model_files_fingerprint(str(tmp_path))
+    assert retrained != fingerprint
+    
+    (tmp_path / "Elongation_model.joblib").write_bytes(b"model")
+    assert model_files_fingerprint(str(tmp_path)) not in (fingerprint, retrained)
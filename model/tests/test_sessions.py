@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from conftest import request_body
+from tree_engine import IncrementalState
+
+
+def without_session_fields(body):
+    return {key: value for key, value in body.items() if key not in ("sessionId", "treesEvaluated")}
+
+
+def test_incremental_state_matches_full_evaluation(main_module):
+    engine = main_module.active_model_set.tree_engine
+    if engine is None:
+        pytest.skip("tree engine disabled")
+    max_amounts = main_module.active_model_set.formulation_matrix.max(axis=0).to_numpy()
+
+    rng = np.random.default_rng(0)
+    x = np.zeros(engine.n_features)
+    x[:len(max_amounts)] = np.where(rng.random(len(max_amounts)) < 0.25, max_amounts, 0.0)
+    state = IncrementalState(engine, x)
+    np.testing.assert_array_equal(state.predict(), engine.predict(x[None, :])[0])
+
+    for step in range(300):
+        # Mostly single-material slider steps, sometimes several materials at once
+        features = rng.choice(len(max_amounts), size=1 if step % 10 else 3, replace=False)
+        changes = {int(f): float(rng.uniform(0, 1) * max_amounts[f]) if rng.random() > 0.1 else 0.0 for f in features}
+        state.update(changes)
+        for feature, amount in changes.items():
+            x[feature] = amount
+        np.testing.assert_array_equal(state.predict(), engine.predict(x[None, :])[0], err_msg=f"step {step}")
+
+
+def test_session_updates_match_predict(main_module, client, formulation):
+    fields = ["testResults", "tensileStrength", "modulus100", "recommendedUses"]
+    started = client.post("/predict/session", json=request_body(formulation, fields=fields)).json()
+    assert started["treesEvaluated"] == main_module.active_model_set.tree_engine.n_trees
+    session_id = started["sessionId"]
+
+    materials = main_module.active_model_set.formulation_matrix.columns.tolist()
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        material = materials[int(rng.integers(0, 40))]
+        amount = float(round(rng.uniform(0, 30), 2)) if rng.random() > 0.2 else 0.0
+        formulation[material] = amount
+
+        updated = client.post(
+            f"/predict/session/{session_id}", json=request_body({material: amount}, fields=fields)
+        )
+        assert updated.status_code == 200
+        expected = client.post("/predict", json=request_body(formulation, fields=fields)).json()
+        assert without_session_fields(updated.json()) == expected
+
+
+def test_session_defaults_skip_contributions(client, formulation):
+    body = client.post("/predict/session", json=request_body(formulation)).json()
+    assert "testResults" in body
+    assert "materialImpacts" not in body and "materialContributions" not in body
+
+    body = client.post(
+        f"/predict/session/{body['sessionId']}", json=request_body({}, fields=["materialImpacts"])
+    ).json()
+    assert set(without_session_fields(body)) == {"materialImpacts"}
+
+
+def test_ended_session_is_not_found(client, formulation):
+    session_id = client.post("/predict/session", json=request_body(formulation)).json()["sessionId"]
+    assert client.delete(f"/predict/session/{session_id}").status_code == 204
+    assert client.post(f"/predict/session/{session_id}", json=request_body({})).status_code == 404
+    assert client.delete(f"/predict/session/{session_id}").status_code == 404
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from tree_engine import load_bundle, save_bundle
+
+
+@pytest.fixture(scope="module")
+def model_set(main_module):
+    if main_module.active_model_set.tree_engine is None:
+        pytest.skip("tree engine disabled")
+    return main_module.active_model_set
+
+
+@pytest.fixture(scope="module")
+def random_rows(model_set):
+    """Random formulations up to the largest amount of each material in the recipes"""
+    rng = np.random.default_rng(0)
+    max_amounts = model_set.formulation_matrix.max(axis=0).to_numpy()
+    X = np.zeros((200, model_set.tree_engine.n_features))
+    used = rng.random((200, len(max_amounts))) < 0.25
+    X[:, :len(max_amounts)] = np.where(used, rng.uniform(0, 1, used.shape) * max_amounts, 0.0)
+    return X
+
+
+def test_bundle_round_trip_maps_traversal_arrays(model_set, random_rows, tmp_path):
+    engine = model_set.tree_engine
+    path = tmp_path / "models.bundle"
+    save_bundle(engine, str(path))
+    loaded, manifest = load_bundle(str(path))
+
+    assert manifest["test_params"] == engine.test_params
+    # The arrays walked per request come straight from the read-only map
+    for name in ("split_feature", "split_threshold", "node_split", "children"):
+        array = getattr(loaded, name)
+        assert not array.flags.writeable and not array.flags.owndata, name
+        np.testing.assert_array_equal(array, getattr(engine, name))
+    np.testing.assert_array_equal(loaded.predict(random_rows), engine.predict(random_rows))
+
+
+# The API scores NumPy rows too (see main.build_feature_layout)
+@pytest.mark.filterwarnings("ignore:X does not have valid feature names")
+def test_engine_matches_sklearn(model_set, random_rows):
+    engine = model_set.tree_engine
+    predictions = engine.predict(random_rows)
+    for j, test_param in enumerate(engine.test_params):
+        model = model_set.models[test_param]
+        expected = model.predict(random_rows[:, model_set.model_feature_orders[test_param]])
+        np.testing.assert_allclose(predictions[:, j], expected, rtol=1e-7, atol=1e-9, err_msg=test_param)
+
+
+def test_engine_model_subset_matches_all_models(model_set, random_rows):
+    engine = model_set.tree_engine
+    models = [5, 0, len(engine.test_params) - 1]
+    np.testing.assert_array_equal(engine.predict(random_rows, models), engine.predict(random_rows)[:, models])
@@ -0,0 +1,85 @@
+import asyncio
+import io
+import json
+import tempfile
+
+import pandas as pd
+import pytest
+
+
+def upload_frame(main_module, rows=30):
+    model_set = main_module.active_model_set
+    frame = model_set.formulation_matrix.iloc[:rows].reset_index(drop=True)
+    frame.insert(0, "id", [f"R{i}" for i in range(len(frame))])
+    return frame
+
+
+def expected_results(main_module, frame):
+    materials = [column for column in frame.columns if column != "id"]
+    formulations = [
+        {material: amount for material, amount in zip(materials, row) if amount}
+        for row in frame[materials].itertuples(index=False)
+    ]
+    return main_module.predict_formulations(main_module.active_model_set, formulations)
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_upload_matches_predict_formulations(main_module, client, file_format):
+    frame = upload_frame(main_module)
+    body = io.BytesIO()
+    if file_format == "csv":
+        frame.to_csv(body, index=False)
+    else:
+        frame.to_parquet(body, index=False)
+
+    response = client.post("/predict/upload", params={"idColumn": "id"}, content=body.getvalue())
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["unknownMaterials"] == []
+    assert lines[-1] == {"rows": len(frame)}
+
+    results = lines[1:-1]
+    assert [line["id"] for line in results] == frame["id"].tolist()
+    for line, expected in zip(results, expected_results(main_module, frame)):
+        assert line["testResults"] == pytest.approx(expected)
+
+
+def test_upload_closed_when_stream_stops_early(main_module):
+    frame = upload_frame(main_module)
+    upload = tempfile.SpooledTemporaryFile()
+    frame.to_csv(upload, index=False)
+    upload.seek(0)
+
+    async def first_lines():
+        # Stop after the first chunk of results, with the chunk reader still open
+        stream = main_module.stream_upload_predictions(upload, "id")
+        lines = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return lines
+
+    header, results = asyncio.run(first_lines())
+    assert "modelVersion" in json.loads(header)
+    assert json.loads(results.splitlines()[0])["id"] == "R0"
+    assert upload.closed
+
+
+
+def test_upload_over_content_length_limit_rejected(main_module, client, monkeypatch):
+    monkeypatch.setattr(main_module, "UPLOAD_MAX_BYTES", 100)
+    body = upload_frame(main_module).to_csv(index=False).encode("utf-8")
+
+    response = client.post("/predict/upload", content=body)
+    assert response.status_code == 413
+
+
+def test_upload_without_content_length_stopped_at_limit(main_module, client, monkeypatch):
+    monkeypatch.setattr(main_module, "UPLOAD_MAX_BYTES", 100)
+    body = upload_frame(main_module).to_csv(index=False).encode("utf-8")
+
+    def blocks():
+        # A generator body is sent chunked, with no Content-Length to check up front
+        for start in range(0, len(body), 64):
+            yield body[start:start + 64]
+
+    response = client.post("/predict/upload", content=blocks())
+    assert response.status_code == 413
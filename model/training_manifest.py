@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import platform
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+MANIFEST_FILENAME = "training_manifest.json"
+# Bump when the manifest layout changes; older manifests are ignored
+MANIFEST_FORMAT_VERSION = 1
+# Values are hashed at this many significant digits, so float noise from
+# re-saving the workbook doesn't count as a data change
+FINGERPRINT_DIGITS = 12
+
+
+def library_versions():
+    """Return the versions of the libraries a trained model depends on"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scikit-learn": sklearn.__version__,
+        "joblib": joblib.__version__,
+    }
+
+
+def config_fingerprint(config):
+    """Return the hex SHA-256 of a JSON-serializable training configuration"""
+    encoded = json.dumps(config, sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _hash_values(digest, values):
+    values = np.asarray(values, dtype=np.float64)
+    digest.update(repr(values.shape).encode("utf-8"))
+    digest.update(",".join(f"{v:.{FINGERPRINT_DIGITS}g}" for v in values.ravel()).encode("utf-8"))
+
+
+def data_fingerprint(X, y):
+    """
+    Return the hex SHA-256 of one test parameter's aligned training data
+
+    The recipe names, feature names and values of X and y all go into the
+    hash, so adding, removing or editing a recipe, a raw material or a result
+    changes the fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in X.columns], ensure_ascii=False).encode("utf-8"))
+    digest.update(json.dumps([str(r) for r in X.index], ensure_ascii=False).encode("utf-8"))
+    _hash_values(digest, X.to_numpy(dtype=np.float64))
+    digest.update(json.dumps([str(r) for r in y.index], ensure_ascii=False).encode("utf-8"))
+    _hash_values(digest, y.to_numpy(dtype=np.float64))
+    return digest.hexdigest()
+
+
+def load_manifest(model_dir):
+    """Return the training manifest in model_dir, or None if it is missing or unreadable"""
+    try:
+        with open(os.path.join(model_dir, MANIFEST_FILENAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format_version") != MANIFEST_FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(model_dir, config, parameters):
+    """
+    Write the training manifest to model_dir
+
+    Parameters:
+    - config: Training configuration (hyperparameters, CV settings, library versions)
+    - parameters: Dictionary of test parameter -> entry with at least
+      "fingerprint" and "model_file"
+    """
+    manifest = {
+        "format_version": MANIFEST_FORMAT_VERSION,
+        "config": config,
+        "config_fingerprint": config_fingerprint(config),
+        "parameters": parameters,
+    }
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True, default=repr, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def plan_training(manifest, config, fingerprints, model_dir):
+    """
+    Split test parameters into those that must be retrained and those whose
+    saved model is still current
+
+    A parameter is current when the manifest was written with the same
+    training configuration, records the same data fingerprint and its model
+    file still exists. Everything is retrained when there is no manifest or
+    the configuration changed.
+
+    Returns:
+    - (stale, current, reason) where stale and current are lists of test
+      parameters and reason explains a full retrain (None otherwise)
+    """
+    if manifest is None:
+        return list(fingerprints), [], "no training manifest"
+    if manifest.get("config_fingerprint") != config_fingerprint(config):
+        return list(fingerprints), [], "training configuration or library versions changed"
+
+    entries = manifest.get("parameters", {})
+    stale, current = [], []
+    for test_param, fingerprint in fingerprints.items():
+        entry = entries.get(test_param) or {}
+        model_file = entry.get("model_file")
+        if (entry.get("fingerprint") == fingerprint
+                and model_file
+                and os.path.isfile(os.path.join(model_dir, model_file))):
+            current.append(test_param)
+        else:
+            stale.append(test_param)
+    return stale, current, None
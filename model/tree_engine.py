@@ -0,0 +1,857 @@
+import json
+import math
+import os
+
+import numpy as np
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.dummy import DummyRegressor
+from sklearn.ensemble import ExtraTreesRegressor, GradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+
+# Rows evaluated per traversal step; bounds the (rows x trees) node index arrays
+PREDICT_CHUNK_SIZE = 32
+
+# Model subsets whose tree layout (see model_trees) is kept; past this, new
+# subsets are computed without being cached
+MODEL_TREES_CACHE_SIZE = 256
+
+# Models at most this deep get their TreeSHAP terms tabulated (see shap_table):
+# 2 ** depth path patterns per leaf
+SHAP_TABLE_MAX_DEPTH = 6
+
+_EMPTY = np.empty(0, dtype=np.intp)
+
+
+def _union(arrays, size):
+    """Return the sorted union of sorted, duplicate-free arrays of integers below size"""
+    arrays = [array for array in arrays if len(array)]
+    if len(arrays) == 1:
+        return arrays[0]
+    if not arrays:
+        return _EMPTY
+    # A mask is cheaper than sorting when the arrays hold many values
+    mask = np.zeros(size, dtype=bool)
+    mask[np.concatenate(arrays)] = True
+    return np.flatnonzero(mask)
+
+# Single-file model bundle: magic, manifest length (uint64 LE), JSON manifest,
+# then the engine arrays, each starting on an aligned offset so they can be
+# used straight from a read-only memory map
+BUNDLE_FILENAME = "compound_models.bundle"
+BUNDLE_MAGIC = b"CMPDBNDL"
+BUNDLE_FORMAT_VERSION = 4
+BUNDLE_ALIGNMENT = 64
+BUNDLE_ARRAYS = {
+    "feature": np.dtype("<i4"),
+    "threshold": np.dtype("<f8"),
+    "children_left": np.dtype("<i4"),
+    "children_right": np.dtype("<i4"),
+    "value": np.dtype("<f8"),
+    "cover": np.dtype("<f8"),
+    "tree_roots": np.dtype("<i4"),
+    "model_tree_offsets": np.dtype("<i4"),
+    "init": np.dtype("<f8"),
+    "tree_scale": np.dtype("<f8"),
+    "linear_coef": np.dtype("<f8"),
+    "inverse_expm1": np.dtype("?"),
+    # Traversal index (see TreeEnsembleEngine._build_traversal_index), stored
+    # so every process walks the mapped pages instead of building its own copy
+    "split_feature": np.dtype("<i8"),
+    "split_threshold": np.dtype("<f8"),
+    "node_split": np.dtype("<i4"),
+    "children": np.dtype("<i4"),
+}
+
+
+class TreeEnsembleEngine:
+    """
+    Every tree of every compound model packed into contiguous NumPy arrays
+
+    Nodes of all trees share one set of arrays (feature, threshold, children,
+    leaf value). Leaves point to themselves, so all trees can be walked in
+    lock-step for max_depth steps with vectorized gathers. Feature indices
+    refer to the columns of the request feature matrix built by the API.
+
+    Each model's raw output is init + tree_scale * (sum of its tree leaf
+    values) + X @ linear_coef: gradient boosting uses its init estimator and
+    learning rate, forests average their trees, linear models carry their
+    intercept and coefficients (with a single zero-valued leaf as their tree).
+    Node covers (training sample weight reaching each node) are kept for
+    TreeSHAP attribution.
+    """
+
+    def __init__(self, test_params, feature, threshold, children_left, children_right,
+                 value, cover, tree_roots, model_tree_offsets, init, tree_scale, linear_coef,
+                 inverse_expm1, max_depth, n_features, feature_names=None, split_feature=None,
+                 split_threshold=None, node_split=None, children=None):
+        self.test_params = list(test_params)
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.cover = cover
+        self.tree_roots = tree_roots
+        self.model_tree_offsets = model_tree_offsets
+        self.init = init
+        self.tree_scale = tree_scale
+        self.linear_coef = linear_coef
+        self._has_linear = bool(np.any(linear_coef))
+        self.inverse_expm1 = inverse_expm1
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.model_index = {test_param: i for i, test_param in enumerate(self.test_params)}
+        self.model_tree_counts = np.diff(np.append(model_tree_offsets, len(tree_roots)))
+        if split_feature is None or split_threshold is None or node_split is None or children is None:
+            self._build_traversal_index()
+        else:
+            self.split_feature = split_feature
+            self.split_threshold = split_threshold
+            self.node_split = node_split
+            self.children = children
+        self._leaf_paths = {}
+        self._shap_tables = {}
+        self._shap_layouts = {}
+        self._model_trees = {}
+        self._feature_splits = None
+
+    @property
+    def n_trees(self):
+        return len(self.tree_roots)
+
+    def _build_traversal_index(self):
+        """Deduplicate (feature, threshold) splits and pack children for traversal"""
+        node_ids = np.arange(len(self.feature))
+        internal = self.children_left != node_ids
+
+        # The ensembles share a small set of distinct splits (thresholds are
+        # midpoints between the few training values of each material), so each
+        # split is evaluated once per row and nodes only look up its outcome
+        splits, node_split = np.unique(
+            np.stack([self.feature[internal], self.threshold[internal]], axis=1),
+            axis=0, return_inverse=True
+        )
+        self.split_feature = splits[:, 0].astype(np.intp)
+        self.split_threshold = splits[:, 1]
+
+        # Leaves look up an extra split column that is always False
+        self.node_split = np.full(len(self.feature), len(splits), dtype=np.int32)
+        self.node_split[internal] = node_split.ravel()
+
+        # children[2 * node] is the left child, children[2 * node + 1] the right one
+        self.children = np.stack([self.children_left, self.children_right], axis=1).ravel().astype(np.int32)
+
+    def model_trees(self, models):
+        """
+        Return the trees of a subset of models and where each model's trees start among them
+
+        Returns:
+        - (tree indices, per-model offsets into those indices)
+        """
+        key = tuple(models)
+        cached = self._model_trees.get(key)
+        if cached is not None:
+            return cached
+
+        ends = np.append(self.model_tree_offsets[1:], self.n_trees)
+        trees = [np.arange(self.model_tree_offsets[i], ends[i]) for i in models]
+        offsets = np.cumsum([0] + [len(t) for t in trees[:-1]])
+        cached = (np.concatenate(trees).astype(np.intp), offsets.astype(np.intp))
+        if len(self._model_trees) < MODEL_TREES_CACHE_SIZE:
+            self._model_trees[key] = cached
+        return cached
+
+    def _build_feature_index(self):
+        """Index the distinct splits on each feature column, the trees using each split and each tree's model"""
+        feature_splits = {}
+        for split, feature in enumerate(self.split_feature):
+            feature_splits.setdefault(int(feature), []).append(split)
+        self._feature_splits = {feature: np.array(splits, dtype=np.intp) for feature, splits in feature_splits.items()}
+
+        # Split -> trees using it, as CSR arrays; nodes of each tree are stored
+        # contiguously from its root
+        node_ids = np.arange(len(self.feature))
+        internal = self.children_left != node_ids
+        node_tree = np.searchsorted(self.tree_roots, node_ids, side="right") - 1
+        pairs = np.unique(np.stack([self.node_split[internal], node_tree[internal]], axis=1), axis=0)
+        self._split_tree_ptr = np.searchsorted(pairs[:, 0], np.arange(len(self.split_feature) + 1))
+        self._split_trees = pairs[:, 1].astype(np.intp)
+
+        self._tree_model = np.searchsorted(self.model_tree_offsets, np.arange(self.n_trees), side="right") - 1
+        self._feature_linear_models = {
+            feature: np.flatnonzero(self.linear_coef[:, feature]) for feature in range(self.n_features)
+        }
+
+    def feature_splits(self, features):
+        """Return the distinct splits (see split_outcomes) on any of the given feature columns"""
+        if self._feature_splits is None:
+            self._build_feature_index()
+        return _union([self._feature_splits.get(int(feature), _EMPTY) for feature in features], len(self.split_feature))
+
+    def split_trees(self, splits):
+        """Return the trees (sorted) with a node on any of the given distinct splits"""
+        if self._feature_splits is None:
+            self._build_feature_index()
+        ptr = self._split_tree_ptr
+        return _union([self._split_trees[ptr[split]:ptr[split + 1]] for split in splits], self.n_trees)
+
+    def affected_models(self, trees, features):
+        """Return the models (sorted) owning any of the sorted trees or with a linear term in any of the features"""
+        if self._feature_splits is None:
+            self._build_feature_index()
+        models = self._tree_model[trees]
+        if len(models):
+            models = models[np.concatenate(([True], models[1:] != models[:-1]))]
+        if not self._has_linear:
+            return models
+        return _union([models] + [self._feature_linear_models[int(f)] for f in features], len(self.test_params))
+
+    def apply(self, X, trees=None):
+        """Return the leaf node reached in every tree (or the given trees) for each row of X, shape (rows, trees)"""
+        tree_roots = self.tree_roots if trees is None else self.tree_roots[trees]
+        # sklearn evaluates trees on float32 inputs; comparing float32 values
+        # against the float64 thresholds reproduces its split decisions exactly
+        X = np.asarray(X, dtype=np.float32)
+        leaves = np.empty((X.shape[0], len(tree_roots)), dtype=np.intp)
+
+        for start in range(0, X.shape[0], PREDICT_CHUNK_SIZE):
+            goes_right = self.split_outcomes(X[start:start + PREDICT_CHUNK_SIZE])
+            leaves[start:start + PREDICT_CHUNK_SIZE] = self.walk(goes_right, tree_roots)
+
+        return leaves
+
+    def split_outcomes(self, X):
+        """
+        Return the outcome of every distinct split for every row of X (True = go right)
+
+        Shape (rows, splits + 1); the extra last column, looked up by leaves, is always False.
+        """
+        goes_right = np.zeros((X.shape[0], len(self.split_feature) + 1), dtype=bool)
+        goes_right[:, :-1] = np.asarray(X, dtype=np.float32)[:, self.split_feature] > self.split_threshold
+        return goes_right
+
+    def walk(self, goes_right, tree_roots):
+        """Walk trees down from their roots given split outcomes, returning the leaf reached per row and tree"""
+        n_rows, n_splits = goes_right.shape
+        goes_right = goes_right.ravel()
+
+        # Node indices are kept as int32 to halve the memory traffic of the gathers
+        row_offsets = (np.arange(n_rows, dtype=np.int32) * n_splits)[:, None]
+        nodes = np.repeat(tree_roots[None, :].astype(np.int32), n_rows, axis=0)
+        for _ in range(self.max_depth):
+            nodes = self.children.take(2 * nodes + goes_right.take(row_offsets + self.node_split.take(nodes)))
+        return nodes
+
+    def predict_raw(self, X, models=None):
+        """
+        Return the raw (pre inverse transform) ensemble outputs, shape (rows, models)
+
+        With models (a list of model indices) only their trees are walked and
+        the columns follow that order.
+        """
+        trees = self.model_trees(models)[0] if models is not None else None
+        return self.raw_from_leaves(self.apply(X, trees), X, models)
+
+    def raw_from_leaves(self, leaves, X, models=None):
+        """Return the raw outputs for rows of X from the leaves apply reached (in the trees of models if given)"""
+        if models is None:
+            offsets = self.model_tree_offsets
+            models = slice(None)
+        else:
+            models = np.asarray(models, dtype=np.intp)
+            offsets = self.model_trees(models)[1]
+
+        # Sum leaf values per model, then apply the init/intercept and tree scale
+        tree_sums = np.add.reduceat(self.value.take(leaves), offsets, axis=1)
+        raw = self.init[models] + self.tree_scale[models] * tree_sums
+        if self._has_linear:
+            raw += np.asarray(X, dtype=np.float64) @ self.linear_coef[models].T
+        return raw
+
+    def predict(self, X, models=None):
+        """Return model predictions for each row of X, shape (rows, models); see predict_raw for models"""
+        return self.inverse_transform(self.predict_raw(X, models), models)
+
+    def inverse_transform(self, raw, models=None):
+        """Map raw outputs (columns in the order of models, if given) to predictions, in place"""
+        inverse = self.inverse_expm1 if models is None else self.inverse_expm1[np.asarray(models, dtype=np.intp)]
+        raw[:, inverse] = np.expm1(raw[:, inverse])
+        return raw
+
+    def has_trees(self, index):
+        """Whether a model's output comes from its trees alone (not a linear model)"""
+        return not np.any(self.linear_coef[index])
+
+    def leaf_paths(self, index):
+        """
+        Return the root-to-leaf paths of one model's trees, merged per feature
+
+        Each leaf gets max_depth slots, one per distinct feature split on its
+        path, holding the feature, the share of cover that follows the path
+        through that feature's splits (zero fraction) and the interval
+        (lower, upper] a value must lie in to follow all of them. Unused slots
+        point at the always-zero padding column with a zero fraction of 1 and
+        an unbounded interval, which makes them null players.
+
+        Returns:
+        - (leaf values scaled by tree_scale (leaves,), features, zero
+          fractions, lower bounds, upper bounds (leaves, max_depth))
+        """
+        paths = self._leaf_paths.get(index)
+        if paths is not None:
+            return paths
+
+        first_tree = self.model_tree_offsets[index]
+        last_tree = self.model_tree_offsets[index + 1] if index + 1 < len(self.model_tree_offsets) else self.n_trees
+        slots = max(self.max_depth, 1)
+
+        values, features, zeros, lowers, uppers = [], [], [], [], []
+        for root in self.tree_roots[first_tree:last_tree]:
+            # Depth-first walk carrying feature -> [zero fraction, lower, upper]
+            stack = [(int(root), {})]
+            while stack:
+                node, path = stack.pop()
+                left, right = int(self.children_left[node]), int(self.children_right[node])
+                if left == node:
+                    row_features = np.full(slots, self.n_features - 1, dtype=np.intp)
+                    row_zeros, row_lowers, row_uppers = np.ones(slots), np.full(slots, -np.inf), np.full(slots, np.inf)
+                    for slot, (feature, (zero, lower, upper)) in enumerate(path.items()):
+                        row_features[slot], row_zeros[slot] = feature, zero
+                        row_lowers[slot], row_uppers[slot] = lower, upper
+                    values.append(self.value[node] * self.tree_scale[index])
+                    features.append(row_features)
+                    zeros.append(row_zeros)
+                    lowers.append(row_lowers)
+                    uppers.append(row_uppers)
+                    continue
+
+                feature, threshold = int(self.feature[node]), float(self.threshold[node])
+                zero, lower, upper = path.get(feature, (1.0, -np.inf, np.inf))
+                for child, child_lower, child_upper in (
+                    (left, lower, min(upper, threshold)),
+                    (right, max(lower, threshold), upper),
+                ):
+                    child_path = dict(path)
+                    child_path[feature] = (zero * self.cover[child] / self.cover[node], child_lower, child_upper)
+                    stack.append((child, child_path))
+
+        paths = (np.array(values), np.array(features), np.array(zeros), np.array(lowers), np.array(uppers))
+        self._leaf_paths[index] = paths
+        return paths
+
+    def expected_raw(self, index):
+        """Return a model's cover-weighted mean raw output, the baseline of its SHAP values"""
+        values, _, zeros, _, _ = self.leaf_paths(index)
+        return float(self.init[index] + np.sum(values * np.prod(zeros, axis=1)))
+
+    def _shap_weights(self, slots):
+        """Shapley weights w(k) = k! (D - k - 1)! / D! for paths of D slots"""
+        return np.array([
+            math.factorial(k) * math.factorial(slots - k - 1) / math.factorial(slots) for k in range(slots)
+        ])
+
+    def _path_contributions(self, ones, zeros, weights):
+        """
+        Return the TreeSHAP contribution of every path slot given its one fractions
+
+        ones has shape (rows, leaves, slots); the result has the same shape
+        and is not yet scaled by the leaf values.
+        """
+        rows, leaves, slots = ones.shape
+
+        # Coefficients of prod_j (z_j + o_j t) over all path features
+        poly = np.zeros((rows, leaves, slots + 1))
+        poly[:, :, 0] = 1.0
+        for j in range(slots):
+            shifted = poly[:, :, :-1] * ones[:, :, j:j + 1]
+            poly *= zeros[:, j:j + 1]
+            poly[:, :, 1:] += shifted
+
+        # Divide out each feature's own factor and weight the coefficients
+        contributions = np.empty((rows, leaves, slots))
+        for i in range(slots):
+            z, o = zeros[:, i], ones[:, :, i]
+            # o_i = 0: the factor is the constant z_i
+            others_cold = poly[:, :, :slots] / z[:, None]
+            # o_i = 1: synthetic division by (t + z_i) from the top coefficient
+            others_hot = np.empty((rows, leaves, slots))
+            others_hot[:, :, slots - 1] = poly[:, :, slots]
+            for k in range(slots - 1, 0, -1):
+                others_hot[:, :, k - 1] = poly[:, :, k] - z * others_hot[:, :, k]
+            others = np.where(o[:, :, None] > 0, others_hot, others_cold)
+            contributions[:, :, i] = (o - z) * (others @ weights)
+        return contributions
+
+    def shap_table(self, index):
+        """
+        Return one model's TreeSHAP terms for every leaf and path pattern, or None past SHAP_TABLE_MAX_DEPTH
+
+        A row's contributions through a leaf only depend on which of the
+        leaf's path slots it satisfies, so they are computed once per pattern
+        (bit j set when the row satisfies slot j) when the model is loaded.
+
+        Returns:
+        - Array of shape (leaves * 2 ** slots, slots), row leaf * 2 ** slots + pattern
+        """
+        table = self._shap_tables.get(index)
+        if table is not None or index in self._shap_tables:
+            return table
+
+        values, features, zeros, _, _ = self.leaf_paths(index)
+        leaves, slots = features.shape
+        if slots > SHAP_TABLE_MAX_DEPTH:
+            self._shap_tables[index] = None
+            return None
+
+        patterns = 1 << slots
+        pattern_ones = (np.arange(patterns)[:, None] >> np.arange(slots)) & 1
+        ones = np.broadcast_to(pattern_ones[:, None, :], (patterns, leaves, slots)).astype(np.float64)
+        contributions = self._path_contributions(ones, zeros, self._shap_weights(slots)) * values[:, None]
+        table = np.ascontiguousarray(contributions.transpose(1, 0, 2)).reshape(leaves * patterns, slots)
+        self._shap_tables[index] = table
+        return table
+
+    def _shap_layout(self, indices):
+        """
+        Concatenate the leaf paths and shap_table rows of several tabulated models
+
+        Returns:
+        - (path features, lower bounds, upper bounds, each (slots, leaves),
+          stacked tables, first table row per leaf, output bin per path slot
+          (model position * n_features + feature), shape (leaves, slots))
+        """
+        key = tuple(indices)
+        layout = self._shap_layouts.get(key)
+        if layout is not None:
+            return layout
+
+        features, lowers, uppers, tables, leaf_rows, bins = [], [], [], [], [], []
+        table_offset = 0
+        for position, index in enumerate(indices):
+            _, model_features, _, model_lowers, model_uppers = self.leaf_paths(index)
+            table = self.shap_table(index)
+            leaves, slots = model_features.shape
+            features.append(model_features)
+            lowers.append(model_lowers)
+            uppers.append(model_uppers)
+            tables.append(table)
+            leaf_rows.append(table_offset + (np.arange(leaves) << slots))
+            bins.append(model_features + position * self.n_features)
+            table_offset += len(table)
+
+        # Slot-major, so each slot's comparisons are contiguous
+        layout = (
+            np.ascontiguousarray(np.concatenate(features).T),
+            np.ascontiguousarray(np.concatenate(lowers).T),
+            np.ascontiguousarray(np.concatenate(uppers).T),
+            np.concatenate(tables), np.concatenate(leaf_rows), np.concatenate(bins),
+        )
+        if len(self._shap_layouts) < MODEL_TREES_CACHE_SIZE:
+            self._shap_layouts[key] = layout
+        return layout
+
+    def shap_values(self, X, index):
+        """
+        Exact path-dependent TreeSHAP values of one model for each row of X
+
+        Attributions are in raw output space (before the expm1 inverse
+        transform) and cover the trees only, so for tree models each row sums
+        to predict_raw minus expected_raw. The Shapley value of every leaf's
+        game is taken in closed form: with zero fractions z and one fractions
+        o (0/1, whether the row satisfies the leaf's splits on a feature),
+        feature i gets (o_i - z_i) * sum_k w(k) * c_k, where c_k is the t^k
+        coefficient of prod over the other path features of (z_j + o_j t)
+        and w(k) = k! (D - k - 1)! / D!. With a shap_table the terms are
+        looked up by each leaf's pattern of o instead of computed per row.
+
+        Returns:
+        - Array of shape (rows, n_features)
+        """
+        if self.shap_table(index) is not None:
+            return self.shap_values_many(X, [index])[:, 0]
+
+        values, features, zeros, lowers, uppers = self.leaf_paths(index)
+        weights = self._shap_weights(features.shape[1])
+
+        # Compare the float32 inputs the way apply() does
+        X = np.asarray(X, dtype=np.float32)
+        phi = np.zeros((X.shape[0], self.n_features))
+        for start in range(0, X.shape[0], PREDICT_CHUNK_SIZE):
+            X_chunk = X[start:start + PREDICT_CHUNK_SIZE]
+            rows = X_chunk.shape[0]
+            x = X_chunk[:, features]
+            ones = ((x > lowers) & (x <= uppers)).astype(np.float64)
+            contributions = self._path_contributions(ones, zeros, weights) * values[:, None]
+
+            # Sum over leaves per feature, one bincount for the whole chunk
+            flat_features = (features[None, :, :] + (np.arange(rows) * self.n_features)[:, None, None]).ravel()
+            phi[start:start + rows] = np.bincount(
+                flat_features, weights=contributions.ravel(), minlength=rows * self.n_features
+            ).reshape(rows, self.n_features)
+
+        # The padding column never varies
+        phi[:, -1] = 0.0
+        return phi
+
+    def shap_values_many(self, X, indices):
+        """
+        TreeSHAP values of several models for each row of X (see shap_values)
+
+        Tabulated models are explained together in one pass over their
+        concatenated leaves, giving the same values as one call per model.
+
+        Returns:
+        - Array of shape (rows, models, n_features)
+        """
+        if any(self.shap_table(index) is None for index in indices):
+            return np.stack([self.shap_values(X, index) for index in indices], axis=1)
+
+        features, lowers, uppers, table, leaf_rows, bins = self._shap_layout(indices)
+        width = len(indices) * self.n_features
+
+        # Compare the float32 inputs the way apply() does (float32 values are
+        # exact in float64, which avoids a mixed-type comparison)
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        phi = np.zeros((X.shape[0], width))
+        for start in range(0, X.shape[0], PREDICT_CHUNK_SIZE):
+            X_chunk = X[start:start + PREDICT_CHUNK_SIZE]
+            rows = X_chunk.shape[0]
+            x = X_chunk.take(features, axis=1)
+            ones = ((x > lowers) & (x <= uppers)).view(np.uint8)
+
+            # Bit j of a leaf's pattern is set when the row satisfies slot j
+            patterns = ones[:, 0].copy()
+            for j in range(1, len(features)):
+                patterns |= ones[:, j] << j
+            contributions = table.take((leaf_rows + patterns).ravel(), axis=0)
+
+            # Sum over leaves per model and feature, one bincount for the whole chunk
+            flat_bins = (bins[None, :, :] + (np.arange(rows) * width)[:, None, None]).ravel()
+            phi[start:start + rows] = np.bincount(
+                flat_bins, weights=contributions.ravel(), minlength=rows * width
+            ).reshape(rows, width)
+
+        phi = phi.reshape(X.shape[0], len(indices), self.n_features)
+        # The padding column never varies
+        phi[:, :, -1] = 0.0
+        return phi
+
+
+def _unwrap_model(model):
+    """
+    Return (regressor, applies expm1 inverse) for a supported model
+
+    Raises ValueError for models the engine cannot reproduce exactly.
+    """
+    inverse_expm1 = False
+    if isinstance(model, TransformedTargetRegressor):
+        transformer = model.transformer_
+        if getattr(transformer, 'inverse_func', None) is not np.expm1:
+            raise ValueError("only log1p/expm1 target transforms are supported")
+        model = model.regressor_
+        inverse_expm1 = True
+
+    if isinstance(model, GradientBoostingRegressor):
+        if model.init_ != 'zero' and not isinstance(model.init_, DummyRegressor):
+            raise ValueError(f"unsupported init estimator {type(model.init_).__name__}")
+    elif not isinstance(model, (RandomForestRegressor, ExtraTreesRegressor, LinearRegression)):
+        raise ValueError(f"unsupported regressor {type(model).__name__}")
+    if getattr(model, 'n_outputs_', 1) != 1 or np.ndim(getattr(model, 'coef_', 0)) > 1:
+        raise ValueError("only single-output models are supported")
+
+    return model, inverse_expm1
+
+
+def _model_components(regressor):
+    """Return (tree estimators, init, tree scale) of a supported regressor"""
+    if isinstance(regressor, GradientBoostingRegressor):
+        init = 0.0 if regressor.init_ == 'zero' else float(np.ravel(regressor.init_.constant_)[0])
+        return list(regressor.estimators_[:, 0]), init, regressor.learning_rate
+    if isinstance(regressor, LinearRegression):
+        return [], float(regressor.intercept_), 1.0
+    # Forests average their trees
+    return list(regressor.estimators_), 0.0, 1.0 / len(regressor.estimators_)
+
+
+def compile_models(models, feature_names):
+    """
+    Flatten all supported models into a TreeEnsembleEngine
+
+    Parameters:
+    - models: Dictionary mapping test parameters to trained models
+    - feature_names: Column order of the feature matrix the engine will receive;
+      one extra trailing column (always 0) is assumed for unknown features
+
+    Returns:
+    - (engine, skipped) where skipped maps test parameters to the reason they
+      were left to sklearn; engine is None if no model could be compiled
+    """
+    feature_index = {name: i for i, name in enumerate(feature_names)}
+    padding_col = len(feature_index)
+
+    test_params, skipped = [], {}
+    features, thresholds, lefts, rights, values, covers = [], [], [], [], [], []
+    tree_roots, model_tree_offsets = [], []
+    inits, tree_scales, linear_coefs, inverses = [], [], [], []
+    node_offset, max_depth = 0, 0
+
+    for test_param, model in models.items():
+        try:
+            regressor, inverse_expm1 = _unwrap_model(model)
+        except ValueError as e:
+            skipped[test_param] = str(e)
+            continue
+
+        # Map the model's own feature order onto the engine's column order
+        if hasattr(regressor, 'feature_names_in_'):
+            column_map = np.array([feature_index.get(f, padding_col) for f in regressor.feature_names_in_], dtype=np.intp)
+        else:
+            column_map = np.arange(regressor.n_features_in_, dtype=np.intp)
+
+        estimators, init, tree_scale = _model_components(regressor)
+
+        linear_coef = np.zeros(padding_col + 1)
+        if isinstance(regressor, LinearRegression):
+            np.add.at(linear_coef, column_map, np.ravel(regressor.coef_))
+            linear_coef[padding_col] = 0.0
+
+        test_params.append(test_param)
+        model_tree_offsets.append(len(tree_roots))
+        inits.append(init)
+        tree_scales.append(tree_scale)
+        linear_coefs.append(linear_coef)
+        inverses.append(inverse_expm1)
+
+        if not estimators:
+            # Models without trees get a single zero-valued leaf so every model
+            # owns at least one tree in the per-model sums
+            features.append(np.zeros(1))
+            thresholds.append(np.zeros(1))
+            lefts.append(np.array([node_offset]))
+            rights.append(np.array([node_offset]))
+            values.append(np.zeros(1))
+            covers.append(np.ones(1))
+            tree_roots.append(node_offset)
+            node_offset += 1
+            continue
+
+        for estimator in estimators:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count) + node_offset
+            is_leaf = tree.children_left == -1
+
+            # Leaves point back to themselves so traversal can run a fixed number of steps
+            features.append(np.where(is_leaf, 0, column_map[np.maximum(tree.feature, 0)]))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + node_offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + node_offset))
+            values.append(tree.value[:, 0, 0])
+            covers.append(tree.weighted_n_node_samples)
+
+            tree_roots.append(node_offset)
+            node_offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+    if not test_params:
+        return None, skipped
+
+    engine = TreeEnsembleEngine(
+        test_params=test_params,
+        feature=np.concatenate(features).astype(np.int32),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        children_left=np.concatenate(lefts).astype(np.int32),
+        children_right=np.concatenate(rights).astype(np.int32),
+        value=np.concatenate(values).astype(np.float64),
+        cover=np.concatenate(covers).astype(np.float64),
+        tree_roots=np.array(tree_roots, dtype=np.int32),
+        model_tree_offsets=np.array(model_tree_offsets, dtype=np.int32),
+        init=np.array(inits, dtype=np.float64),
+        tree_scale=np.array(tree_scales, dtype=np.float64),
+        linear_coef=np.array(linear_coefs, dtype=np.float64),
+        inverse_expm1=np.array(inverses, dtype=bool),
+        max_depth=max_depth,
+        n_features=padding_col + 1,
+        feature_names=feature_names,
+    )
+    return engine, skipped
+
+
+def verify_engine(engine, models, X, feature_orders, rtol=1e-7, atol=1e-9):
+    """
+    Compare engine predictions against model.predict on the rows of X
+
+    Returns:
+    - List of test parameters whose engine output is outside the tolerance
+    """
+    engine_preds = engine.predict(X)
+    mismatched = []
+    for j, test_param in enumerate(engine.test_params):
+        sklearn_preds = models[test_param].predict(X[:, feature_orders[test_param]])
+        if not np.allclose(engine_preds[:, j], sklearn_preds, rtol=rtol, atol=atol):
+            mismatched.append(test_param)
+    return mismatched
+
+
+class IncrementalState:
+    """
+    The leaf one feature row reaches in every tree, kept current as features change
+
+    When features change, only the trees containing a split whose outcome
+    flipped (the new value crossed its threshold) are walked again, and only
+    the models owning them are summed again. Each model is summed over its
+    stored leaves exactly as predict sums a full walk, so outputs are
+    identical to evaluating the row from scratch.
+    """
+
+    def __init__(self, engine, x):
+        self.engine = engine
+        # One row, including the engine's trailing padding column
+        self.x = np.zeros((1, engine.n_features))
+        x = np.asarray(x, dtype=np.float64).ravel()
+        self.x[0, :len(x)] = x
+        self.goes_right = engine.split_outcomes(self.x)
+        self.leaves = engine.walk(self.goes_right, engine.tree_roots)
+        self.raw = engine.raw_from_leaves(self.leaves, self.x)
+
+    def update(self, changes):
+        """
+        Set features and re-evaluate the trees and models they affect
+
+        Parameters:
+        - changes: Dictionary mapping feature columns to their new values
+
+        Returns:
+        - Number of trees walked again
+        """
+        changed = [feature for feature, value in changes.items() if self.x[0, feature] != value]
+        if not changed:
+            return 0
+        for feature in changed:
+            self.x[0, feature] = changes[feature]
+
+        engine = self.engine
+        splits = engine.feature_splits(changed)
+        outcomes = self.x[0, engine.split_feature[splits]].astype(np.float32) > engine.split_threshold[splits]
+        flipped = splits[outcomes != self.goes_right[0, splits]]
+        if not len(flipped) and not engine._has_linear:
+            # No leaf can change
+            return 0
+        self.goes_right[0, splits] = outcomes
+
+        trees = engine.split_trees(flipped)
+        if len(trees):
+            self.leaves[:, trees] = engine.walk(self.goes_right, engine.tree_roots[trees])
+
+        models = engine.affected_models(trees, changed)
+        if len(models):
+            model_trees = engine.model_trees(models)[0]
+            self.raw[:, models] = engine.raw_from_leaves(self.leaves[:, model_trees], self.x, models)
+        return len(trees)
+
+    def predict(self):
+        """Return the predictions of every model for the current row, shape (models,)"""
+        return self.engine.inverse_transform(self.raw.copy())[0]
+
+
+class EngineModel:
+    """sklearn-style predict() view of one model inside a TreeEnsembleEngine"""
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.feature_names_in_ = np.array(engine.feature_names, dtype=object)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        # Append the always-zero padding column the engine expects
+        X = np.hstack([X, np.zeros((X.shape[0], self.engine.n_features - X.shape[1]))])
+        return self.engine.predict(X, [self.index])[:, 0]
+
+
+def _align(offset):
+    """Round offset up to the bundle array alignment"""
+    return -(-offset // BUNDLE_ALIGNMENT) * BUNDLE_ALIGNMENT
+
+
+def save_bundle(engine, path, unbundled=None):
+    """
+    Write an engine to a single versioned, memory-mappable bundle file
+
+    Parameters:
+    - engine: TreeEnsembleEngine to serialize
+    - path: Destination file; written to a temporary file and renamed into place
+    - unbundled: Optional dictionary mapping test parameters that could not be
+      compiled to the joblib file that still holds them
+    """
+    arrays = {name: np.ascontiguousarray(getattr(engine, name), dtype=dtype)
+              for name, dtype in BUNDLE_ARRAYS.items()}
+
+    # Array offsets are relative to the data section, which starts at the
+    # first aligned offset after the manifest
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "test_params": engine.test_params,
+        "feature_names": engine.feature_names,
+        "max_depth": engine.max_depth,
+        "n_features": engine.n_features,
+        "unbundled": unbundled or {},
+        "arrays": layout,
+    }
+    manifest_bytes = json.dumps(manifest).encode("utf-8")
+    data_start = _align(len(BUNDLE_MAGIC) + 8 + len(manifest_bytes))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(len(manifest_bytes).to_bytes(8, "little"))
+        f.write(manifest_bytes)
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + layout[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_bundle(path):
+    """
+    Open a model bundle as a TreeEnsembleEngine backed by a read-only memory map
+
+    Several processes opening the same bundle share its physical pages.
+
+    Returns:
+    - (engine, manifest)
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(BUNDLE_MAGIC))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not a model bundle")
+        manifest_size = int.from_bytes(f.read(8), "little")
+        manifest = json.loads(f.read(manifest_size).decode("utf-8"))
+    data_start = _align(len(BUNDLE_MAGIC) + 8 + manifest_size)
+
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"unsupported bundle format version {manifest.get('format_version')} "
+            f"(expected {BUNDLE_FORMAT_VERSION})"
+        )
+
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]).reshape(spec["shape"])
+
+    engine = TreeEnsembleEngine(
+        test_params=manifest["test_params"],
+        max_depth=manifest["max_depth"],
+        n_features=manifest["n_features"],
+        feature_names=manifest["feature_names"],
+        **arrays,
+    )
+    return engine, manifest